@@ -0,0 +1,666 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+import config
+import metrics
+from fixture_server import LISTS_PATH, fixture_corpus, render_film_page, render_histogram, render_stats, start_fixture_server
+from html_parser import make_soup
+from html_archive import HtmlArchive
+from http_client import controlled_get, controller_for, make_session, reset_controllers
+from output_sink import STAR_COLUMNS, TABLES, ColumnBuffer, read_table, write_csv
+from reextract import reextract_movies
+from state_store import StateStore
+from refresh import refresh_movie_data
+from step1_list import list_url_extraction, parse_list_summary_page
+from step2_movie_list_playwright import extract_movie_urls_from_list, parse_list_page
+from movie_extractor import extract_into, extract_movie
+from step3_movie_data_playwright import ORDERS, apply_fragments, extract_movie_data, list_weights, parse_movie_page
+from step4 import merge_outputs
+
+BASE_URL = "https://letterboxd.com"
+GOLDEN_MOVIE_ROWS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "movie_rows.json")
+
+# (name, old, new) edits that give fixture film pages the gaps real pages have.
+FILM_PAGE_VARIANTS = [
+    ("no-tabs", 'id="tabbed-content"', 'id="tabbed-content-x"'),
+    ("no-releases", 'id="tab-releases"', 'id="tab-releases-x"'),
+    ("no-histogram", 'class="rating-histogram"', 'class="rating-chart"'),
+    ("no-fans", "&nbsp;fans", "&nbsp;reviews"),
+    ("no-footer", 'class="text-link text-footer"', 'class="text-link"'),
+    ("no-stats", "production-statistic", "production-stat"),
+]
+
+
+def bench_step1(args):
+    server, base_url = start_fixture_server(
+        latency=args.latency, total_pages=args.pages, lists_per_page=12
+    )
+    # Archived list pages would be served without a fetch on every run after the first.
+    config.HTML_ARCHIVE_ENABLED = False
+    try:
+        print(f"{'concurrency':>11} | {'pages':>5} | {'seconds':>7} | {'pages/sec':>9}")
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory() as tmp:
+                output_file = os.path.join(tmp, "lists.csv")
+                state_db = os.path.join(tmp, "state.sqlite3")
+                reset_controllers()
+                controller_for(base_url, rate=args.rate, concurrency=concurrency)
+                start = time.perf_counter()
+                list_url_extraction(
+                    output_file, state_db, fetch_mode="async",
+                    concurrency=concurrency,
+                    base_url=base_url, start_url=base_url + LISTS_PATH
+                )
+                elapsed = time.perf_counter() - start
+            pages = min(args.pages, -(-500 // 12))
+            print(f"{concurrency:>11} | {pages:>5} | {elapsed:>7.2f} | {pages / elapsed:>9.1f}")
+    finally:
+        server.shutdown()
+
+
+def load_corpus(corpus_dir):
+    """Read (kind, url_path, html) from <corpus_dir>/<kind>/*.html; kind is lists, list or film."""
+    pages = []
+    for kind in ["lists", "list", "film"]:
+        kind_dir = os.path.join(corpus_dir, kind)
+        if not os.path.isdir(kind_dir):
+            continue
+        for name in sorted(os.listdir(kind_dir)):
+            with open(os.path.join(kind_dir, name), encoding="utf-8") as f:
+                pages.append((kind, f"/{kind}/{name}/", f.read()))
+    return pages
+
+
+def parse_page(kind, path, html, logger):
+    url = BASE_URL + path
+    if kind == "lists":
+        return parse_list_summary_page(html, url, BASE_URL)
+    if kind == "list":
+        return parse_list_page(html, url, BASE_URL)
+    return parse_movie_page(html, url, logger)
+
+
+def bench_parsers(args):
+    pages = load_corpus(args.corpus) if args.corpus else fixture_corpus(films=args.films)
+    logger = logging.getLogger("benchmark")
+    logger.disabled = True
+    baseline = None
+    print(f"{'backend':>12} | {'pages':>5} | {'pages/sec':>9} | {'peak MiB':>8} | identical")
+    for backend in args.backends:
+        config.HTML_PARSER = backend
+        tracemalloc.start()
+        start = time.perf_counter()
+        results = [parse_page(kind, path, html, logger) for kind, path, html in pages]
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if baseline is None:
+            baseline = results
+        identical = "yes" if results == baseline else "NO"
+        print(f"{backend:>12} | {len(pages):>5} | {len(pages) / elapsed:>9.1f} | {peak / 2**20:>8.1f} | {identical}")
+
+
+def golden_movie_pages(films, corpus=None):
+    """
+    (url, page html, fragment html by name) for the extractor golden test:
+    fixture films, every third with its ratings/stats fragments, plus each
+    FILM_PAGE_VARIANTS edit; or the film/ pages of a saved corpus.
+    """
+    if corpus:
+        return [(BASE_URL + path, html, {}) for kind, path, html in load_corpus(corpus) if kind == "film"]
+    pages = []
+    for f in range(films):
+        fragments = {"ratings": render_histogram(f), "stats": render_stats(f)} if f % 3 == 0 else {}
+        pages.append((f"{BASE_URL}/film/fixture-film-{f}/", render_film_page(f), fragments))
+    for i, (name, old, new) in enumerate(FILM_PAGE_VARIANTS):
+        for f in range(i, films, 10):
+            fragments = {"ratings": render_histogram(f), "stats": render_stats(f)} if f % 2 == 0 else {}
+            pages.append((f"{BASE_URL}/film/fixture-film-{f}/?{name}", render_film_page(f).replace(old, new), fragments))
+    return pages
+
+
+def bench_extract(args):
+    pages = golden_movie_pages(args.films, args.corpus)
+    logger = logging.getLogger("benchmark")
+    logger.disabled = True
+    if args.write_golden:
+        rows = []
+        for url, html, fragments in pages:
+            row = parse_movie_page(html, url, logger)
+            apply_fragments(fragments, row)
+            rows.append(row)
+        os.makedirs(os.path.dirname(args.golden) or ".", exist_ok=True)
+        with open(args.golden, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1, ensure_ascii=False)
+        print(f"Wrote {len(rows)} golden rows to {args.golden}")
+        return
+
+    soups = [(url, make_soup(html), {name: make_soup(h) for name, h in fragments.items()})
+             for url, html, fragments in pages]
+    start = time.process_time()
+    for _ in range(args.repeat):
+        rows = []
+        for url, soup, fragments in soups:
+            row = extract_movie(soup, url, logger)
+            for fragment in fragments.values():
+                extract_into(fragment, row)
+            rows.append(row)
+    elapsed = time.process_time() - start
+    with open(args.golden, encoding="utf-8") as f:
+        golden = json.load(f)
+    # Column order matters too: it is the CSV header order.
+    mismatched = [(row, expected) for row, expected in zip(rows, golden) if list(row.items()) != list(expected.items())]
+    per_page = elapsed / (args.repeat * len(soups))
+    print(f"{len(soups)} pages x {args.repeat}: {per_page * 1e6:.0f} us CPU per page (extraction only, parse excluded)")
+    if len(rows) != len(golden) or mismatched:
+        print(f"Golden mismatch: {len(mismatched)} of {len(rows)} rows differ ({len(golden)} golden rows)")
+        for row, expected in mismatched[:3]:
+            print(f"  {row['movie_url']}: " + ", ".join(
+                f"{k}={row.get(k)!r} (golden {v!r})" for k, v in expected.items() if row.get(k) != v
+            ) or "column order differs")
+        sys.exit(1)
+    print(f"All {len(rows)} rows match {args.golden}")
+
+
+def bench_reextract(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        archive_dir = os.path.join(tmp, "archive")
+        archive = HtmlArchive(archive_dir, max_bytes=float("inf"))
+        for f in range(args.films):
+            archive.put(f"{BASE_URL}/film/fixture-film-{f}/", render_film_page(f))
+        archive.close()
+        print(f"{'workers':>7} | {'films':>6} | {'seconds':>7} | {'films/sec':>9}")
+        for workers in args.workers:
+            output_file = os.path.join(tmp, f"movies_{workers}.csv")
+            start = time.perf_counter()
+            count = reextract_movies(archive_dir, output_file, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers:>7} | {count:>6} | {elapsed:>7.2f} | {count / elapsed:>9.1f}")
+
+
+def write_merge_inputs(tmp, lists, films, edges):
+    """Synthetic Step 1-3 outputs: `edges` list-movie rows over `lists` lists and `films` movies."""
+    rng = random.Random(0)
+    list_urls = [f"{BASE_URL}/user{n}/list/fixture-list-{n}/" for n in range(lists)]
+    movie_urls = [f"{BASE_URL}/film/fixture-film-{f}/" for f in range(films)]
+    pd.DataFrame({
+        "page_url": f"{BASE_URL}/lists/popular/this/week/", "list_url": list_urls,
+        "list_name": [f"Fixture list {n}" for n in range(lists)], "owner_name": "user",
+        "film_count": edges // lists, "like_count": 1200.0, "comment_count": 12.0,
+    }).to_csv(os.path.join(tmp, "lists.csv"), index=False)
+    movies = {name: [f"{name} {f}" for f in range(films)] for name, _, _ in TABLES["movie_data"]}
+    movies["movie_url"] = movie_urls
+    for name in ["release_year", "duration", "fans_count"] + STAR_COLUMNS:
+        movies[name] = [rng.randint(1, 5000) for _ in range(films)]
+    movies["genres"] = [rng.choice(["Drama", "Comedy", "Horror"]) for _ in range(films)]
+    pd.DataFrame(movies).to_csv(os.path.join(tmp, "movies.csv"), index=False)
+    edges_file = os.path.join(tmp, "edges.csv")
+    for start in range(0, edges, 100_000):
+        n = min(100_000, edges - start)
+        pd.DataFrame({
+            "list_url": [list_urls[(start + i) % lists] for i in range(n)],
+            "movie_url": [movie_urls[rng.randrange(films)] for _ in range(n)],
+            "tags": "fixture,tags",
+        }).to_csv(edges_file, mode="a", header=start == 0, index=False)
+    return os.path.join(tmp, "lists.csv"), edges_file, os.path.join(tmp, "movies.csv")
+
+
+def bench_merge(args):
+    print(f"{'edges':>9} | {'seconds':>7} | {'rows/sec':>9} | {'peak MiB':>8} | budget MiB")
+    for edges in args.edges:
+        with tempfile.TemporaryDirectory() as tmp:
+            list_file, edges_file, movie_file = write_merge_inputs(tmp, args.lists, args.films, edges)
+            output_file = os.path.join(tmp, "final" + (".parquet" if args.parquet else ".csv"))
+            tracemalloc.start()
+            start = time.perf_counter()
+            merge_outputs(list_file, edges_file, movie_file, output_file, memory_budget_mb=args.budget)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{edges:>9} | {elapsed:>7.2f} | {edges / elapsed:>9.0f} | {peak / 2**20:>8.1f} | {args.budget}")
+
+
+def bench_refresh(args):
+    server, base_url = start_fixture_server(total_films=args.films)
+    logger = logging.getLogger("benchmark")
+    logger.disabled = True
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config.HTML_ARCHIVE_DIR = os.path.join(tmp, "archive")
+            movie_file = os.path.join(tmp, "movies.csv")
+            state_db = os.path.join(tmp, "state.sqlite3")
+            rows = [parse_movie_page(render_film_page(f), f"{base_url}/film/fixture-film-{f}/", logger)
+                    for f in range(args.films)]
+            pd.DataFrame(rows).to_csv(movie_file, index=False)
+            print(f"{'run':>14} | {'films':>5} | {'changed':>7} | {'seconds':>7}")
+            reset_controllers()
+            for label, changed_share in [("first check", None), ("nothing new", 0.0)] + [
+                (f"{share:.0%} changed", share) for share in args.changed
+            ]:
+                if changed_share:
+                    for f in range(int(args.films * changed_share)):
+                        path = f"/csi/film/fixture-film-{f}/stats/"
+                        server.revisions[path] = server.revisions.get(path, 0) + 1
+                start = time.perf_counter()
+                changed = refresh_movie_data(movie_file, state_db, limit=args.films, min_age_hours=0,
+                                             workers=args.workers, rate_per_host=1000.0)
+                elapsed = time.perf_counter() - start
+                print(f"{label:>14} | {args.films:>5} | {changed:>7} | {elapsed:>7.2f}")
+    finally:
+        server.shutdown()
+
+
+def bench_aimd(args):
+    """Hammer a throttling fixture with the shared rate controller and show it settle."""
+    server, base_url = start_fixture_server(
+        latency=args.latency, total_films=args.films, max_rate=args.server_rate, challenge=args.challenge
+    )
+    config.HTML_ARCHIVE_ENABLED = False
+    reset_controllers()
+    controller = controller_for(base_url, rate=args.rate, concurrency=args.concurrency)
+    session = make_session(pool_size=controller.max_concurrency)
+    stop = time.monotonic() + args.seconds
+    fetched = [0]
+
+    def worker(n):
+        while time.monotonic() < stop:
+            url = f"{base_url}/film/fixture-film-{random.randrange(args.films)}/"
+            try:
+                controlled_get(session, url, timeout=10)
+                fetched[0] += 1
+            except Exception:
+                time.sleep(controller.pause())
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(controller.max_concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        print(f"{'second':>6} | {'pages/sec':>9} | {'rejected':>8} | {'rate':>6} | {'concurrency':>11} | {'backoff':>7}")
+        last_fetched, last_throttled = 0, 0
+        for second in range(1, int(args.seconds) + 1):
+            time.sleep(1)
+            snap = controller.snapshot()
+            print(f"{second:>6} | {fetched[0] - last_fetched:>9} | {server.throttled - last_throttled:>8} | "
+                  f"{snap['rate']:>6.2f} | {snap['concurrency']:>11} | {snap['backoff_remaining']:>7.2f}")
+            last_fetched, last_throttled = fetched[0], server.throttled
+        for thread in threads:
+            thread.join()
+        print(f"Fetched {fetched[0]} pages in {args.seconds:.0f}s ({fetched[0] / args.seconds:.1f}/s) against a "
+              f"{args.server_rate} req/s limit; {server.throttled} requests rejected; final {controller.snapshot()}")
+    finally:
+        server.shutdown()
+
+
+def peak_rss_mib():
+    """Peak resident set of this process and of its finished children (the browser), in MiB."""
+    unit = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20)
+
+
+def current_rss_mib():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mib()[0]
+
+
+def fresh(value):
+    """A new object equal to `value`, as each parsed page yields (parsers never share strings between rows)."""
+    return (value + " ")[:-1] if isinstance(value, str) else value
+
+
+def buffer_rows(table, rows, layout, path, queue):
+    """
+    Child process of bench_buffers: buffer `rows` rows of `table` the old way
+    (a dict per row, DataFrame at flush) or in a ColumnBuffer, then flush to
+    `path`. Reports MiB held while buffered, peak MiB over start and flush seconds.
+    """
+    start_rss = current_rss_mib()
+    if table == "movie_list":
+        buffer = [] if layout == "dicts" else ColumnBuffer(table)
+        for page in range(rows // 100):
+            list_url = fresh(f"{BASE_URL}/user{page // 10}/list/fixture-list-{page // 10}/")
+            tags = ",".join(["tag", str(page // 10 % 5), "fixture"])
+            movie_urls = [f"{BASE_URL}/film/fixture-film-{page * 100 + i}/" for i in range(100)]
+            if layout == "dicts":
+                row = {'list_url': list_url, 'movie_url': None, 'tags': tags}
+                for movie_url in movie_urls:
+                    row['movie_url'] = movie_url
+                    buffer.append(row.copy())
+            else:
+                buffer.extend_column("movie_url", movie_urls, list_url=list_url, tags=tags)
+    else:
+        logger = logging.getLogger("benchmark")
+        logger.disabled = True
+        templates = [parse_movie_page(render_film_page(f), f"{BASE_URL}/film/fixture-film-{f}/", logger)
+                     for f in range(50)]
+        buffer = [] if layout == "dicts" else ColumnBuffer(table)
+        for n in range(rows):
+            buffer.append({key: fresh(value) for key, value in templates[n % 50].items()})
+    held = current_rss_mib() - start_rss
+    started = time.perf_counter()
+    if layout == "dicts":
+        pd.DataFrame(buffer).to_csv(path, index=False)
+    else:
+        write_csv(buffer, path)
+    flush = time.perf_counter() - started
+    queue.put((held, peak_rss_mib()[0] - start_rss, flush))
+
+
+def run_in_child(target, *args):
+    """Run target(*args, queue) in a fresh interpreter, so its peak RSS is its own; returns what it put."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    child = ctx.Process(target=target, args=(*args, queue))
+    child.start()
+    child.join()
+    if child.exitcode:
+        raise RuntimeError(f"{target.__name__} failed with exit code {child.exitcode}")
+    return queue.get()
+
+
+def bench_buffers(args):
+    """Memory of 100k buffered rows: dict rows + DataFrame flush against ColumnBuffer + csv writer."""
+    print(f"{'table':>10} | {'layout':>7} | {'rows':>7} | {'held MiB':>8} | {'peak MiB':>8} | "
+          f"{'per 100k':>8} | flush s")
+    with tempfile.TemporaryDirectory() as tmp:
+        for table in ["movie_list", "movie_data"]:
+            for layout in ["dicts", "columns"]:
+                path = os.path.join(tmp, f"{table}-{layout}.csv")
+                held, peak, flush = run_in_child(buffer_rows, table, args.rows, layout, path)
+                print(f"{table:>10} | {layout:>7} | {args.rows:>7} | {held:>8.1f} | {peak:>8.1f} | "
+                      f"{peak * 100_000 / args.rows:>8.1f} | {flush:>7.2f}")
+
+
+def write_edges(path, start, edges, films):
+    """Append `edges` list-movie rows (row numbers from `start`) drawing on `films` distinct movies."""
+    buffer = ColumnBuffer("movie_list")
+    for page in range(start // 100, (start + edges) // 100):
+        movie_urls = [f"{BASE_URL}/film/fixture-film-{(page * 100 + i) * 7919 % films}/" for i in range(100)]
+        buffer.extend_column("movie_url", movie_urls, list_url=f"{BASE_URL}/user{page}/list/fixture-list-{page}/")
+        if len(buffer) >= 100_000:
+            write_csv(buffer, path)
+            buffer.clear()
+    write_csv(buffer, path)
+
+
+def resume_startup(mode, edges_file, state_db, queue):
+    """Child process of bench_resume: Step 3's startup registration of the edge file's movies."""
+    start_rss = current_rss_mib()
+    started = time.perf_counter()
+    store = StateStore(state_db)
+    if mode == "full":
+        store.add_urls("step3", read_table(edges_file, ["movie_url"])["movie_url"].unique().tolist())
+    else:
+        store.ingest("step3", edges_file, "movie_url")
+    store.recover("step3")
+    known = store.count("step3")
+    store.close()
+    queue.put((time.perf_counter() - started, peak_rss_mib()[0] - start_rss, known))
+
+
+def bench_resume(args):
+    """Startup cost of Step 3 on a fresh state store and after 1% more edges, by edge count."""
+    print(f"{'edges':>9} | {'mode':>6} | {'movies':>8} | {'first s':>7} | {'first MiB':>9} | "
+          f"{'resume s':>8} | {'resume MiB':>10}")
+    for edges in args.edges:
+        films = edges // 4
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in ["full", "ingest"]:
+                edges_file = os.path.join(tmp, f"edges-{mode}.csv")
+                state_db = os.path.join(tmp, f"state-{mode}.sqlite3")
+                write_edges(edges_file, 0, edges, films)
+                first, first_peak, _ = run_in_child(resume_startup, mode, edges_file, state_db)
+                write_edges(edges_file, edges, max(edges // 100, 100), films * 2)
+                resume, resume_peak, known = run_in_child(resume_startup, mode, edges_file, state_db)
+                print(f"{edges:>9} | {mode:>6} | {known:>8} | {first:>7.2f} | {first_peak:>9.1f} | "
+                      f"{resume:>8.2f} | {resume_peak:>10.1f}")
+
+
+def write_skewed_edges(edges_file, lists_file, lists, films, seed=0):
+    """
+    `lists` lists of 100 films each, drawn with Zipf-like popularity (film k
+    weighs 1/k) and in random order, plus a lists file with their like counts.
+    """
+    rng = random.Random(seed)
+    order = list(range(films))
+    rng.shuffle(order)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(films)))
+    buffer = ColumnBuffer("movie_list")
+    for n in range(lists):
+        picks = rng.choices(order, cum_weights=cum_weights, k=100)
+        buffer.extend_column("movie_url", [f"{BASE_URL}/film/fixture-film-{f}/" for f in picks],
+                             list_url=f"{BASE_URL}/user{n}/list/fixture-list-{n}/")
+    write_csv(buffer, edges_file)
+    pd.DataFrame({
+        "list_url": [f"{BASE_URL}/user{n}/list/fixture-list-{n}/" for n in range(lists)],
+        "like_count": [int(rng.lognormvariate(3, 2)) for _ in range(lists)],
+    }).to_csv(lists_file, index=False)
+
+
+def bench_order(args):
+    """Share of list-movie edges with movie data after a cut-short Step 3, by scrape order."""
+    with tempfile.TemporaryDirectory() as tmp:
+        edges_file, lists_file = os.path.join(tmp, "edges.csv"), os.path.join(tmp, "lists.csv")
+        write_skewed_edges(edges_file, lists_file, args.lists, args.films)
+        edges = read_table(edges_file, ["list_url", "movie_url"])
+        weights = list_weights(lists_file)
+        refs = edges["movie_url"].value_counts()
+        liked = edges.assign(weight=edges["list_url"].map(weights)).groupby("movie_url")["weight"].sum()
+        films = len(refs)
+        print(f"{len(edges)} edges over {films} films")
+        header = " | ".join(f"{budget:>6.0%} edges / liked" for budget in args.budget)
+        print(f"{'order':>10} | {'ingest s':>8} | {header}")
+        for order in ORDERS:
+            store = StateStore(os.path.join(tmp, f"state-{order}.sqlite3"))
+            started = time.perf_counter()
+            if order == "input":
+                store.ingest("step3", edges_file, "movie_url")
+            else:
+                store.ingest("step3", edges_file, "movie_url", referrer="list_url",
+                             weights=weights if order == "likes" else None)
+            ingest_seconds = time.perf_counter() - started
+            scraped = []
+            while len(scraped) < films * max(args.budget):
+                batch = store.claim("step3", 100, by_priority=order != "input")
+                store.mark_done("step3", batch)
+                scraped.extend(batch)
+            store.close()
+            cells = []
+            for budget in args.budget:
+                done = scraped[:int(films * budget)]
+                cells.append(f"{refs[done].sum() / refs.sum():>12.1%} / {liked[done].sum() / liked.sum():>5.1%}")
+            print(f"{order:>10} | {ingest_seconds:>8.2f} | {' | '.join(cells)}")
+
+
+def bench_e2e(args):
+    """Steps 1-3 end to end against the fixture server: throughput, latency percentiles, peak RSS."""
+    server, base_url = start_fixture_server(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        total_pages=-(-args.lists // 12), lists_per_page=12, total_films=args.films, list_size=args.list_size
+    )
+    cwd = os.getcwd()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # The steps keep their browser profile and logs relative to the working directory.
+            os.chdir(tmp)
+            os.makedirs("logs")
+            config.HTML_ARCHIVE_DIR = os.path.join(tmp, "archive")
+            reset_controllers()
+            controller_for(base_url, rate=args.rate, concurrency=args.concurrency)
+            lists, movie_list, movie_data = (os.path.join(tmp, name) for name in
+                                             ("lists.csv", "movie_list.csv", "movie_data.csv"))
+            state_db = os.path.join(tmp, "state.sqlite3")
+            steps = [
+                ("step1", lists, "list_url", lambda: list_url_extraction(
+                    lists, state_db, fetch_mode="async", concurrency=args.concurrency,
+                    base_url=base_url, start_url=base_url + LISTS_PATH)),
+                ("step2", movie_list, "movie_url", lambda: extract_movie_urls_from_list(
+                    lists, movie_list, state_db, block_resources=True, login=False,
+                    base_url=base_url, headless=True, workers=args.list_pages)),
+                ("step3", movie_data, "movie_url", lambda: extract_movie_data(
+                    movie_list, movie_data, state_db, workers=args.workers, fetch_mode=args.fetch_mode,
+                    block_resources=True, login=False, base_url=base_url, headless=True,
+                    order=args.order, lists_file=lists)),
+            ]
+            for step, output, column, run in steps:
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                rows = len(pd.read_csv(output, usecols=[column])) if os.path.exists(output) else 0
+                stats = metrics.snapshot()["steps"].get(step, {"stages": {}, "counters": {}})
+                stages = stats["stages"]
+                latency = stages.get("fetch") or stages.get("navigate") or {}
+                results[step] = {
+                    "seconds": round(elapsed, 3),
+                    "rows": rows,
+                    "rows_per_second": round(rows / elapsed, 2),
+                    "pages": stats["counters"].get("ok", 0),
+                    "failed": stats["counters"].get("failed", 0),
+                    "latency": {q: latency.get(q) for q in ("p50", "p90", "p99")},
+                    "stages": {stage: data["sum"] for stage, data in stages.items()},
+                }
+        self_rss, child_rss = peak_rss_mib()
+        results["peak_rss_mib"] = {"python": round(self_rss, 1), "browser": round(child_rss, 1)}
+        results["server"] = {"errors": server.errors, "throttled": server.throttled}
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+    print(f"{'step':>5} | {'seconds':>7} | {'rows':>6} | {'rows/sec':>8} | {'pages':>5} | {'failed':>6} | "
+          f"{'p50':>6} | {'p90':>6} | {'p99':>6}")
+    for step in ("step1", "step2", "step3"):
+        r = results[step]
+        p = {q: f"{v:.3f}" if v is not None else "-" for q, v in r["latency"].items()}
+        print(f"{step:>5} | {r['seconds']:>7.2f} | {r['rows']:>6} | {r['rows_per_second']:>8.1f} | {r['pages']:>5} | "
+              f"{r['failed']:>6} | {p['p50']:>6} | {p['p90']:>6} | {p['p99']:>6}")
+    print(f"Peak RSS: {results['peak_rss_mib']['python']} MiB Python, {results['peak_rss_mib']['browser']} MiB browser; "
+          f"server injected {results['server']['errors']} errors")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressed = []
+        for step in ("step1", "step2", "step3"):
+            before, after = baseline[step]["rows_per_second"], results[step]["rows_per_second"]
+            change = (after - before) / before if before else 0.0
+            print(f"{step}: {before:.1f} -> {after:.1f} rows/sec ({change:+.0%})")
+            if change < -args.tolerance:
+                regressed.append(step)
+        if regressed:
+            print(f"Throughput regressed by more than {args.tolerance:.0%} in: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a local fixture server")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    step1 = sub.add_parser("step1", help="Step 1 async list crawler throughput by concurrency")
+    step1.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    step1.add_argument("--latency", type=float, default=0.2, help="Per-request server latency in seconds")
+    step1.add_argument("--pages", type=int, default=42)
+    step1.add_argument("--rate", type=float, default=1000.0, help="Starting requests/sec of the rate controller")
+    step1.set_defaults(func=bench_step1)
+
+    parsers = sub.add_parser("parsers", help="Parse a fixture corpus with each HTML parser backend")
+    parsers.add_argument("--backends", nargs="+", default=["html.parser", "lxml"])
+    parsers.add_argument("--corpus", help="Directory with lists/, list/ and film/ *.html pages (default: generated)")
+    parsers.add_argument("--films", type=int, default=200)
+    parsers.set_defaults(func=bench_parsers)
+
+    extract = sub.add_parser("extract", help="Movie field extraction CPU per page, checked against golden rows")
+    extract.add_argument("--films", type=int, default=60)
+    extract.add_argument("--corpus", help="Use the film/ pages of this corpus instead of fixture pages")
+    extract.add_argument("--golden", default=GOLDEN_MOVIE_ROWS, help="Golden rows JSON file")
+    extract.add_argument("--write-golden", action="store_true",
+                         help="Write the current parser's rows to --golden instead of comparing")
+    extract.add_argument("--repeat", type=int, default=20)
+    extract.set_defaults(func=bench_extract)
+
+    reextract = sub.add_parser("reextract", help="Offline re-extraction throughput by worker count")
+    reextract.add_argument("--workers", type=int, nargs="+", default=[1, 4, os.cpu_count()])
+    reextract.add_argument("--films", type=int, default=2000)
+    reextract.set_defaults(func=bench_reextract)
+
+    merge = sub.add_parser("merge", help="Step 4 chunked merge: time and peak memory by edge count")
+    merge.add_argument("--edges", type=int, nargs="+", default=[50_000, 200_000, 800_000])
+    merge.add_argument("--lists", type=int, default=500)
+    merge.add_argument("--films", type=int, default=20_000)
+    merge.add_argument("--budget", type=int, default=64, help="Merge memory budget in MiB")
+    merge.add_argument("--parquet", action="store_true", help="Write the merged output as parquet")
+    merge.set_defaults(func=bench_merge)
+
+    refresh = sub.add_parser("refresh", help="Conditional re-crawl cost by share of changed films")
+    refresh.add_argument("--films", type=int, default=200)
+    refresh.add_argument("--changed", type=float, nargs="+", default=[0.05, 0.5])
+    refresh.add_argument("--workers", type=int, default=8)
+    refresh.set_defaults(func=bench_refresh)
+
+    aimd = sub.add_parser("aimd", help="Adaptive rate controller against a fixture that throttles")
+    aimd.add_argument("--server-rate", type=int, default=20, help="Requests per second the fixture accepts")
+    aimd.add_argument("--challenge", action="store_true", help="Answer over-limit requests with a challenge page")
+    aimd.add_argument("--rate", type=float, default=config.AIMD_START_RATE)
+    aimd.add_argument("--concurrency", type=int, default=config.AIMD_START_CONCURRENCY)
+    aimd.add_argument("--latency", type=float, default=0.05)
+    aimd.add_argument("--films", type=int, default=500)
+    aimd.add_argument("--seconds", type=float, default=30)
+    aimd.set_defaults(func=bench_aimd)
+
+    buffers = sub.add_parser("buffers", help="Peak RSS of buffered rows: dicts vs column buffers")
+    buffers.add_argument("--rows", type=int, default=100_000)
+    buffers.set_defaults(func=bench_buffers)
+
+    resume = sub.add_parser("resume", help="Step 3 startup: re-reading the edge file vs incremental ingest")
+    resume.add_argument("--edges", type=int, nargs="+", default=[200_000, 1_000_000, 4_000_000])
+    resume.set_defaults(func=bench_resume)
+
+    order = sub.add_parser("order", help="Step 3 edge coverage of a cut-short run, by scrape order")
+    order.add_argument("--lists", type=int, default=2000, help="Lists of 100 films each")
+    order.add_argument("--films", type=int, default=20000, help="Distinct films the lists draw from")
+    order.add_argument("--budget", type=float, nargs="+", default=[0.05, 0.1, 0.25, 0.5],
+                       help="Shares of the films scraped before the run is cut short")
+    order.set_defaults(func=bench_order)
+
+    e2e = sub.add_parser("e2e", help="Steps 1-3 end to end against the fixture server")
+    e2e.add_argument("--lists", type=int, default=24, help="Lists on the popular pages (12 per page)")
+    e2e.add_argument("--list-size", type=int, default=100, help="Films in list 0; list n has n more")
+    e2e.add_argument("--films", type=int, default=300, help="Distinct films the lists draw from")
+    e2e.add_argument("--latency", type=float, default=0.05)
+    e2e.add_argument("--jitter", type=float, default=0.05, help="Extra random latency, up to this many seconds")
+    e2e.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+    e2e.add_argument("--rate", type=float, default=1000.0, help="Starting requests/sec of the rate controller")
+    e2e.add_argument("--concurrency", type=int, default=8)
+    e2e.add_argument("--list-pages", type=int, default=4, help="Step 2 list pages at once")
+    e2e.add_argument("--workers", type=int, default=4, help="Step 3 pages at once")
+    e2e.add_argument("--fetch-mode", choices=["browser", "hybrid"], default="hybrid")
+    e2e.add_argument("--order", choices=ORDERS, default="input", help="Step 3 scrape order")
+    e2e.add_argument("--json", help="Write the results to this file")
+    e2e.add_argument("--baseline", help="Compare with a results file from --json; exit 1 on a regression")
+    e2e.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop against --baseline")
+    e2e.set_defaults(func=bench_e2e)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+
+from playwright.sync_api import sync_playwright
+
+import config
+import metrics
+
+LAUNCH_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--no-sandbox",
+    "--disable-infobars"
+]
+
+CONTEXT_OPTIONS = dict(
+    viewport={"width": 1366, "height": 768},
+    locale="en-US",
+    timezone_id="Asia/Kolkata",
+)
+
+STEALTH_SCRIPT = """
+Object.defineProperty(navigator, 'webdriver', {
+    get: () => undefined
+});
+"""
+
+
+def headless_default(headless):
+    return config.HEADLESS if headless is None else headless
+
+
+def context_options():
+    """New-context options, logged in from STORAGE_STATE when login.py has saved one."""
+    options = dict(CONTEXT_OPTIONS)
+    if os.path.exists(config.STORAGE_STATE):
+        options["storage_state"] = config.STORAGE_STATE
+    return options
+
+
+class BrowserSession:
+    """
+    One Chromium process (sync API) that steps open their contexts in, so
+    Step 2 and Step 3 run by step4 pay for a single launch. The browser is
+    launched on the first new_context() call.
+    """
+
+    def __init__(self, headless=None):
+        self.headless = headless_default(headless)
+        self._playwright = None
+        self._browser = None
+
+    def new_context(self):
+        if self._browser is None:
+            started = time.perf_counter()
+            self._playwright = sync_playwright().start()
+            self._browser = self._playwright.chromium.launch(headless=self.headless, args=LAUNCH_ARGS)
+            metrics.observe("browser", "launch", time.perf_counter() - started)
+        context = self._browser.new_context(**context_options())
+        context.add_init_script(STEALTH_SCRIPT)
+        return context
+
+    def close(self):
+        if self._browser is not None:
+            self._browser.close()
+            self._playwright.stop()
+            self._browser = self._playwright = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def new_context_async(playwright, headless=None):
+    """Launch a browser with the async API and open a logged-in context; returns (browser, context)."""
+    started = time.perf_counter()
+    browser = await playwright.chromium.launch(headless=headless_default(headless), args=LAUNCH_ARGS)
+    metrics.observe("browser", "launch", time.perf_counter() - started)
+    context = await browser.new_context(**context_options())
+    await context.add_init_script(STEALTH_SCRIPT)
+    return browser, context
+
+
+class ColdStart:
+    """Reports, once, how long a step took from its start to its first loaded page."""
+
+    def __init__(self, step):
+        self.step = step
+        self.started = time.perf_counter()
+        self.reported = False
+
+    def page_loaded(self):
+        if self.reported:
+            return
+        self.reported = True
+        elapsed = time.perf_counter() - self.started
+        metrics.observe(self.step, "cold_start", elapsed)
+        message = f"{self.step}: first page loaded {elapsed:.2f}s after start"
+        print(message)
+        logging.getLogger(self.step).info(message)
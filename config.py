@@ -3,10 +3,116 @@ LISTS_URL_CSV=f'{BASE_DIR}/letterboxd_lists_urls.csv'
 MOVIE_LIST_CSV=f'{BASE_DIR}/letterboxd_movie_list_urls.csv'
 MOVIE_DATA_CSV=f'{BASE_DIR}/letterboxd_movie_data.csv'
 
-CHECKPOINT_LIST = f"{BASE_DIR}/checkpoint_list.txt"
-CHECKPOINT_MOVIE_URL = f"{BASE_DIR}/checkpoint_movie_url.txt"
-CHECKPOINT_MOVIE_DATA = f"{BASE_DIR}/checkpoint_movie_data.txt"
+# Per-URL crawl state (pending / in_flight / done / failed) for all steps
+STATE_DB = f"{BASE_DIR}/state.sqlite3"
 
 LOG_DIR = "logs"
 
-FINAL_OUTPUT_CSV = f"{BASE_DIR}/letterboxd_final_output.csv"
\ No newline at end of file
+FINAL_OUTPUT_CSV = f"{BASE_DIR}/letterboxd_final_output.csv"
+# Step 4 merge: memory budget for the lookup tables plus one chunk of list-movie edges
+MERGE_MEMORY_BUDGET_MB = 512
+# "incremental" appends only new edges (and edges whose movie was scraped since) to the final CSV;
+# edges whose movie is not scraped yet are held back. "full" rebuilds with empty movie columns
+# for unscraped movies. `python step4.py --merge rebuild` restarts the incremental history.
+MERGE_MODE = "incremental"
+MERGE_STATE = f"{BASE_DIR}/merge_state.json"
+
+# Step 1 fetch mode: "sync" (one page at a time) or "async" (pooled, concurrent)
+STEP1_FETCH_MODE = "sync"
+STEP1_CONCURRENCY = 4  # async mode: most list pages in flight (the host's rate controller may allow fewer)
+
+# Adaptive politeness (AimdController in http_client.py), one controller per host shared by every
+# fetcher: rate and concurrency grow additively while responses are healthy and halve on a 429, 5xx,
+# Cloudflare challenge or a page without id="content", followed by an exponential backoff pause.
+AIMD_START_RATE = 2.0       # requests per second
+AIMD_START_CONCURRENCY = 4
+AIMD_MIN_RATE = 0.2
+AIMD_MAX_RATE = 20.0
+AIMD_MAX_CONCURRENCY = 16
+AIMD_LATENCY_TARGET = 2.0   # seconds; slower average responses stop the additive increase
+AIMD_BACKOFF_MAX = 120.0    # seconds
+
+# "staged" runs Steps 1-3 one after another; "streaming" overlaps them (see pipeline.py):
+# list URLs go to Step 2 as each page is parsed and new movie URLs go to Step 3 as each list page is committed.
+PIPELINE_MODE = "staged"
+STEP2_WORKERS = 2          # streaming mode: lists scraped at once
+# Step 2 list pages loaded at once, across the pages of a list and of the next lists (1 = sequential).
+# A list's page URLs come from Step 1's film_count, so its pages need not wait on each other's a.next.
+STEP2_PAGE_WORKERS = 4
+STREAM_FLUSH_SECONDS = 10  # streaming mode: flush movie rows at least this often
+
+# `python sharding.py run step2|step3` on several hosts: URLs are split into SHARD_COUNT shards by a
+# stable hash, nodes lease shards through SHARD_LEASE_DB (put it and SHARD_DIR on a volume all nodes share),
+# and `python sharding.py merge step2|step3` joins the shard parts into the step output.
+SHARD_COUNT = 16
+SHARD_DIR = f"{BASE_DIR}/shards"
+SHARD_LEASE_DB = f"{BASE_DIR}/shards/leases.sqlite3"
+SHARD_LEASE_SECONDS = 600
+SHARD_MAX_ATTEMPTS = 3
+# SQLite journal of the lease and shard state databases. WAL needs shared memory on one host, so it
+# breaks on NFS/SMB; "DELETE" (rollback journal) only needs the volume's file locks to work.
+SHARD_JOURNAL_MODE = "DELETE"
+
+# `python login.py` once: log in by hand in a visible browser and save the session to STORAGE_STATE.
+# Steps 2 and 3 then start from it without a prompt, and step4 runs both in one browser process.
+STORAGE_STATE = f"{BASE_DIR}/storage_state.json"
+HEADLESS = True
+
+# Step 3 worker pool: number of pages scraping movie URLs at once (1 = sequential)
+STEP3_WORKERS = 1
+# Step 3 fetch mode: "browser" (Playwright only) or "hybrid" (plain HTTP first, browser fallback)
+STEP3_FETCH_MODE = "browser"
+# Step 3 scrape order: "input" (first seen in the Step 2 edges first), "references" (films in the most
+# lists first) or "likes" (references weighted by 1 + log(1 + the list's like_count)). The last two
+# print the share of list-movie edges with movie data after every flush.
+STEP3_ORDER = "input"
+
+# Playwright request interception: we only read page.content(), so skip heavy resources.
+# URLs matching ALLOWED_URL_PATTERNS (histogram/stats includes and site scripts) are exempt from
+# BLOCKED_URL_PATTERNS; their images, fonts and stylesheets are still blocked by type.
+BLOCK_RESOURCES = True
+BLOCKED_RESOURCE_TYPES = ["image", "media", "font", "stylesheet"]
+BLOCKED_URL_PATTERNS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "adservice.google", "amazon-adsystem.com", "quantserve.com", "scorecardresearch.com",
+    "pubmatic.com", "criteo", "youtube.com", "vimeo.com", "/ads/"
+]
+ALLOWED_URL_PATTERNS = ["letterboxd.com/csi/", "s.ltrbxd.com/static/"]
+
+# BeautifulSoup tree builder for all steps: "lxml" (fast) or "html.parser" (stdlib fallback)
+HTML_PARSER = "lxml"
+
+# `python refresh.py`: re-check the most overdue films (staleness x popularity) with conditional
+# requests and rewrite only the rows whose page or ratings/stats fragments changed.
+REFRESH_BATCH = 500
+REFRESH_MIN_AGE_HOURS = 24
+REFRESH_WORKERS = 8
+REFRESH_RATE_PER_HOST = 2.0  # starting rate, adapted like AIMD_START_RATE
+
+# Instrumentation (metrics.py): per-step histograms of fetch/navigate, wait, settle, parse, extract
+# and flush time plus ok/failed/archived/bytes counters and pages/minute. The JSON snapshot is
+# rewritten every METRICS_INTERVAL_SECONDS; set METRICS_PORT to serve Prometheus text on /metrics.
+METRICS_ENABLED = True
+METRICS_FILE = f"{BASE_DIR}/metrics.json"
+METRICS_INTERVAL_SECONDS = 15
+METRICS_PORT = None
+
+# Raw HTML archive shared by all steps (see html_archive.py)
+HTML_ARCHIVE_ENABLED = True
+HTML_ARCHIVE_DIR = f"{BASE_DIR}/html_archive"
+HTML_ARCHIVE_MAX_BYTES = 5 * 2**30
+HTML_ARCHIVE_PACK_BYTES = 64 * 2**20
+HTML_ARCHIVE_TTL_DAYS = 90     # evict pages fetched longer ago than this
+HTML_ARCHIVE_FRESH_HOURS = 24  # serve from the archive instead of the network when younger than this
+
+# Outputs of `python reextract.py` (same schema as MOVIE_LIST_CSV / MOVIE_DATA_CSV)
+REEXTRACT_MOVIE_LIST_CSV = f"{BASE_DIR}/reextract_movie_list_urls.csv"
+REEXTRACT_MOVIE_DATA_CSV = f"{BASE_DIR}/reextract_movie_data.csv"
+
+# Output format for all steps: "csv" or "parquet" (typed, dictionary-encoded; needs pyarrow).
+# Parquet outputs are dataset directories of part files, compacted after each step.
+OUTPUT_FORMAT = "csv"
+LISTS_URL_PARQUET = f"{BASE_DIR}/letterboxd_lists_urls.parquet"
+MOVIE_LIST_PARQUET = f"{BASE_DIR}/letterboxd_movie_list_urls.parquet"
+MOVIE_DATA_PARQUET = f"{BASE_DIR}/letterboxd_movie_data.parquet"
+FINAL_OUTPUT_PARQUET = f"{BASE_DIR}/letterboxd_final_output.parquet"
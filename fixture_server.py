@@ -0,0 +1,273 @@
+import collections
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LISTS_PATH = "/lists/popular/this/week/"
+LIST_PAGE_SIZE = 100
+STAR_LABELS = ["half-★", "★", "★½", "★★", "★★½", "★★★", "★★★½", "★★★★", "★★★★½", "★★★★★"]
+
+
+def list_film_count(n, list_size=100):
+    return list_size + n
+
+
+def list_film_slugs(n, total_films, list_size=100):
+    return [f"fixture-film-{(n * 37 + i * 13) % total_films}" for i in range(list_film_count(n, list_size))]
+
+
+def render_lists_page(number, total_pages, lists_per_page, list_size=100):
+    items = []
+    for i in range(lists_per_page):
+        n = (number - 1) * lists_per_page + i
+        items.append(f"""
+        <section class="list">
+          <div class="masthead">
+            <h2 class="name prettify"><a href="/user{n}/list/fixture-list-{n}/">Fixture list {n}</a></h2>
+            <a class="owner" href="/user{n}/">user{n}</a>
+            <span class="value">{list_film_count(n, list_size):,} films</span>
+            <span class="label">{n % 9 + 1}.{n % 10}K</span>
+            <span class="label">{n % 300}</span>
+          </div>
+        </section>""")
+    next_link = ""
+    if number < total_pages:
+        next_link = f'<a class="next" href="{LISTS_PATH}page/{number + 1}/">Older</a>'
+    return f"""<html><body><div id="content">
+    <div class="list-summary-list">{''.join(items)}</div>
+    <div class="pagination">{next_link}</div>
+    </div></body></html>"""
+
+
+def render_list_page(n, number, total_films, list_size=100):
+    slugs = list_film_slugs(n, total_films, list_size)
+    page_slugs = slugs[(number - 1) * LIST_PAGE_SIZE:number * LIST_PAGE_SIZE]
+    entries = "".join(f"""
+        <li class="posteritem">
+          <div class="react-component" data-component-class="LazyPoster" data-item-link="/film/{slug}/"></div>
+        </li>""" for slug in page_slugs)
+    next_link = ""
+    if number * LIST_PAGE_SIZE < len(slugs):
+        next_link = f'<a class="next" href="/user{n}/list/fixture-list-{n}/page/{number + 1}/">Newer</a>'
+    return f"""<html><body><div id="content">
+    <ul class="tags"><li><a>tag{n % 5}</a></li><li><a>fixture</a></li></ul>
+    <ul class="js-list-entries poster-list">{entries}</ul>
+    <div class="pagination">{next_link}</div>
+    </div></body></html>"""
+
+
+def render_histogram(f):
+    bars = "".join(
+        f'<li class="rating-histogram-bar"><a class="bar" data-original-title="{(f * 7 + i * 131) % 5000:,}&nbsp;{label} ratings"></a></li>'
+        for i, label in enumerate(STAR_LABELS)
+    )
+    return f"""<section class="ratings-histogram-chart">
+      <span class="average-rating"><a>{1 + f % 40 / 10:.1f}</a></span>
+      <a class="all-link more-link" href="/film/fixture-film-{f}/fans/">{f % 90 + 1}K&nbsp;fans</a>
+      <div class="rating-histogram"><ul>{bars}</ul></div>
+    </section>"""
+
+
+def render_stats(f):
+    return f"""<div class="production-statistic -watches"><span class="label">{f % 9 + 1}.{f % 7}M</span></div>
+      <div class="production-statistic -lists"><span class="label">{f % 500 + 3}K</span></div>
+      <div class="production-statistic -likes"><span class="label">{f * 17 % 100000:,}</span></div>"""
+
+
+def render_sluglist(h3, names, span_class=None):
+    span = f'<span class="{span_class}">{h3}</span>' if span_class else f"<span>{h3}</span>"
+    links = "".join(f'<a class="text-slug" href="/x/">{name}</a>' for name in names)
+    return f'<h3>{span}</h3><div class="text-sluglist"><p>{links}</p></div>'
+
+
+def render_film_page(f):
+    cast = "".join(f'<a class="text-slug" href="/actor/a{f}-{i}/">Actor {f}-{i}</a>' for i in range(8))
+    crew = "".join(render_sluglist(role, [f"{role} {f}-{i}" for i in range(2)], "crewrole -full")
+                   for role in ["Director", "Writers", "Editor", "Cinematography", "Producers", "Composer"])
+    details = (render_sluglist("Studios", [f"Studio {f % 40}"]) +
+               render_sluglist("Country", ["USA", "UK"][:1 + f % 2]) +
+               render_sluglist("Primary Language", ["English"]))
+    genres = render_sluglist("Genres", ["Drama", "Thriller"]) + render_sluglist("Themes", [f"Theme {f % 11}"])
+    releases = "".join(f"""<h3>{kind}</h3><div class="release-table -bydate">
+        <div class="listitem"><h5 class="date">{1 + f % 28} Mar {1950 + f % 70}</h5></div>
+        <div class="listitem"><h5 class="date">2 Apr {1951 + f % 70}</h5></div></div>"""
+                       for kind in ["Theatrical", "Digital"])
+    return f"""<html><body><div id="content">
+    <div class="col-17"><div class="details">
+      <h1 class="headline-1">Fixture Film {f}</h1>
+      <span class="releasedate"><a>{1950 + f % 70}</a></span>
+      <span class="creatorlist"><a>Director {f}-0</a></span>
+    </div></div>
+    <p class="text-link text-footer">{80 + f % 90}&nbsp;mins &nbsp; More at
+      <a href="http://www.imdb.com/title/tt{f:07d}/maindetails">IMDb</a>
+      <a href="https://www.themoviedb.org/movie/{f + 1}/">TMDb</a></p>
+    <div id="tabbed-content">
+      <div id="tab-cast"><div class="cast-list text-sluglist"><p>{cast}<a class="text-slug" id="has-cast-overflow">Show All…</a></p></div></div>
+      <div id="tab-crew">{crew}</div>
+      <div id="tab-details">{details}</div>
+      <div id="tab-genres">{genres}</div>
+      <div id="tab-releases">{releases}</div>
+    </div>
+    {render_histogram(f)}
+    {render_stats(f)}
+    </div></body></html>"""
+
+
+def fixture_corpus(lists=20, films=200):
+    """(kind, url_path, html) tuples for each page type, for parser benchmarks."""
+    pages = []
+    for number in range(1, -(-lists // 12) + 1):
+        path = LISTS_PATH if number == 1 else f"{LISTS_PATH}page/{number}/"
+        pages.append(("lists", path, render_lists_page(number, -(-lists // 12), 12)))
+    for n in range(lists):
+        pages.append(("list", f"/user{n}/list/fixture-list-{n}/", render_list_page(n, 1, films)))
+    for f in range(films):
+        pages.append(("film", f"/film/fixture-film-{f}/", render_film_page(f)))
+    return pages
+
+
+def route(path, total_pages, lists_per_page, total_films, list_size=100):
+    m = re.fullmatch(re.escape(LISTS_PATH) + r"(?:page/(\d+)/)?", path)
+    if m:
+        number = int(m.group(1) or 1)
+        return render_lists_page(number, total_pages, lists_per_page, list_size) if number <= total_pages else None
+    m = re.fullmatch(r"/user(\d+)/list/fixture-list-\d+/(?:page/(\d+)/)?", path)
+    if m:
+        n, number = int(m.group(1)), int(m.group(2) or 1)
+        if (number - 1) * LIST_PAGE_SIZE >= list_film_count(n, list_size):
+            return None
+        return render_list_page(n, number, total_films, list_size)
+    m = re.fullmatch(r"/film/fixture-film-(\d+)/", path)
+    if m and int(m.group(1)) < total_films:
+        return render_film_page(int(m.group(1)))
+    m = re.fullmatch(r"/csi/film/fixture-film-(\d+)/(rating-histogram|stats)/", path)
+    if m and int(m.group(1)) < total_films:
+        f = int(m.group(1))
+        return render_histogram(f) if m.group(2) == "rating-histogram" else render_stats(f)
+    if path == "/":
+        return '<html><body><div id="content"></div></body></html>'
+    return None
+
+
+CHALLENGE_PAGE = '<html><head><title>Just a moment...</title></head><body class="cf-challenge"></body></html>'
+
+
+def over_limit(server):
+    """Count this request against the server's throttle; True if it exceeds max_rate or max_in_flight."""
+    if not server.max_rate and not server.max_in_flight:
+        return False
+    with server.lock:
+        now = time.monotonic()
+        while server.recent and server.recent[0] < now - 1.0:
+            server.recent.popleft()
+        server.recent.append(now)
+        too_fast = server.max_rate and len(server.recent) > server.max_rate
+        too_many = server.max_in_flight and server.in_flight > server.max_in_flight
+        if too_fast or too_many:
+            server.throttled += 1
+            return True
+        return False
+
+
+def make_handler(latency, total_pages, lists_per_page, total_films, list_size=100):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server = self.server
+            with server.lock:
+                server.in_flight += 1
+            try:
+                self.respond()
+            finally:
+                with server.lock:
+                    server.in_flight -= 1
+
+        def respond(self):
+            if over_limit(self.server):
+                if self.server.challenge:
+                    body = CHALLENGE_PAGE.encode("utf-8")
+                    self.send_response(403)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_error(429)
+                return
+            server = self.server
+            with server.lock:
+                delay = latency + (server.rng.uniform(0, server.jitter) if server.jitter else 0.0)
+                fail = server.error_rate and server.rng.random() < server.error_rate
+                if fail:
+                    server.errors += 1
+            if delay:
+                time.sleep(delay)
+            if fail:
+                self.send_error(500)
+                return
+            html = route(self.path, total_pages, lists_per_page, total_films, list_size)
+            if html is None:
+                self.send_error(404)
+                return
+            revision = self.server.revisions.get(self.path)
+            if revision:
+                html += f"<!-- revision {revision} -->"
+            body = html.encode("utf-8")
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+
+class FixtureServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Crawlers cancel requests they no longer need; a dropped connection is not an error.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_fixture_server(latency=0.0, total_pages=50, lists_per_page=12, total_films=2000,
+                         max_rate=None, max_in_flight=None, challenge=False,
+                         jitter=0.0, error_rate=0.0, list_size=100, seed=0):
+    """
+    Serve Letterboxd-shaped pages on a random local port from a daemon thread.
+    Returns (server, base_url); call server.shutdown() when done.
+    Responses carry an ETag and honour If-None-Match; bump
+    server.revisions[path] to make a page change.
+    With `max_rate` (requests in any 1s window) or `max_in_flight`, requests
+    over the limit get a 429, or a Cloudflare-style challenge page when
+    `challenge` is set; server.throttled counts them.
+    Every response is delayed by `latency` plus up to `jitter` seconds, and
+    an `error_rate` share of requests fails with a 500 (server.errors).
+    List n has `list_size` + n films, paginated LIST_PAGE_SIZE per page.
+    """
+    handler = make_handler(latency, total_pages, lists_per_page, total_films, list_size)
+    server = FixtureServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.revisions = {}
+    server.max_rate, server.max_in_flight, server.challenge = max_rate, max_in_flight, challenge
+    server.lock = threading.Lock()
+    server.recent = collections.deque()
+    server.in_flight = 0
+    server.throttled = 0
+    server.jitter, server.error_rate = jitter, error_rate
+    server.rng = random.Random(seed)
+    server.errors = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
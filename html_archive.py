@@ -0,0 +1,251 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packs (
+    pack INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    pack INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    codec TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (url, fetched_at)
+);
+CREATE INDEX IF NOT EXISTS blobs_pack ON blobs(pack);
+CREATE INDEX IF NOT EXISTS pages_hash ON pages(hash);
+"""
+
+
+class HtmlArchive:
+    """
+    Content-addressed store of raw fetched pages.
+
+    Page bodies are compressed (zstd, or zlib when zstandard is missing) and
+    appended to pack files of at most `pack_size` bytes; identical bodies are
+    stored once. A SQLite index maps (url, fetched_at) to the body hash and the
+    hash to its pack offset, so reads are a single mmap slice. Eviction drops
+    pages older than `ttl_seconds`, then whole least-recently-read packs until
+    the archive fits in `max_bytes`.
+    """
+
+    def __init__(self, root, max_bytes, ttl_seconds=None, pack_size=64 * 2**20):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.pack_size = pack_size
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._maps = {}
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite3"), timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.active_pack = self._read_active_pack()
+        self.compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+        self.decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    def _read_active_pack(self):
+        # Sharded runs share one archive, so another process may have rolled to a new pack.
+        row = self.db.execute("SELECT MAX(pack) FROM packs").fetchone()
+        return row[0] or 1
+
+    def pack_path(self, pack):
+        return os.path.join(self.root, f"pack-{pack:06d}.bin")
+
+    def _compress(self, data):
+        if self.compressor:
+            return self.compressor.compress(data), "zstd"
+        return zlib.compress(data, 6), "zlib"
+
+    def _decompress(self, data, codec):
+        if codec == "zstd":
+            if not self.decompressor:
+                raise RuntimeError("zstandard is required to read zstd-compressed archive entries")
+            return self.decompressor.decompress(data)
+        return zlib.decompress(data)
+
+    def _read_blob(self, pack, offset, length):
+        mapped = self._maps.get(pack)
+        if mapped is None or offset + length > len(mapped):
+            if mapped is not None:
+                mapped.close()
+            with open(self.pack_path(pack), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[pack] = mapped
+        return mapped[offset:offset + length]
+
+    def _drop_map(self, pack):
+        mapped = self._maps.pop(pack, None)
+        if mapped is not None:
+            mapped.close()
+
+    def put(self, url, html, fetched_at=None):
+        """Store one fetched page; returns the sha256 of its body."""
+        fetched_at = fetched_at or time.time()
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            # Take the write lock before reading the pack tail: sharded processes append
+            # to the same packs, and BEGIN IMMEDIATE serialises them across processes.
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.active_pack = self._read_active_pack()
+                exists = self.db.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone()
+                rolled = False
+                if not exists:
+                    compressed, codec = self._compress(data)
+                    path = self.pack_path(self.active_pack)
+                    offset = os.path.getsize(path) if os.path.exists(path) else 0
+                    if offset and offset + len(compressed) > self.pack_size:
+                        self.active_pack += 1
+                        path = self.pack_path(self.active_pack)
+                        offset = 0
+                    with open(path, "ab") as f:
+                        f.write(compressed)
+                    self.db.execute(
+                        "INSERT INTO packs (pack, size, last_access) VALUES (?, ?, ?) "
+                        "ON CONFLICT(pack) DO UPDATE SET size = excluded.size, last_access = excluded.last_access",
+                        (self.active_pack, offset + len(compressed), fetched_at)
+                    )
+                    self.db.execute(
+                        "INSERT OR IGNORE INTO blobs (hash, pack, offset, length, codec) VALUES (?, ?, ?, ?, ?)",
+                        (digest, self.active_pack, offset, len(compressed), codec)
+                    )
+                    rolled = offset == 0 and self.active_pack > 1
+                self.db.execute(
+                    "INSERT OR REPLACE INTO pages (url, fetched_at, hash) VALUES (?, ?, ?)",
+                    (url, fetched_at, digest)
+                )
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+            if rolled:
+                self.evict()
+        return digest
+
+    def latest(self, url, max_age=None):
+        """(html, fetched_at, hash) of the newest copy of `url`, or None if absent or older than max_age."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT p.fetched_at, p.hash, b.pack, b.offset, b.length, b.codec "
+                "FROM pages p JOIN blobs b ON b.hash = p.hash "
+                "WHERE p.url = ? ORDER BY p.fetched_at DESC LIMIT 1",
+                (url,)
+            ).fetchone()
+            if not row:
+                return None
+            fetched_at, digest, pack, offset, length, codec = row
+            if max_age is not None and time.time() - fetched_at > max_age:
+                return None
+            data = self._decompress(self._read_blob(pack, offset, length), codec)
+            self.db.execute("UPDATE packs SET last_access = ? WHERE pack = ?", (time.time(), pack))
+            self.db.commit()
+        return data.decode("utf-8"), fetched_at, digest
+
+    def get(self, url, max_age=None):
+        """Lookup used by the fetchers before going to the network."""
+        found = self.latest(url, max_age)
+        return found[0] if found else None
+
+    def urls(self, like=None):
+        """Distinct archived URLs, optionally filtered by an SQL LIKE pattern."""
+        with self._lock:
+            if like:
+                rows = self.db.execute("SELECT DISTINCT url FROM pages WHERE url LIKE ?", (like,)).fetchall()
+            else:
+                rows = self.db.execute("SELECT DISTINCT url FROM pages").fetchall()
+        return [r[0] for r in rows]
+
+    def total_bytes(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM packs").fetchone()[0]
+
+    def evict(self):
+        """Apply the TTL, then drop least-recently-read packs (never the active one) until under max_bytes."""
+        with self._lock:
+            self.active_pack = self._read_active_pack()
+            if self.ttl_seconds:
+                self.db.execute("DELETE FROM pages WHERE fetched_at < ?", (time.time() - self.ttl_seconds,))
+                self.db.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM pages)")
+                empty = self.db.execute(
+                    "SELECT pack FROM packs WHERE pack != ? AND pack NOT IN (SELECT pack FROM blobs)",
+                    (self.active_pack,)
+                ).fetchall()
+                for (pack,) in empty:
+                    self._remove_pack(pack)
+            while self.total_bytes() > self.max_bytes:
+                row = self.db.execute(
+                    "SELECT pack FROM packs WHERE pack != ? ORDER BY last_access LIMIT 1",
+                    (self.active_pack,)
+                ).fetchone()
+                if not row:
+                    break
+                self._remove_pack(row[0])
+            self.db.commit()
+
+    def _remove_pack(self, pack):
+        self.db.execute("DELETE FROM pages WHERE hash IN (SELECT hash FROM blobs WHERE pack = ?)", (pack,))
+        self.db.execute("DELETE FROM blobs WHERE pack = ?", (pack,))
+        self.db.execute("DELETE FROM packs WHERE pack = ?", (pack,))
+        self._drop_map(pack)
+        if os.path.exists(self.pack_path(pack)):
+            os.remove(self.pack_path(pack))
+
+    def close(self):
+        with self._lock:
+            for pack in list(self._maps):
+                self._drop_map(pack)
+            self.db.close()
+
+
+_archive = None
+
+
+def get_archive():
+    """Process-wide archive configured in config.py, or None when archiving is disabled."""
+    global _archive
+    if not config.HTML_ARCHIVE_ENABLED:
+        return None
+    if _archive is None:
+        _archive = HtmlArchive(
+            config.HTML_ARCHIVE_DIR,
+            max_bytes=config.HTML_ARCHIVE_MAX_BYTES,
+            ttl_seconds=config.HTML_ARCHIVE_TTL_DAYS * 86400,
+            pack_size=config.HTML_ARCHIVE_PACK_BYTES,
+        )
+        _archive.evict()
+    return _archive
+
+
+def archived(url):
+    """Archived HTML for `url` if it is fresh enough to skip the network, else None."""
+    archive = get_archive()
+    if archive is None:
+        return None
+    return archive.get(url, max_age=config.HTML_ARCHIVE_FRESH_HOURS * 3600)
+
+
+def archive_page(url, html):
+    archive = get_archive()
+    if archive is not None and html:
+        archive.put(url, html)
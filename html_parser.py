@@ -0,0 +1,25 @@
+import logging
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+import config
+
+FALLBACK_PARSER = "html.parser"
+_missing_backends = set()
+
+
+def make_soup(html, backend=None):
+    """
+    Build a BeautifulSoup tree with the configured backend (config.HTML_PARSER).
+    Falls back to the stdlib html.parser when the backend is not installed.
+    """
+    backend = backend or config.HTML_PARSER
+    if backend not in _missing_backends:
+        try:
+            return BeautifulSoup(html, backend)
+        except FeatureNotFound:
+            _missing_backends.add(backend)
+            logging.getLogger(__name__).warning(
+                f"HTML parser backend {backend!r} is not installed, using {FALLBACK_PARSER}"
+            )
+    return BeautifulSoup(html, FALLBACK_PARSER)
@@ -0,0 +1,265 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9"
+}
+
+
+CHALLENGE_MARKERS = ("cf-challenge", "challenge-platform", "<title>Just a moment", "cf_chl_")
+
+
+def is_throttled(status=None, html=None, expect_content=True):
+    """429s, 5xx, Cloudflare challenge pages and pages without id="content" all mean back off."""
+    if status is not None and (status == 429 or status >= 500):
+        return True
+    if html is not None:
+        if any(marker in html for marker in CHALLENGE_MARKERS):
+            return True
+        if expect_content and status in (None, 200) and 'id="content"' not in html:
+            return True
+    return False
+
+
+class AimdController:
+    """
+    Adaptive politeness for one host, shared by every fetcher (sync threads,
+    asyncio tasks and Playwright pages alike).
+
+    Requests wait for a token at the current `rate` and for one of
+    `concurrency` slots. Healthy responses (no throttle signal, smoothed
+    latency under `latency_target`) raise the rate additively and add a
+    slot after a full window of successes; a throttle signal or error halves
+    both and starts an exponential backoff pause. Responses to requests that
+    started before the last cut do not cut again, so one burst of 429s
+    counts as a single congestion event.
+    """
+
+    def __init__(self, rate=2.0, concurrency=4, min_rate=0.2, max_rate=20.0, min_concurrency=1,
+                 max_concurrency=16, rate_step=0.2, latency_target=2.0, backoff_base=2.0, backoff_max=120.0):
+        self.rate = float(rate)
+        self.concurrency = int(concurrency)
+        # An explicit starting point above the ceilings raises the ceilings.
+        self.min_rate, self.max_rate = min_rate, max(max_rate, self.rate)
+        self.min_concurrency, self.max_concurrency = min_concurrency, max(max_concurrency, self.concurrency)
+        self.rate_step = rate_step
+        self.latency_target = latency_target
+        self.backoff_base, self.backoff_max = backoff_base, backoff_max
+        self.backoff = 0.0
+        self.backoff_until = 0.0
+        self.last_cut = 0.0
+        self.latency = None
+        self.in_flight = 0
+        self.healthy_streak = 0
+        self.counts = {"ok": 0, "throttled": 0, "errors": 0, "cuts": 0}
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)
+
+    def _reserve(self):
+        """Claim the next send time at the current rate; returns (seconds to wait, cut count)."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot, self.backoff_until)
+            self._next_slot = start + 1.0 / self.rate
+            return start - now, self.counts["cuts"]
+
+    def _still_valid(self, cuts):
+        """A send time reserved before a cut is void: the cut reset the pacing and started a backoff."""
+        with self._lock:
+            return self.counts["cuts"] == cuts
+
+    def _try_enter(self):
+        with self._lock:
+            if self.in_flight < self.concurrency:
+                self.in_flight += 1
+                return True
+            return False
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._freed.notify()
+
+    def acquire(self):
+        """Block until a request may be sent; returns its start time for record()."""
+        with self._lock:
+            while self.in_flight >= self.concurrency:
+                self._freed.wait()
+            self.in_flight += 1
+        while True:
+            wait, cuts = self._reserve()
+            if wait > 0:
+                time.sleep(wait)
+            if self._still_valid(cuts):
+                return time.monotonic()
+
+    async def acquire_async(self):
+        while not self._try_enter():
+            await asyncio.sleep(0.01)
+        try:
+            while True:
+                wait, cuts = self._reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if self._still_valid(cuts):
+                    return time.monotonic()
+        except asyncio.CancelledError:
+            self.release()
+            raise
+
+    def release(self):
+        """Give back the slot of a request abandoned (cancelled) before it had an outcome."""
+        self._leave()
+
+    def record(self, started, status=None, html=None, error=False, expect_content=True):
+        """Feed back one finished request; returns True if it was a throttle signal."""
+        self._leave()
+        now = time.monotonic()
+        throttled = error or is_throttled(status, html, expect_content)
+        with self._lock:
+            elapsed = now - started
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            if throttled:
+                self.counts["errors" if error else "throttled"] += 1
+                self.healthy_streak = 0
+                if started >= self.last_cut:
+                    self.counts["cuts"] += 1
+                    self.last_cut = now
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                    self.backoff = min(self.backoff_max, max(self.backoff_base, self.backoff * 2))
+                    self.backoff_until = now + self.backoff
+                    self._next_slot = self.backoff_until
+                return True
+            self.counts["ok"] += 1
+            if self.latency <= self.latency_target:
+                self.backoff = 0.0
+                self.rate = min(self.max_rate, self.rate + self.rate_step)
+                self.healthy_streak += 1
+                if self.healthy_streak >= self.concurrency:
+                    self.healthy_streak = 0
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            return False
+
+    def pause(self):
+        """Seconds left in the current backoff pause (for callers that retry)."""
+        return max(0.0, self.backoff_until - time.monotonic())
+
+    def snapshot(self):
+        """Current rate, concurrency and backoff state, for logs and monitoring."""
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "backoff_seconds": round(self.backoff, 3),
+                "backoff_remaining": round(max(0.0, self.backoff_until - time.monotonic()), 3),
+                "latency_ewma": round(self.latency, 3) if self.latency is not None else None,
+                **self.counts,
+            }
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def controller_for(url, **overrides):
+    """The shared AimdController of `url`'s host, created from config on first use."""
+    host = urlsplit(url).netloc
+    with _controllers_lock:
+        if host not in _controllers:
+            options = dict(
+                rate=config.AIMD_START_RATE, concurrency=config.AIMD_START_CONCURRENCY,
+                min_rate=config.AIMD_MIN_RATE, max_rate=config.AIMD_MAX_RATE,
+                max_concurrency=config.AIMD_MAX_CONCURRENCY, latency_target=config.AIMD_LATENCY_TARGET,
+                backoff_max=config.AIMD_BACKOFF_MAX,
+            )
+            options.update(overrides)
+            _controllers[host] = AimdController(**options)
+        return _controllers[host]
+
+
+def controller_snapshots():
+    with _controllers_lock:
+        return {host: controller.snapshot() for host, controller in _controllers.items()}
+
+
+def reset_controllers():
+    """Forget all learned host state (benchmarks start every run from the configured values)."""
+    with _controllers_lock:
+        _controllers.clear()
+
+
+class Throttled(Exception):
+    """The host answered with a throttle signal; retry after controller.pause()."""
+
+
+def controlled_get(session, url, expect_content=True, step=None, **kwargs):
+    """
+    session.get paced by the host's AimdController; raises Throttled on a
+    throttle signal. With `step`, the wait for the controller and the request
+    itself go to that step's "queue" and "fetch" metrics.
+    """
+    controller = controller_for(url)
+    queued = time.perf_counter()
+    started = controller.acquire()
+    sent = time.perf_counter()
+    try:
+        response = session.get(url, **kwargs)
+    except Exception:
+        controller.record(started, error=True)
+        raise
+    if step:
+        metrics.observe(step, "queue", sent - queued)
+        metrics.observe(step, "fetch", time.perf_counter() - sent)
+        metrics.count(step, "bytes", len(response.content))
+    html = response.text if response.status_code != 304 else None
+    if controller.record(started, response.status_code, html, expect_content=expect_content):
+        raise Throttled(f"{response.status_code} from {url}")
+    return response
+
+
+async def controlled_get_async(session, url, expect_content=True, step=None):
+    """aiohttp GET paced by the host's AimdController; returns (status, text) or raises Throttled."""
+    controller = controller_for(url)
+    queued = time.perf_counter()
+    started = await controller.acquire_async()
+    sent = time.perf_counter()
+    try:
+        async with session.get(url) as response:
+            status = response.status
+            body = await response.read()
+            html = body.decode(response.get_encoding(), errors="replace")
+    except asyncio.CancelledError:
+        controller.release()
+        raise
+    except Exception:
+        controller.record(started, error=True)
+        raise
+    if step:
+        metrics.observe(step, "queue", sent - queued)
+        metrics.observe(step, "fetch", time.perf_counter() - sent)
+        metrics.count(step, "bytes", len(body))
+    if controller.record(started, status, html, expect_content=expect_content):
+        raise Throttled(f"{status} from {url}")
+    return status, html
+
+
+def make_session(pool_size=10, headers=None):
+    """requests.Session with a connection pool sized for `pool_size` concurrent callers."""
+    session = requests.Session()
+    session.headers.update(headers or DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,50 @@
+import argparse
+import os
+
+from playwright.sync_api import sync_playwright
+
+import config
+from browser_session import CONTEXT_OPTIONS, LAUNCH_ARGS, STEALTH_SCRIPT
+
+
+def save_login_state(path=None, base_url="https://letterboxd.com"):
+    """Open a visible browser on the sign-in page, wait for a manual login and save its storage state."""
+    path = path or config.STORAGE_STATE
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=False, args=LAUNCH_ARGS)
+        context = browser.new_context(**CONTEXT_OPTIONS)
+        context.add_init_script(STEALTH_SCRIPT)
+        page = context.new_page()
+
+        # IMPORTANT: homepage first
+        page.goto(base_url + "/", wait_until="domcontentloaded")
+        page.wait_for_timeout(3000)
+
+        # Navigate normally
+        page.click("a[href='/sign-in/']")
+        page.wait_for_timeout(3000)
+
+        input("Log in manually, then press ENTER...")
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        context.storage_state(path=path)
+        browser.close()
+    print(f"Saved login state to {path}")
+
+
+def ensure_login(login=True):
+    """Run the interactive login once, when it is wanted and no saved state exists yet."""
+    if login and not os.path.exists(config.STORAGE_STATE):
+        save_login_state()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Log in to Letterboxd once and save the session for headless runs")
+    parser.add_argument("--output", default=config.STORAGE_STATE, help="Storage state file to write")
+    args = parser.parse_args()
+    save_login_state(args.output)
+
+
+if __name__ == "__main__":
+    main()
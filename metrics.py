@@ -0,0 +1,209 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Upper bounds in seconds, roughly x2.5 apart: 1ms up to 2 minutes.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus style); percentiles are bucket estimates."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (the max for the overflow bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return round(min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max, 4)
+        return round(self.max, 4)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": round(self.max, 4),
+        }
+
+
+_lock = threading.Lock()
+_histograms = {}  # (step, stage) -> Histogram
+_counters = {}    # (step, name) -> number
+_first_seen = {}  # step -> time of its first event
+_started = time.time()
+
+
+def observe(step, stage, seconds):
+    with _lock:
+        histogram = _histograms.get((step, stage))
+        if histogram is None:
+            histogram = _histograms[(step, stage)] = Histogram()
+            _first_seen.setdefault(step, time.time())
+        histogram.observe(seconds)
+
+
+def count(step, name, n=1):
+    with _lock:
+        _counters[(step, name)] = _counters.get((step, name), 0) + n
+        _first_seen.setdefault(step, time.time())
+
+
+class timer:
+    """`with timer("step3", "parse"):` adds the block's wall time to that stage's histogram."""
+
+    __slots__ = ("step", "stage", "start")
+
+    def __init__(self, step, stage):
+        self.step, self.stage = step, stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.step, self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def snapshot():
+    """All metrics as one JSON-ready dict: per step, stage histograms, counters and pages/minute."""
+    from http_client import controller_snapshots
+
+    now = time.time()
+    steps = {}
+    with _lock:
+        for (step, stage), histogram in _histograms.items():
+            steps.setdefault(step, {"stages": {}, "counters": {}})["stages"][stage] = histogram.summary()
+        for (step, name), value in _counters.items():
+            steps.setdefault(step, {"stages": {}, "counters": {}})["counters"][name] = value
+        for step, data in steps.items():
+            minutes = max(now - _first_seen.get(step, now), 1e-9) / 60
+            data["pages_per_minute"] = round(data["counters"].get("ok", 0) / minutes, 2)
+    return {
+        "generated_at": now,
+        "uptime_seconds": round(now - _started, 1),
+        "steps": steps,
+        "rate_controllers": controller_snapshots(),
+    }
+
+
+def prometheus_text():
+    """The metrics in the Prometheus text exposition format."""
+    from http_client import controller_snapshots
+
+    lines = [
+        "# TYPE scraper_stage_seconds histogram",
+    ]
+    with _lock:
+        for (step, stage), histogram in sorted(_histograms.items()):
+            labels = f'step="{step}",stage="{stage}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, histogram.counts):
+                cumulative += n
+                lines.append(f'scraper_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'scraper_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"scraper_stage_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"scraper_stage_seconds_count{{{labels}}} {histogram.count}")
+        lines.append("# TYPE scraper_events_total counter")
+        for (step, name), value in sorted(_counters.items()):
+            lines.append(f'scraper_events_total{{step="{step}",name="{name}"}} {value}')
+    lines.append("# TYPE scraper_rate_controller gauge")
+    for host, state in sorted(controller_snapshots().items()):
+        for key in ("rate", "concurrency", "in_flight", "backoff_remaining"):
+            lines.append(f'scraper_rate_controller{{host="{host}",field="{key}"}} {state[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_json(path):
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(), f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_reporter = None
+
+
+class MetricsReporter:
+    """Rewrites the JSON metrics file every `interval` seconds and serves /metrics on `port` if given."""
+
+    def __init__(self, path, interval, port=None):
+        self.path, self.interval = path, interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.server = None
+        if port is not None:
+            self.server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            write_json(self.path)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        write_json(self.path)
+        if self.server:
+            self.server.shutdown()
+
+
+def start(path=None, interval=None, port=None):
+    """Start the process-wide reporter from config (once); the file is written a last time at exit."""
+    global _reporter
+    if _reporter is None and config.METRICS_ENABLED:
+        _reporter = MetricsReporter(
+            path or config.METRICS_FILE, interval or config.METRICS_INTERVAL_SECONDS,
+            port if port is not None else config.METRICS_PORT
+        ).start()
+        atexit.register(_reporter.stop)
+    return _reporter
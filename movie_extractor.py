@@ -0,0 +1,362 @@
+import re
+
+from bs4 import Tag
+
+from output_sink import TABLES
+
+# Row keys in output column order.
+MOVIE_COLUMNS = [name for name, _, _ in TABLES["movie_data"]]
+
+DURATION = re.compile(r'(\d+)\s*min')
+IMDB_ID = re.compile(r'(tt\d+)')
+TMDB_ID = re.compile(r'/movie/(\d+)')
+COUNT = re.compile(r'([\d,]+)')
+STARS = re.compile(r'([½★]+)')
+
+STAR_MAP = {
+    "½": "half_stars",
+    "★": "one_stars",
+    "★½": "one_and_half_stars",
+    "★★": "two_stars",
+    "★★½": "two_and_half_stars",
+    "★★★": "three_stars",
+    "★★★½": "three_and_half_stars",
+    "★★★★": "four_stars",
+    "★★★★½": "four_and_half_stars",
+    "★★★★★": "five_stars",
+}
+
+STATISTIC_COLUMNS = {"-watches": "movie_watched_by", "-lists": "movie_listed_by", "-likes": "movie_liked_by"}
+
+SLUGLIST = ("div", ("class", ("text-sluglist",)))
+
+# Tabs of div#tabbed-content where each <h3> names a role and the values sit in
+# the next sibling block. tab id -> (label tag in the h3, or None for the h3's
+# own text; label must equal the role name (else contain it); role -> column;
+# value block; how to read the value block).
+ROLE_TABS = {
+    "tab-crew": (("span", ("classes", "crewrole -full")), False, {
+        'Writer': 'writer',
+        'Editor': 'editor',
+        'Cinematography': 'cinematography',
+        'Producer': 'producer',
+        'Composer': 'composer'
+    }, SLUGLIST, "links"),
+    "tab-details": (("span", None), False, {
+        'Studio': 'studio',
+        'Country': 'country',
+        'Language': 'primary_language'
+    }, SLUGLIST, "links"),
+    "tab-genres": (("span", None), False, {
+        'Genres': 'genres',
+        'Themes': 'themes'
+    }, SLUGLIST, "links"),
+    "tab-releases": (None, True, {
+        'Theatrical': 'first_theatrical_release',
+        'Digital': 'OTT_release'
+    }, ("div", ("classes", "release-table -bydate")), "first_date"),
+}
+
+
+def extract(tag, strip=True):
+    if not tag:
+        return None
+    text = tag.get_text(strip=strip)
+    return text.replace("&nbsp;", " ") if text else None
+
+
+def convert_k_m(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        if value.endswith("K"):
+            return float(value[:-1]) * 1_000
+        if value.endswith("M"):
+            return float(value[:-1]) * 1_000_000
+        return float(value.replace(",", ""))
+    except:
+        return None
+
+
+def matches(tag, test):
+    """test: None (any), ("class", names) all present, ("classes", "a b") exact class string, ("id", x), ("attr", name)."""
+    if test is None:
+        return True
+    kind, value = test
+    if kind == "class":
+        classes = tag.get("class") or ()
+        return all(name in classes for name in value)
+    if kind == "classes":
+        classes = tag.get("class")
+        return classes is not None and " ".join(classes) == value
+    if kind == "id":
+        return tag.get("id") == value
+    return tag.get(value) is not None
+
+
+class Rule:
+    """
+    One field spec: a tag (name and test) inside the innermost `scope`
+    instance (None: anywhere). It may open a scope for its subtree and/or
+    run an action; `first` limits it to the first match per scope instance.
+    """
+
+    __slots__ = ("scope", "name", "test", "opens", "action", "first")
+
+    def __init__(self, scope, name, test=None, opens=None, action=None, first=False):
+        self.scope, self.name, self.test = scope, name, test
+        self.opens, self.action, self.first = opens, action, first
+
+
+class Scope:
+    __slots__ = ("name", "tag", "claimed", "items", "data")
+
+    def __init__(self, name, tag, data=None):
+        self.name, self.tag, self.data = name, tag, data
+        self.claimed = set()
+        self.items = []
+
+
+class MovieExtraction:
+    """One walk over a page: every Tag is visited once and every rule for its name is tried."""
+
+    def __init__(self, row):
+        self.row = row
+        self.document = Scope(None, None)
+        self.active = {}
+        self.opened = set()
+
+    def run(self, soup):
+        # Each frame: (children iterator, pending heading values, scopes opened on the parent tag).
+        stack = [(iter(soup.contents), [None], ())]
+        while stack:
+            children, pending, _ = frame = stack[-1]
+            for child in children:
+                if not isinstance(child, Tag):
+                    continue
+                opened = []
+                if pending[0] is not None and child.name == pending[0][0] and matches(child, pending[0][1]):
+                    _, _, scope_name, columns = pending[0]
+                    opened.append(self.open(scope_name, child, columns))
+                    pending[0] = None
+                for rule in RULES.get(child.name, ()):
+                    scope = self.document if rule.scope is None else self.active.get(rule.scope)
+                    if scope is None or (rule.first and rule in scope.claimed) or not matches(child, rule.test):
+                        continue
+                    if rule.first:
+                        scope.claimed.add(rule)
+                    if rule.opens:
+                        opened.append(self.open(rule.opens, child))
+                    if rule.action:
+                        rule.action(self, child, self.active.get(rule.opens) if rule.opens else scope)
+                stack.append((iter(child.contents), [None], opened))
+                break
+            else:
+                stack.pop()
+                for scope, previous in reversed(frame[2]):
+                    result = self.close(scope, previous)
+                    if result is not None:
+                        parent_pending = stack[-1][1]
+                        if parent_pending[0] is not None and parent_pending[0][:3] == result[:3]:
+                            parent_pending[0][3].extend(result[3])
+                        else:
+                            parent_pending[0] = result
+        return self.row
+
+    def open(self, name, tag, data=None):
+        previous = self.active.get(name)
+        scope = self.active[name] = Scope(name, tag, data)
+        self.opened.add(name)
+        if name in HEADINGS and ROLE_TABS[HEADINGS[name]][0] is None:
+            scope.data = extract(tag)
+        return scope, previous
+
+    def close(self, scope, previous):
+        if previous is None:
+            del self.active[scope.name]
+        else:
+            self.active[scope.name] = previous
+        finish = CLOSERS.get(scope.name)
+        return finish(self, scope) if finish else None
+
+    # Actions: (extraction, matched tag, scope instance)
+
+    def footer(self, tag, scope):
+        text = extract(tag)
+        scope.data = bool(text)
+        if text:
+            m = DURATION.search(text)
+            if m:
+                self.row['duration'] = m.group(1)
+
+    def external_link(self, tag, scope):
+        if not scope.data:
+            return
+        href = tag['href']
+        if 'imdb.com/title/tt' in href:
+            self.row['imdb'] = href
+            m = IMDB_ID.search(href)
+            if m:
+                self.row['imdb_id'] = m.group(1)
+        elif 'themoviedb.org/movie/' in href:
+            self.row['tmdb'] = href
+            m = TMDB_ID.search(href)
+            if m:
+                self.row['tmdb_id'] = m.group(1)
+
+    def fans(self, tag, scope):
+        if "fan" in tag.text.lower():
+            self.row["fans_count"] = convert_k_m(extract(tag).replace("fans", "").strip())
+
+    def histogram_bar(self, tag, scope):
+        title = tag.get('data-original-title', '')
+        if not title:
+            return
+        title = title.replace('half-★', '½')
+        m = COUNT.search(title)
+        if not m:
+            return
+        star_match = STARS.search(title)
+        if not star_match:
+            return
+        col = STAR_MAP.get(star_match.group(1))
+        if col:
+            self.row[col] = int(m.group(1).replace(',', ''))
+
+    def collect(self, tag, scope):
+        scope.items.append(extract(tag))
+
+    def label(self, tag, scope):
+        scope.data = extract(tag)
+
+    def release_date(self, tag, scope):
+        value = extract(tag)
+        for column in self.active["tab-releases:values"].data:
+            self.row[column] = value
+
+    # Closers: run when a scope's tag ends; a heading returns the value block it is waiting for.
+
+    def close_cast(self, scope):
+        self.row['actors'] = ', '.join(text for text in scope.items[:-1] if text)
+
+    def close_statistic(self, scope):
+        classes = scope.tag.get("class", [])
+        for flag, column in STATISTIC_COLUMNS.items():
+            if flag in classes:
+                self.row[column] = convert_k_m(scope.data)
+                return
+
+    def close_heading(self, scope):
+        column = role_column(HEADINGS[scope.name], scope.data)
+        if column is None:
+            return None
+        tab = HEADINGS[scope.name]
+        name, test = ROLE_TABS[tab][3]
+        return name, test, tab + ":values", [column]
+
+    def close_links(self, scope):
+        value = ', '.join(text for text in scope.items if text)
+        for column in scope.data:
+            self.row[column] = value
+
+
+_role_cache = {}
+
+
+def role_column(tab, label):
+    """Column for a heading label in a role tab (first role in ROLE_TABS order that matches), cached."""
+    if label is None:
+        return None
+    key = (tab, label)
+    if key not in _role_cache:
+        _, exact, roles, _, _ = ROLE_TABS[tab]
+        text = label.lower()
+        column = None
+        for raw, normalized in roles.items():
+            if (raw.lower() == text) if exact else (raw.lower() in text):
+                column = normalized
+                break
+        if len(_role_cache) < 4096:
+            _role_cache[key] = column
+        return column
+    return _role_cache[key]
+
+
+def text_field(column):
+    def action(extraction, tag, scope):
+        extraction.row[column] = extract(tag)
+    return action
+
+
+def compile_rules():
+    """The field specs, indexed by tag name (built once at import)."""
+    M = MovieExtraction
+    rules = [
+        # Title, release year, director
+        Rule(None, "div", ("class", ("col-17",)), opens="col17", first=True),
+        Rule("col17", "div", ("class", ("details",)), opens="details", first=True),
+        Rule("details", "h1", ("class", ("headline-1",)), action=text_field('title'), first=True),
+        Rule("details", "span", ("class", ("releasedate",)), action=text_field('release_year'), first=True),
+        Rule("details", "span", ("class", ("creatorlist",)), action=text_field('director'), first=True),
+        # Duration, IMDb, TMDB
+        Rule(None, "p", ("classes", "text-link text-footer"), opens="footer", action=M.footer, first=True),
+        Rule("footer", "a", ("attr", "href"), action=M.external_link),
+        # Cast
+        Rule(None, "div", ("id", "tabbed-content"), opens="tabs", first=True),
+        Rule("tabs", "div", ("id", "tab-cast"), opens="cast", first=True),
+        Rule("cast", "a", ("class", ("text-slug",)), action=M.collect),
+        # Rating, fans and histogram
+        Rule(None, "span", ("class", ("average-rating",)), action=text_field('rating'), first=True),
+        Rule(None, "a", ("class", ("all-link", "more-link")), action=M.fans, first=True),
+        Rule(None, "div", ("class", ("rating-histogram",)), opens="histogram", first=True),
+        Rule("histogram", "ul", opens="histogram:list", first=True),
+        Rule("histogram:list", "li", ("class", ("rating-histogram-bar",)), opens="histogram:bar"),
+        Rule("histogram:bar", "a", ("class", ("bar",)), action=M.histogram_bar, first=True),
+        # Watches, lists, likes
+        Rule(None, "div", ("class", ("production-statistic",)), opens="statistic"),
+        Rule("statistic", "span", ("class", ("label",)), action=M.label, first=True),
+        # Release dates: the first date of the first entry in the block
+        Rule("tab-releases:values", "div", ("class", ("listitem",)), opens="tab-releases:item", first=True),
+        Rule("tab-releases:item", "h5", ("class", ("date",)), action=M.release_date, first=True),
+    ]
+    for tab, (label, _, _, _, reader) in ROLE_TABS.items():
+        rules.append(Rule("tabs", "div", ("id", tab), opens=tab, first=True))
+        rules.append(Rule(tab, "h3", opens=tab + ":heading"))
+        if label is not None:
+            rules.append(Rule(tab + ":heading", label[0], label[1], action=M.label, first=True))
+        if reader == "links":
+            rules.append(Rule(tab + ":values", "a", action=M.collect))
+    by_name = {}
+    for rule in rules:
+        by_name.setdefault(rule.name, []).append(rule)
+    return by_name
+
+
+RULES = compile_rules()
+HEADINGS = {tab + ":heading": tab for tab in ROLE_TABS}
+CLOSERS = {
+    "cast": MovieExtraction.close_cast,
+    "statistic": MovieExtraction.close_statistic,
+    **{tab + ":heading": MovieExtraction.close_heading for tab in ROLE_TABS},
+    **{tab + ":values": MovieExtraction.close_links for tab, spec in ROLE_TABS.items() if spec[4] == "links"},
+}
+
+
+def extract_movie(soup, movie_url, logger):
+    """All movie columns from a parsed film page in one pass over the tree."""
+    row = dict.fromkeys(MOVIE_COLUMNS)
+    row['movie_url'] = movie_url
+    extraction = MovieExtraction(row)
+    extraction.run(soup)
+    if "tabs" not in extraction.opened:
+        logger.warning(f"No tabbed-content found for {movie_url}")
+    if "tab-releases" not in extraction.opened:
+        logger.warning(f"No releases tab found for {movie_url}")
+    return row
+
+
+def extract_into(soup, row):
+    """Fill `row` from a partial page (the ratings or stats fragment); only fields found are set."""
+    MovieExtraction(row).run(soup)
+    return row
@@ -0,0 +1,422 @@
+import csv
+import glob
+import hashlib
+import io
+import itertools
+import os
+import shutil
+import time
+from array import array
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+STAR_COLUMNS = [
+    'half_stars', 'one_stars', 'one_and_half_stars', 'two_stars', 'two_and_half_stars',
+    'three_stars', 'three_and_half_stars', 'four_stars', 'four_and_half_stars', 'five_stars'
+]
+
+# (column, arrow type name, dictionary-encode) per table, in output column order
+TABLES = {
+    "lists": [
+        ("page_url", "string", True), ("list_url", "string", False), ("list_name", "string", False),
+        ("owner_name", "string", True), ("film_count", "int32", False), ("like_count", "int64", False),
+        ("comment_count", "int64", False),
+    ],
+    "movie_list": [
+        ("list_url", "string", True), ("movie_url", "string", False), ("tags", "string", True),
+    ],
+    "movie_data": [
+        ("movie_url", "string", False), ("title", "string", False), ("release_year", "int16", False),
+        ("movie_watched_by", "int64", False), ("movie_listed_by", "int64", False),
+        ("movie_liked_by", "int64", False), ("tmdb", "string", False), ("imdb", "string", False),
+        ("imdb_id", "string", False), ("tmdb_id", "int64", False), ("rating", "float32", False),
+        ("duration", "int32", False), ("actors", "string", False), ("director", "string", False),
+        ("writer", "string", False), ("editor", "string", False), ("cinematography", "string", False),
+        ("producer", "string", False), ("composer", "string", False), ("studio", "string", True),
+        ("country", "string", True), ("primary_language", "string", True), ("genres", "string", True),
+        ("themes", "string", True), ("first_theatrical_release", "string", False),
+        ("OTT_release", "string", False),
+    ] + [(col, "int64", False) for col in STAR_COLUMNS] + [("fans_count", "int64", False)],
+}
+
+
+def is_parquet(path):
+    return str(path).endswith(".parquet")
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for the parquet output format")
+
+
+def schema_for(table):
+    require_pyarrow()
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name, _ in TABLES[table]])
+
+
+def table_for_columns(columns):
+    for table, spec in TABLES.items():
+        if list(columns) == [name for name, _, _ in spec]:
+            return table
+    raise ValueError(f"No parquet schema matches columns {list(columns)}")
+
+
+def coerce(value, type_name):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if type_name == "string":
+        return str(value)
+    try:
+        if type_name.startswith("int"):
+            return int(float(str(value).replace(",", "")))
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ColumnBuffer:
+    """
+    Rows of one output table, held column-wise until the next flush: one list
+    per column instead of one dict per row. Columns the table dictionary-encodes
+    (TABLES) store int codes into the buffer's list of distinct values, so a
+    list_url or tags string repeated on every edge row is kept once.
+    """
+
+    __slots__ = ("table", "names", "columns", "values", "codes")
+
+    def __init__(self, table):
+        spec = TABLES[table]
+        self.table = table
+        self.names = [name for name, _, _ in spec]
+        self.columns = [array("i") if dictionary else [] for _, _, dictionary in spec]
+        self.values = [[] if dictionary else None for _, _, dictionary in spec]  # code -> value
+        self.codes = [{} if dictionary else None for _, _, dictionary in spec]   # value -> code
+
+    @classmethod
+    def from_rows(cls, rows):
+        """A buffer of (non-empty) dict rows, for the table their keys belong to."""
+        if isinstance(rows, cls):
+            return rows
+        rows = list(rows)
+        buffer = cls(table_for_columns(rows[0].keys()))
+        buffer.extend(rows)
+        return buffer
+
+    def _code(self, i, value):
+        code = self.codes[i].get(value)
+        if code is None:
+            code = self.codes[i][value] = len(self.values[i])
+            self.values[i].append(value)
+        return code
+
+    def append(self, row):
+        for i, name in enumerate(self.names):
+            value = row.get(name)
+            self.columns[i].append(value if self.codes[i] is None else self._code(i, value))
+
+    def extend_column(self, name, values, **constants):
+        """Append one row per item of `values` (column `name`), with `constants` on every row and None elsewhere."""
+        n = len(values)
+        for i, column_name in enumerate(self.names):
+            if column_name == name:
+                if self.codes[i] is None:
+                    self.columns[i].extend(values)
+                else:
+                    self.columns[i].extend(self._code(i, value) for value in values)
+            elif self.codes[i] is None:
+                self.columns[i].extend([constants.get(column_name)] * n)
+            else:
+                self.columns[i].extend(array("i", [self._code(i, constants.get(column_name))]) * n)
+
+    def extend(self, rows):
+        """Append the rows of another buffer of the same table, or an iterable of dicts."""
+        if not isinstance(rows, ColumnBuffer):
+            for row in rows:
+                self.append(row)
+            return
+        for i, column in enumerate(rows.columns):
+            if self.codes[i] is None:
+                self.columns[i].extend(column)
+            else:
+                self.columns[i].extend(self._code(i, rows.values[i][code]) for code in column)
+
+    def truncate(self, n):
+        for column in self.columns:
+            del column[n:]
+
+    def column(self, name):
+        i = self.names.index(name)
+        if self.codes[i] is None:
+            return list(self.columns[i])
+        values = self.values[i]
+        return [values[code] for code in self.columns[i]]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __iter__(self):
+        """Rows as dicts (for inspection and tests; the writers read columns)."""
+        for values in zip(*(self.column(name) for name in self.names)):
+            yield dict(zip(self.names, values))
+
+    def __eq__(self, other):
+        if not isinstance(other, ColumnBuffer):
+            return NotImplemented
+        return self.names == other.names and all(self.column(n) == other.column(n) for n in self.names)
+
+    __hash__ = None
+
+    def clear(self):
+        for i, column in enumerate(self.columns):
+            del column[:]
+            if self.codes[i] is not None:
+                self.values[i].clear()
+                self.codes[i].clear()
+
+
+def write_csv(buffer_df, path):
+    """
+    Append a ColumnBuffer (or dict rows) to the CSV at `path`, with the header
+    if the file is new. Rows go straight from the columns to the csv module,
+    without building a DataFrame; None is written as an empty field.
+    """
+    if not len(buffer_df):
+        return
+    buffer = ColumnBuffer.from_rows(buffer_df)
+    header = not os.path.exists(path)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        if header:
+            writer.writerow(buffer.names)
+        writer.writerows(zip(*(buffer.column(name) for name in buffer.names)))
+
+
+def write_parquet(buffer_df, path):
+    """
+    Write one flush as a part file of the dataset directory `path`.
+    Each flush is its own file so a crash never leaves a half-written footer;
+    compact_parquet() merges the parts into large row groups afterwards.
+    """
+    if not len(buffer_df):
+        return
+    buffer = ColumnBuffer.from_rows(buffer_df)
+    table = buffer.table
+    spec = TABLES[table]
+    columns = {
+        name: [coerce(value, type_name) for value in buffer.column(name)]
+        for name, type_name, _ in spec
+    }
+    arrow_table = pa.table(columns, schema=schema_for(table))
+    os.makedirs(path, exist_ok=True)
+    part = os.path.join(path, f"part-{time.time_ns()}.parquet")
+    pq.write_table(
+        arrow_table, part + ".tmp",
+        use_dictionary=[name for name, _, dictionary in spec if dictionary],
+        compression="zstd"
+    )
+    os.replace(part + ".tmp", part)
+
+
+def compact_parquet(path, row_group_size=100_000):
+    """
+    Rewrite all part files of `path` into a single file with large row groups.
+    The merged file keeps the newest part's name, so output_end() marks taken
+    before the compaction still hold.
+    """
+    parts = sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+    if len(parts) < 2:
+        return
+    dataset = pq.ParquetDataset(parts)
+    table = dataset.read()
+    spec = TABLES[table_for_columns(table.column_names)]
+    merged = parts[-1]
+    pq.write_table(
+        table, merged + ".tmp", row_group_size=row_group_size,
+        use_dictionary=[name for name, _, dictionary in spec if dictionary],
+        compression="zstd"
+    )
+    os.replace(merged + ".tmp", merged)
+    for part in parts[:-1]:
+        os.remove(part)
+
+
+def plain_strings(table):
+    """Dictionary columns would come back as pandas categoricals; keep plain strings for merges."""
+    return table.cast(pa.schema([
+        (field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+        for field in table.schema
+    ]))
+
+
+def read_table(path, columns=None):
+    """Read a step output as a DataFrame, whether it is a CSV file or a parquet dataset directory."""
+    if not is_parquet(path):
+        return pd.read_csv(path, usecols=columns)
+    require_pyarrow()
+    parts = sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    table = pq.ParquetDataset(parts).read(columns=columns)
+    return plain_strings(table).to_pandas()
+
+
+def replace_rows(path, key, rows, chunksize=50_000):
+    """
+    Rewrite the rows of `path` whose `key` matches one of `rows` (dicts), in
+    place and in file order. CSVs are streamed as text so untouched rows keep
+    their exact formatting; parquet datasets are rewritten as one part.
+    """
+    if not rows:
+        return
+    if is_parquet(path):
+        df = read_table(path)
+        columns = list(df.columns)
+        df = df.set_index(key)
+        replacement = pd.DataFrame(rows).set_index(key)
+        df.loc[replacement.index.intersection(df.index)] = replacement
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        write_parquet(df.reset_index()[columns].to_dict("records"), tmp)
+        shutil.rmtree(path)
+        os.replace(tmp, path)
+        return
+    text = pd.DataFrame(rows).to_csv(index=False)
+    replacement = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False).set_index(key)
+    tmp = path + ".tmp"
+    first = True
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize):
+        columns = [c for c in chunk.columns if c != key]
+        matched = chunk[key].isin(replacement.index)
+        if matched.any():
+            chunk.loc[matched, columns] = replacement.loc[chunk.loc[matched, key], columns].values
+        chunk.to_csv(tmp, mode="w" if first else "a", header=first, index=False)
+        first = False
+    os.replace(tmp, path)
+
+
+def source_mark(path, offset=None):
+    """High-water mark of an append-only CSV: byte offset plus hashes of its first and last 4 KiB."""
+    offset = os.path.getsize(path) if offset is None else offset
+    with open(path, "rb") as f:
+        head = f.read(min(offset, 4096))
+        f.seek(max(0, offset - 4096))
+        tail = f.read(offset - max(0, offset - 4096))
+    return {
+        "offset": offset,
+        "head": hashlib.sha1(head).hexdigest(),
+        "tail": hashlib.sha1(tail).hexdigest(),
+    }
+
+
+def output_end(path):
+    """
+    Where an append-only step output ends now: the byte size of a CSV, or the
+    newest part file name of a parquet dataset. None when nothing is written.
+    """
+    if not os.path.exists(path):
+        return None
+    if is_parquet(path):
+        parts = sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+        return os.path.basename(parts[-1]) if parts else None
+    return os.path.getsize(path)
+
+
+def truncate_output(path, end):
+    """Drop whatever was appended to a step output after `end` (an output_end() value)."""
+    if is_parquet(path):
+        for part in glob.glob(os.path.join(path, "part-*.parquet")):
+            if end is None or os.path.basename(part) > end:
+                os.remove(part)
+    elif end is None:
+        os.remove(path)
+    else:
+        with open(path, "r+b") as f:
+            f.truncate(end)
+
+
+class _ByteRange(io.RawIOBase):
+    """The next `remaining` bytes of an open binary file, as a readable stream."""
+
+    def __init__(self, f, remaining):
+        self.f, self.remaining = f, remaining
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.f.read(min(len(b), self.remaining))
+        b[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def complete_lines_end(path):
+    """Byte offset just past the last newline of a file (a writer may be mid-row after it)."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            block = f.read(end - start)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def iter_csv_column(path, column, offset, end, chunksize):
+    """
+    Values of `column` (as Series chunks; DataFrame chunks for a list of
+    columns) in the CSV rows between byte offsets `offset` and `end`; offset 0
+    starts after the header. Streams from disk, yielding (chunk, offset just
+    past its last row) so a caller can checkpoint between chunks.
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        names = pd.read_csv(io.BytesIO(header), nrows=0).columns
+        offset = max(offset, len(header))
+        columns = column if isinstance(column, list) else [column]
+        while offset < end:
+            # Find where the next `chunksize` lines end, then let pandas stream just that range.
+            f.seek(offset)
+            stop, quotes = offset, 0
+            for line in itertools.islice(f, chunksize):
+                stop += len(line)
+                quotes += line.count(b'"')
+            # A quoted field can span lines; a chunk only ends where the quotes balance.
+            while quotes % 2:
+                line = f.readline()
+                if not line:
+                    break
+                stop += len(line)
+                quotes += line.count(b'"')
+            # `end` is a line boundary; lines a writer appended after it are left for the next read.
+            stop = min(stop, end)
+            if stop <= offset:
+                return
+            f.seek(offset)
+            stream = io.BufferedReader(_ByteRange(f, stop - offset))
+            chunk = pd.read_csv(stream, names=names, header=None, usecols=columns)
+            offset = stop
+            yield chunk[column], offset
+
+
+def iter_table(path, chunksize, columns=None):
+    """Like read_table, but yields DataFrames of at most `chunksize` rows."""
+    if not is_parquet(path):
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+    require_pyarrow()
+    for part in sorted(glob.glob(os.path.join(path, "part-*.parquet"))):
+        for batch in pq.ParquetFile(part).iter_batches(batch_size=chunksize, columns=columns):
+            yield plain_strings(pa.Table.from_batches([batch])).to_pandas()
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import time
+
+from playwright.async_api import async_playwright
+
+import metrics
+from browser_session import ColdStart, new_context_async
+from login import ensure_login
+from resource_blocking import install_resource_blocking_async
+from state_store import DONE, FAILED, StateStore
+from http_client import make_session
+import step1_list
+import step2_movie_list_playwright as step2
+import step3_movie_data_playwright as step3
+
+CLAIM_SIZE = 100
+
+
+def seed_from_output(store, step, path, column, status=None):
+    """Register the URLs in `column` of an existing step output with the store (rows new since the last run)."""
+    if not os.path.exists(path):
+        return
+    if status:
+        store.ingest(step, path, column, status=status)
+    else:
+        store.ingest(step, path, column)
+
+
+async def feed_from_store(store, step, work_queue, workers, added, upstream):
+    """
+    Hand pending URLs of `step` to its workers as the upstream stage adds them.
+    The state store is the de-duplicating queue: a URL is only ever inserted
+    once per step, so a movie seen in many lists is claimed once. Stops when
+    nothing is pending and `upstream` has finished.
+    """
+    while True:
+        added.clear()
+        batch = store.claim(step, CLAIM_SIZE)
+        if batch:
+            for url in batch:
+                await work_queue.put(url)
+            continue
+        if upstream.done():
+            break
+        waiter = asyncio.ensure_future(added.wait())
+        await asyncio.wait([waiter, upstream], return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+    for _ in range(workers):
+        await work_queue.put(None)
+
+
+async def list_worker(pages, work_queue, store, movie_list_output, movies_added, film_counts, logger, base_url,
+                      cold_start=None):
+    """
+    Step 2 worker: scrape one list page by page, queueing each page's new
+    movies for Step 3 before writing and checkpointing its edges. The list's
+    pages load at once with pages from the shared `pages` pool.
+    """
+    while True:
+        list_url = await work_queue.get()
+        if list_url is None:
+            break
+        print(f"Starting processing for List URL: {list_url}")
+        list_pages = step2.ListPages(pages, list_url, logger, base_url, film_counts.get(list_url),
+                                     store.last_page(step2.STATE_STEP, list_url))
+        try:
+            async for number, rows, next_url in list_pages.parsed():
+                if cold_start:
+                    cold_start.page_loaded()
+                # Movies are registered before the edges are written, so a crash can
+                # leave a scraped movie without its edges (the page is redone) but
+                # never an edge whose movie is unknown to Step 3.
+                store.add_urls(step3.STATE_STEP, rows.column('movie_url'))
+                movies_added.set()
+                step2.commit_page(store, rows, movie_list_output, list_url, number, next_url, list_pages.movies)
+        except Exception as e:
+            logger.error(f"Error processing {list_url}: {e}")
+            list_pages.failed = True
+        finally:
+            list_pages.cancel()
+        if list_pages.failed:
+            # Its checkpointed pages stay; the next run resumes at the page that failed.
+            store.mark_failed(step2.STATE_STEP, [list_url])
+            metrics.count(step2.STATE_STEP, "failed")
+            continue
+        print(f"Flushed list {list_url}.")
+
+
+async def run_step1(lists_output, state_db, store, lists_added, film_counts, concurrency, base_url, start_url):
+    if store.is_step_complete(step1_list.STATE_STEP):
+        print("Step 1: Skipped (Already Completed)")
+        return
+
+    def on_lists(rows):
+        film_counts.update((row['list_url'], row['film_count']) for row in rows if row['film_count'] is not None)
+        store.add_urls(step2.STATE_STEP, [row['list_url'] for row in rows])
+        lists_added.set()
+
+    await step1_list.list_url_extraction_async(
+        lists_output, state_db, concurrency, base_url, start_url, on_lists=on_lists
+    )
+
+
+async def run_streaming_pipeline_async(lists_output, movie_list_output, movie_data_output, state_db,
+                                       list_workers=2, list_pages=4, movie_workers=4, fetch_mode="browser",
+                                       concurrency=4, block_resources=False,
+                                       flush_interval=10, headless=None,
+                                       base_url=step1_list.BASE_URL, start_url=step1_list.START_URL):
+    logger = logging.getLogger("pipeline")
+    list_logger = logging.getLogger("step2")
+    movie_logger = logging.getLogger("step3")
+    started = time.perf_counter()
+    cold_start = ColdStart("pipeline")
+
+    store = StateStore(state_db)
+    # Edges written after the last Step 2 page checkpoint (a crash mid-page) are dropped first.
+    store.reconcile_output(step2.STATE_STEP, movie_list_output)
+    # Outputs of earlier (staged or streaming) runs feed the queues first.
+    seed_from_output(store, step2.STATE_STEP, lists_output, 'list_url')
+    if not store.count(step3.STATE_STEP):
+        seed_from_output(store, step3.STATE_STEP, movie_data_output, 'movie_url', status=DONE)
+    seed_from_output(store, step3.STATE_STEP, movie_list_output, 'movie_url')
+    store.recover(step2.STATE_STEP)
+    store.recover(step3.STATE_STEP)
+    film_counts = step2.load_film_counts(lists_output)
+
+    lists_added = asyncio.Event()
+    movies_added = asyncio.Event()
+    list_queue = asyncio.Queue(maxsize=list_workers * 2)
+    movie_queue = asyncio.Queue(maxsize=movie_workers * 2)
+    results = asyncio.Queue()
+    fetch_counts = {"http": 0, "browser": 0}
+    session = make_session(pool_size=movie_workers) if fetch_mode == "hybrid" else None
+
+    async with async_playwright() as p:
+        browser, context = await new_context_async(p, headless)
+        resource_stats = await install_resource_blocking_async(context) if block_resources else None
+        context.set_default_navigation_timeout(45000)
+        context.set_default_timeout(30000)
+        # `list_pages` pages fetch list pages for all list workers, within and across lists.
+        list_page_pool = await step2.new_page_pool(context, list_pages)
+
+        stage1 = asyncio.create_task(run_step1(
+            lists_output, state_db, store, lists_added, film_counts, concurrency, base_url, start_url
+        ))
+        stage2 = asyncio.ensure_future(asyncio.gather(
+            feed_from_store(store, step2.STATE_STEP, list_queue, list_workers, lists_added, stage1),
+            *(list_worker(list_page_pool, list_queue, store, movie_list_output, movies_added, film_counts,
+                          list_logger, base_url, cold_start)
+              for _ in range(list_workers))
+        ))
+        first_row = {}
+
+        def on_flush(rows):
+            if rows and not first_row:
+                first_row["seconds"] = time.perf_counter() - started
+                message = f"First movie rows written after {first_row['seconds']:.1f}s"
+                print(message)
+                logger.info(message)
+
+        writer = asyncio.create_task(step3.movie_writer(
+            results, movie_data_output, store, movie_logger, flush_interval, on_flush
+        ))
+        try:
+            await asyncio.gather(
+                stage1, stage2,
+                feed_from_store(store, step3.STATE_STEP, movie_queue, movie_workers, movies_added, stage2),
+                *(step3.movie_worker(context, movie_queue, results, movie_logger, session, fetch_counts, cold_start)
+                  for _ in range(movie_workers))
+            )
+        finally:
+            await results.put(None)
+            await writer
+            if resource_stats:
+                resource_stats.pages = fetch_counts["browser"]
+                print(resource_stats.summary())
+                logger.info(resource_stats.summary())
+            await step2.close_page_pool(list_page_pool)
+            await context.close()
+            await browser.close()
+
+    # A stage is only complete when everything upstream of it is too.
+    upstream_complete = store.is_step_complete(step1_list.STATE_STEP)
+    for step in (step2.STATE_STEP, step3.STATE_STEP):
+        upstream_complete = upstream_complete and not store.count(step, FAILED)
+        if upstream_complete:
+            store.mark_step_complete(step)
+    step3.report_fetch_counts(fetch_counts, movie_logger)
+    message = f"Streaming pipeline finished in {time.perf_counter() - started:.1f}s"
+    print(message)
+    logger.info(message)
+    store.close()
+
+
+def run_streaming_pipeline(lists_output, movie_list_output, movie_data_output, state_db, **options):
+    """
+    Run Steps 1-3 as one overlapping pipeline: list URLs go to Step 2 workers as
+    each summary page is parsed, and new movie URLs go to Step 3 workers as each
+    list page is committed. Every stage still writes its own output and state.
+    """
+    ensure_login()
+    asyncio.run(run_streaming_pipeline_async(
+        lists_output, movie_list_output, movie_data_output, state_db, **options
+    ))
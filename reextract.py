@@ -0,0 +1,140 @@
+import argparse
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+import config
+from html_archive import HtmlArchive
+from output_sink import ColumnBuffer, is_parquet, read_table
+from step2_movie_list_playwright import MAX_MOVIE_PER_LIST, parse_list_page
+from step3_movie_data_playwright import apply_fragments, flush_to_disk, fragment_urls, parse_movie_page
+
+FILM_URL = re.compile(r"^https?://[^/]+/film/[^/]+/$")
+LIST_PAGE_URL = re.compile(r"^(https?://[^/]+/[^/]+/list/[^/]+/)(?:page/(\d+)/)?$")
+BATCH_SIZE = 200
+
+_archive = None
+
+
+def init_worker(archive_dir):
+    global _archive
+    _archive = HtmlArchive(archive_dir, max_bytes=float("inf"))
+    logging.getLogger("reextract").disabled = True
+
+
+def extract_films(movie_urls):
+    logger = logging.getLogger("reextract")
+    rows = ColumnBuffer("movie_data")
+    for movie_url in movie_urls:
+        found = _archive.latest(movie_url)
+        if not found or 'id="content"' not in found[0]:
+            continue
+        row = parse_movie_page(found[0], movie_url, logger)
+        fragments = {name: _archive.get(url) for name, url in fragment_urls(movie_url).items()}
+        apply_fragments(fragments, row)
+        rows.append(row)
+    return rows
+
+
+def extract_list(job):
+    list_url, page_urls = job
+    parts = urlsplit(list_url)
+    base_url = f"{parts.scheme}://{parts.netloc}"
+    rows = ColumnBuffer("movie_list")
+    for page_url in page_urls:
+        html = _archive.get(page_url)
+        if html is None or 'js-list-entries' not in html:
+            break
+        page_rows, _ = parse_list_page(html, list_url, base_url)
+        rows.extend(page_rows)
+        if len(rows) >= MAX_MOVIE_PER_LIST:
+            rows.truncate(MAX_MOVIE_PER_LIST)
+            return rows
+    return rows
+
+
+def list_jobs(urls, list_order=None):
+    """Group archived list pages by list, in page order; lists follow `list_order` when given."""
+    pages = {}
+    for url in urls:
+        m = LIST_PAGE_URL.match(url)
+        if m:
+            pages.setdefault(m.group(1), []).append((int(m.group(2) or 1), url))
+    order = [u for u in (list_order or []) if u in pages]
+    order += sorted(set(pages) - set(order))
+    return [(list_url, [url for _, url in sorted(pages[list_url])]) for list_url in order]
+
+
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def start_output(path):
+    if os.path.exists(path):
+        print(f"Replacing existing {path}")
+        if is_parquet(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def reextract_movies(archive_dir, output_file, workers=None, batch_size=BATCH_SIZE):
+    archive = HtmlArchive(archive_dir, max_bytes=float("inf"))
+    movie_urls = sorted(u for u in archive.urls("%/film/%") if FILM_URL.match(u))
+    archive.close()
+    start_output(output_file)
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(archive_dir,)) as pool:
+        for rows in pool.map(extract_films, batches(movie_urls, batch_size)):
+            if rows:
+                count += len(rows)
+                flush_to_disk(rows, output_file)
+    print(f"Re-extracted {count} movies into {output_file}")
+    return count
+
+
+def reextract_lists(archive_dir, output_file, lists_file=None, workers=None):
+    archive = HtmlArchive(archive_dir, max_bytes=float("inf"))
+    urls = archive.urls("%/list/%")
+    archive.close()
+    list_order = None
+    if lists_file and os.path.exists(lists_file):
+        list_order = read_table(lists_file, ["list_url"])["list_url"].drop_duplicates().tolist()
+    jobs = list_jobs(urls, list_order)
+    start_output(output_file)
+    count = 0
+    buffer_df = ColumnBuffer("movie_list")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(archive_dir,)) as pool:
+        for rows in pool.map(extract_list, jobs, chunksize=8):
+            buffer_df.extend(rows)
+            count += len(rows)
+            if len(buffer_df) >= 10 * BATCH_SIZE:
+                flush_to_disk(buffer_df, output_file)
+    if buffer_df:
+        flush_to_disk(buffer_df, output_file)
+    print(f"Re-extracted {count} list entries from {len(jobs)} lists into {output_file}")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild step2/step3 outputs from archived HTML without a browser")
+    parser.add_argument("--archive", default=config.HTML_ARCHIVE_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--movies-only", action="store_true")
+    parser.add_argument("--lists-only", action="store_true")
+    parser.add_argument("--movie-output", default=config.REEXTRACT_MOVIE_DATA_CSV)
+    parser.add_argument("--list-output", default=config.REEXTRACT_MOVIE_LIST_CSV)
+    args = parser.parse_args()
+
+    if not args.movies_only:
+        reextract_lists(args.archive, args.list_output, config.LISTS_URL_CSV, args.workers)
+    if not args.lists_only:
+        reextract_movies(args.archive, args.movie_output, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import logging
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+from html_archive import archive_page, get_archive
+from http_client import controlled_get, controller_for, controller_snapshots, make_session
+from output_sink import read_table, replace_rows
+from state_store import StateStore
+from step3_movie_data_playwright import apply_fragments, fragment_urls, parse_movie_page
+
+# Film pages embed per-request tokens in inline scripts; leave them out of the hash.
+SCRIPT_TAG = re.compile(r"<script\b.*?</script>", re.S | re.I)
+
+
+def content_hash(html):
+    return hashlib.sha256(SCRIPT_TAG.sub("", html).encode("utf-8")).hexdigest()
+
+
+def refresh_queue(store, movie_data_file, limit, min_age_hours, now=None):
+    """
+    Movies to re-check, most urgent first. Priority is hours since the last
+    check times log(1 + watched_by): popular films drift faster, so they come
+    due sooner. Films checked within `min_age_hours` are never picked.
+    """
+    now = now or time.time()
+    df = read_table(movie_data_file, ["movie_url", "movie_watched_by"])
+    checked = store.validators(df["movie_url"])
+    queue = []
+    for movie_url, watched in zip(df["movie_url"], df["movie_watched_by"]):
+        last = checked.get(movie_url)
+        age_hours = (now - last["checked_at"]) / 3600 if last else math.inf
+        if age_hours < min_age_hours:
+            continue
+        popularity = math.log1p(watched) if watched == watched and watched else 0.0
+        # Never-checked films go first, most popular among them first.
+        queue.append((age_hours * (1 + popularity) if last else math.inf, popularity, movie_url))
+    queue.sort(reverse=True)
+    return [movie_url for _, _, movie_url in queue[:limit]]
+
+
+def conditional_get(session, url, known, now, expect_content=True):
+    """
+    GET `url` with If-None-Match / If-Modified-Since from `known`, paced by
+    the host's rate controller. Returns (html or None when not modified,
+    changed, validator record).
+    """
+    headers = {}
+    if known and known.get("etag"):
+        headers["If-None-Match"] = known["etag"]
+    if known and known.get("last_modified"):
+        headers["If-Modified-Since"] = known["last_modified"]
+    response = controlled_get(session, url, expect_content=expect_content, step="refresh", headers=headers, timeout=10)
+    record = dict(url=url, etag=None, last_modified=None, content_hash=None, fetched_at=None, checked_at=now)
+    if response.status_code == 304:
+        metrics.count("refresh", "not_modified")
+        return None, False, record
+    response.raise_for_status()
+    html = response.text
+    digest = content_hash(html)
+    record.update(
+        etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"),
+        content_hash=digest, fetched_at=now
+    )
+    archive_page(url, html)
+    return html, not known or known.get("content_hash") != digest, record
+
+
+def refresh_movie(session, movie_url, known, logger):
+    """
+    Re-check one film page and its ratings/stats fragments.
+    Returns (row or None when nothing changed, validator records).
+    """
+    now = time.time()
+    urls = {"page": movie_url, **fragment_urls(movie_url)}
+    bodies = {}
+    records = []
+    changed = False
+    for name, url in urls.items():
+        html, url_changed, record = conditional_get(session, url, known.get(url), now, name == "page")
+        bodies[name] = html
+        records.append(record)
+        changed = changed or url_changed
+    if not changed:
+        return None, records
+
+    # Parts answered with 304 are re-read from the archive, or fetched again if it lost them.
+    archive = get_archive()
+    for name, url in urls.items():
+        if bodies[name] is None:
+            bodies[name] = archive.get(url) if archive else None
+        if bodies[name] is None:
+            bodies[name], _, records[list(urls).index(name)] = conditional_get(
+                session, url, None, now, name == "page"
+            )
+    if 'id="content"' not in bodies["page"]:
+        logger.error(f"Blocked or incomplete HTML for {movie_url}")
+        return None, []
+    row = parse_movie_page(bodies["page"], movie_url, logger)
+    apply_fragments(bodies, row)
+    return row, records
+
+
+def refresh_movie_data(movie_data_file, state_db, limit=500, min_age_hours=24, workers=8, rate_per_host=2.0):
+    """
+    Re-crawl the most overdue films with conditional requests and rewrite
+    only the rows of films whose content actually changed.
+    """
+    logger = logging.getLogger("refresh")
+    store = StateStore(state_db)
+    movie_urls = refresh_queue(store, movie_data_file, limit, min_age_hours)
+    print(f"Refreshing {len(movie_urls)} films.")
+    known = store.validators(u for movie_url in movie_urls for u in [movie_url, *fragment_urls(movie_url).values()])
+    session = make_session(pool_size=workers)
+    if movie_urls:
+        controller_for(movie_urls[0], rate=rate_per_host, concurrency=workers)
+
+    def check(movie_url):
+        try:
+            result = refresh_movie(session, movie_url, known, logger)
+            metrics.count("refresh", "ok")
+            return result
+        except Exception as e:
+            logger.error(f"Refresh failed for {movie_url}: {e}")
+            metrics.count("refresh", "failed")
+            return None, []
+
+    rows = []
+    records = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for row, film_records in pool.map(check, movie_urls):
+            records.extend(film_records)
+            if row is not None:
+                rows.append(row)
+    metrics.count("refresh", "changed", len(rows))
+    with metrics.timer("refresh", "flush"):
+        replace_rows(movie_data_file, "movie_url", rows)
+    # Validators are saved only once the new rows are on disk.
+    store.save_validators(records)
+    message = f"Refresh checked {len(movie_urls)} films: {len(rows)} changed and rewritten."
+    print(message)
+    logger.info(message)
+    logger.info(f"Rate controllers: {controller_snapshots()}")
+    store.close()
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-crawl stale movie statistics with conditional requests")
+    parser.add_argument("--limit", type=int, default=config.REFRESH_BATCH, help="Films to check this run")
+    parser.add_argument("--min-age-hours", type=float, default=config.REFRESH_MIN_AGE_HOURS)
+    parser.add_argument("--workers", type=int, default=config.REFRESH_WORKERS)
+    args = parser.parse_args()
+    metrics.start()
+    movie_data_file = config.MOVIE_DATA_PARQUET if config.OUTPUT_FORMAT == "parquet" else config.MOVIE_DATA_CSV
+    refresh_movie_data(
+        movie_data_file, config.STATE_DB, args.limit, args.min_age_hours, args.workers,
+        config.REFRESH_RATE_PER_HOST
+    )
+
+
+if __name__ == "__main__":
+    main()
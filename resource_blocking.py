@@ -0,0 +1,84 @@
+import config
+
+
+class ResourceStats:
+    """Counts requests blocked and bytes loaded; page_report() returns the delta since the last call."""
+
+    def __init__(self):
+        self.blocked = 0
+        self.allowed = 0
+        self.bytes_loaded = 0
+        self.blocked_by_type = {}
+        self.pages = 0
+        self._last = (0, 0, 0)
+
+    def record_blocked(self, resource_type):
+        self.blocked += 1
+        self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + 1
+
+    def record_response(self, response):
+        try:
+            self.bytes_loaded += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    def page_report(self):
+        self.pages += 1
+        blocked, allowed, loaded = self._last
+        self._last = (self.blocked, self.allowed, self.bytes_loaded)
+        return {
+            "requests_blocked": self.blocked - blocked,
+            "requests_allowed": self.allowed - allowed,
+            "bytes_loaded": self.bytes_loaded - loaded,
+        }
+
+    def summary(self):
+        pages = max(self.pages, 1)
+        return (f"Resource blocking: {self.blocked} requests blocked "
+                f"({self.blocked / pages:.1f}/page, by type {self.blocked_by_type}), "
+                f"{self.bytes_loaded / pages / 1024:.0f} KiB loaded per page")
+
+
+def should_block(url, resource_type):
+    # Resource types go first: the allowlist keeps scripts and includes, not the images and CSS on the same hosts.
+    if resource_type in config.BLOCKED_RESOURCE_TYPES:
+        return True
+    if any(pattern in url for pattern in config.ALLOWED_URL_PATTERNS):
+        return False
+    return any(pattern in url for pattern in config.BLOCKED_URL_PATTERNS)
+
+
+def install_resource_blocking(context):
+    """Route every request of a sync Playwright context through the block rules."""
+    stats = ResourceStats()
+
+    def handle(route):
+        request = route.request
+        if should_block(request.url, request.resource_type):
+            stats.record_blocked(request.resource_type)
+            route.abort()
+        else:
+            stats.allowed += 1
+            route.continue_()
+
+    context.route("**/*", handle)
+    context.on("response", stats.record_response)
+    return stats
+
+
+async def install_resource_blocking_async(context):
+    """Async Playwright counterpart of install_resource_blocking."""
+    stats = ResourceStats()
+
+    async def handle(route):
+        request = route.request
+        if should_block(request.url, request.resource_type):
+            stats.record_blocked(request.resource_type)
+            await route.abort()
+        else:
+            stats.allowed += 1
+            await route.continue_()
+
+    await context.route("**/*", handle)
+    context.on("response", stats.record_response)
+    return stats
@@ -0,0 +1,313 @@
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+
+import config
+import metrics
+from browser_session import BrowserSession
+from login import ensure_login
+from output_sink import is_parquet, read_table
+from state_store import StateStore
+from step2_movie_list_playwright import extract_movie_urls_from_list
+from step3_movie_data_playwright import extract_movie_data
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    step TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    owner TEXT,
+    expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (step, shard)
+);
+"""
+
+# step -> URL column of the step input that decides the shard
+SHARD_KEYS = {"step2": "list_url", "step3": "movie_url"}
+# step -> input columns copied into each shard's input (Step 2 plans list pages from film_count;
+# Step 3 keeps every edge so its reference counts hold within the shard)
+SHARD_COLUMNS = {"step2": ["list_url", "film_count"], "step3": ["movie_url", "list_url"]}
+
+
+def shard_of(url, shards):
+    """Stable shard number for a URL: the same on every host and every run."""
+    return int.from_bytes(hashlib.sha1(url.encode("utf-8")).digest()[:8], "big") % shards
+
+
+class LeaseStore:
+    """
+    Shard leases shared by all nodes through one SQLite file (e.g. on a
+    shared volume). A node owns a shard until its lease expires; renewals
+    push the expiry forward, and an expired lease can be taken by any node,
+    so a dead node never stalls the run.
+    """
+
+    def __init__(self, path):
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        # Autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+        # so two nodes can never claim the same shard.
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute(f"PRAGMA journal_mode={config.SHARD_JOURNAL_MODE}")
+        self._lock = threading.Lock()
+        self.db.executescript(LEASE_SCHEMA)
+
+    def init_shards(self, step, shards):
+        with self._lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO leases (step, shard) VALUES (?, ?)",
+                ((step, shard) for shard in range(shards))
+            )
+
+    def acquire(self, step, owner, ttl, max_attempts=3):
+        """
+        Lease the least-tried shard that is free or whose lease expired;
+        None when nothing is left. Shards leased `max_attempts` times are skipped.
+        """
+        now = time.time()
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT shard FROM leases WHERE step = ? AND done = 0 "
+                    "AND attempts < ? AND (owner IS NULL OR expires_at < ?) ORDER BY attempts, shard LIMIT 1",
+                    (step, max_attempts, now)
+                ).fetchone()
+                if row:
+                    self.db.execute(
+                        "UPDATE leases SET owner = ?, expires_at = ?, attempts = attempts + 1 "
+                        "WHERE step = ? AND shard = ?",
+                        (owner, now + ttl, step, row[0])
+                    )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return row[0] if row else None
+
+    def renew(self, step, shard, owner, ttl):
+        """Extend our lease; False if it expired and another node took the shard."""
+        with self._lock:
+            cursor = self.db.execute(
+                "UPDATE leases SET expires_at = ? WHERE step = ? AND shard = ? AND owner = ? AND done = 0",
+                (time.time() + ttl, step, shard, owner)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, step, shard, owner):
+        with self._lock:
+            self.db.execute(
+                "UPDATE leases SET done = 1, expires_at = NULL WHERE step = ? AND shard = ? AND owner = ?",
+                (step, shard, owner)
+            )
+
+    def release(self, step, shard, owner):
+        with self._lock:
+            self.db.execute(
+                "UPDATE leases SET owner = NULL, expires_at = NULL WHERE step = ? AND shard = ? AND owner = ?",
+                (step, shard, owner)
+            )
+
+    def pending(self, step):
+        with self._lock:
+            return [r[0] for r in self.db.execute(
+                "SELECT shard FROM leases WHERE step = ? AND done = 0 ORDER BY shard", (step,)
+            )]
+
+    def close(self):
+        self.db.close()
+
+
+class LeaseKeeper:
+    """
+    Background thread renewing a lease every ttl/3 while the shard is being
+    scraped. `lost` is set when a renewal fails; the step stops writing the
+    shard as soon as it sees it.
+    """
+
+    def __init__(self, leases, step, shard, owner, ttl):
+        self.leases, self.step, self.shard, self.owner, self.ttl = leases, step, shard, owner, ttl
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self.leases.renew(self.step, self.shard, self.owner, self.ttl):
+                self.lost.set()
+                logging.getLogger("sharding").error(
+                    f"Lost the lease on {self.step} shard {self.shard}; another node may be writing it."
+                )
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def shard_dir(step, shard):
+    return os.path.join(config.SHARD_DIR, step, f"shard-{shard:04d}")
+
+
+def shard_paths(step, shard):
+    """(input, output part, state db) of one shard."""
+    directory = shard_dir(step, shard)
+    suffix = ".parquet" if config.OUTPUT_FORMAT == "parquet" else ".csv"
+    return (os.path.join(directory, "input.csv"), os.path.join(directory, "part" + suffix),
+            os.path.join(directory, "state.sqlite3"))
+
+
+def step_files(step):
+    """(global input, merged output) of a sharded step, for config.OUTPUT_FORMAT."""
+    parquet = config.OUTPUT_FORMAT == "parquet"
+    lists = config.LISTS_URL_PARQUET if parquet else config.LISTS_URL_CSV
+    movie_list = config.MOVIE_LIST_PARQUET if parquet else config.MOVIE_LIST_CSV
+    movie_data = config.MOVIE_DATA_PARQUET if parquet else config.MOVIE_DATA_CSV
+    return {"step2": (lists, movie_list), "step3": (movie_list, movie_data)}[step]
+
+
+def write_shard_input(step, shard, shards):
+    """The shard's slice of the step input, written once (it only depends on the input and K)."""
+    input_file, _, _ = shard_paths(step, shard)
+    if os.path.exists(input_file):
+        return input_file
+    column = SHARD_KEYS[step]
+    rows = read_table(step_files(step)[0], SHARD_COLUMNS[step]).drop_duplicates()
+    mine = rows[rows[column].map(lambda url: shard_of(url, shards) == shard)]
+    os.makedirs(os.path.dirname(input_file), exist_ok=True)
+    mine.to_csv(input_file + ".tmp", index=False)
+    os.replace(input_file + ".tmp", input_file)
+    return input_file
+
+
+def run_shard(step, shard, shards, browser_session, stop=None):
+    input_file, output_part, state_db = shard_paths(step, shard)
+    write_shard_input(step, shard, shards)
+    if step == "step2":
+        extract_movie_urls_from_list(input_file, output_part, state_db, block_resources=config.BLOCK_RESOURCES,
+                                     browser_session=browser_session, workers=config.STEP2_PAGE_WORKERS,
+                                     stop=stop, journal_mode=config.SHARD_JOURNAL_MODE)
+    else:
+        extract_movie_data(input_file, output_part, state_db, workers=config.STEP3_WORKERS,
+                           fetch_mode=config.STEP3_FETCH_MODE, block_resources=config.BLOCK_RESOURCES,
+                           browser_session=browser_session, order=config.STEP3_ORDER,
+                           lists_file=step_files("step2")[0], stop=stop, journal_mode=config.SHARD_JOURNAL_MODE)
+    store = StateStore(state_db, config.SHARD_JOURNAL_MODE)
+    try:
+        return store.is_step_complete(step)
+    finally:
+        store.close()
+
+
+def run_node(step, node=None, shards=None, ttl=None):
+    """Lease and scrape shards of `step` until none is left to take."""
+    node = node or f"{socket.gethostname()}-{os.getpid()}"
+    shards = shards or config.SHARD_COUNT
+    ttl = ttl or config.SHARD_LEASE_SECONDS
+    leases = LeaseStore(config.SHARD_LEASE_DB)
+    leases.init_shards(step, shards)
+    ensure_login()
+    browser_session = BrowserSession()
+    while True:
+        shard = leases.acquire(step, node, ttl, config.SHARD_MAX_ATTEMPTS)
+        if shard is None:
+            break
+        print(f"{node}: leased {step} shard {shard}/{shards}")
+        keeper = LeaseKeeper(leases, step, shard, node, ttl)
+        try:
+            with keeper:
+                complete = run_shard(step, shard, shards, browser_session, stop=keeper.lost)
+        except Exception as e:
+            logging.getLogger("sharding").error(f"{step} shard {shard} failed on {node}: {e}")
+            complete = False
+        if keeper.lost.is_set():
+            # Another node owns the shard now; leave its lease alone.
+            print(f"{node}: lost the lease on {step} shard {shard}, stopped writing it.")
+        elif complete:
+            leases.complete(step, shard, node)
+        else:
+            # Free the shard so any node (possibly us, after the other shards) retries its failed URLs.
+            leases.release(step, shard, node)
+    browser_session.close()
+    remaining = leases.pending(step)
+    print(f"{node}: no free {step} shards left ({len(remaining)} not done yet).")
+    leases.close()
+
+
+def merge_shards(step, force=False):
+    """Concatenate the shard parts of `step` into the output file the next step and step4 read."""
+    leases = LeaseStore(config.SHARD_LEASE_DB)
+    remaining = leases.pending(step)
+    leases.close()
+    if remaining and not force:
+        raise RuntimeError(f"{step} shards not done yet: {remaining} (use --force to merge anyway)")
+    output = step_files(step)[1]
+    parts = sorted(glob.glob(os.path.join(config.SHARD_DIR, step, "shard-*", "part.*")))
+    if is_parquet(output):
+        tmp = output + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        for part in parts:
+            for i, piece in enumerate(sorted(glob.glob(os.path.join(part, "part-*.parquet")))):
+                shutil.copy(piece, os.path.join(tmp, f"part-{os.path.basename(os.path.dirname(part))}-{i:06d}.parquet"))
+        if os.path.exists(output):
+            shutil.rmtree(output)
+    else:
+        tmp = output + ".tmp"
+        parent = os.path.dirname(output)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(tmp, "wb") as out:
+            header = None
+            for part in parts:
+                with open(part, "rb") as f:
+                    first = f.readline()
+                    if header is None:
+                        header = first
+                        out.write(first)
+                    shutil.copyfileobj(f, out)
+    os.replace(tmp, output)
+    rows = len(read_table(output, [SHARD_KEYS[step]]))
+    print(f"Merged {len(parts)} {step} shard parts into {output} ({rows} rows).")
+    if not remaining:
+        store = StateStore(config.STATE_DB)
+        store.mark_step_complete(step)
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Step 2 / Step 3 as hash-sharded work across nodes")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Lease and scrape shards until none is free")
+    run.add_argument("step", choices=sorted(SHARD_KEYS))
+    run.add_argument("--node", help="Lease owner name (default: host-pid)")
+    run.add_argument("--shards", type=int, default=config.SHARD_COUNT)
+    run.add_argument("--lease-seconds", type=float, default=config.SHARD_LEASE_SECONDS)
+    merge = sub.add_parser("merge", help="Combine shard parts into the step's output file")
+    merge.add_argument("step", choices=sorted(SHARD_KEYS))
+    merge.add_argument("--force", action="store_true", help="Merge even if some shards are not done")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        metrics.start()
+        run_node(args.step, args.node, args.shards, args.lease_seconds)
+    else:
+        merge_shards(args.step, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from output_sink import (complete_lines_end, is_parquet, iter_csv_column, iter_table, output_end, source_mark,
+                         truncate_output)
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_state (
+    step TEXT NOT NULL,
+    url TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0,
+    priority REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (step, url)
+);
+CREATE INDEX IF NOT EXISTS url_state_status ON url_state(step, status, seq);
+CREATE TABLE IF NOT EXISTS step_state (
+    step TEXT PRIMARY KEY,
+    completed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingested (
+    step TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mark TEXT NOT NULL,
+    PRIMARY KEY (step, path)
+);
+CREATE TABLE IF NOT EXISTS list_pages (
+    step TEXT NOT NULL,
+    list_url TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    next_url TEXT,
+    movies INTEGER NOT NULL,
+    output_end,
+    PRIMARY KEY (step, list_url, page)
+);
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    fetched_at REAL,
+    checked_at REAL NOT NULL
+);
+"""
+
+
+class StateStore:
+    """
+    Per-URL crawl state for every step, in one SQLite database (WAL mode by
+    default; pass journal_mode="DELETE" for a file on a network volume, where
+    WAL's shared-memory index does not work).
+
+    Each (step, url) row carries its status (pending / in_flight / done /
+    failed), attempt count, timestamps and an insertion sequence number, so
+    resuming is an indexed scan of the pending rows in input order instead of
+    a walk over the whole URL list. Status changes are applied in batches,
+    one transaction per call.
+    """
+
+    def __init__(self, path, journal_mode="WAL"):
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute(f"PRAGMA journal_mode={journal_mode}")
+        # NORMAL is only crash-safe with WAL; a rollback journal needs FULL.
+        self.db.execute("PRAGMA synchronous=NORMAL" if journal_mode.upper() == "WAL" else "PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+        columns = {r[1] for r in self.db.execute("PRAGMA table_info(url_state)")}
+        for column, definition in (("refs", "INTEGER NOT NULL DEFAULT 0"), ("priority", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE url_state ADD COLUMN {column} {definition}")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS url_state_priority ON url_state(step, status, priority DESC, seq)"
+        )
+
+    def add_urls(self, step, urls, status=PENDING):
+        """Register URLs in order; URLs already known for the step keep their state."""
+        with self._lock, self.db:
+            self._add_urls(step, urls, status)
+
+    def _add_urls(self, step, urls, status):
+        now = time.time()
+        seq = self.db.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM url_state WHERE step = ?", (step,)
+        ).fetchone()[0]
+        self.db.executemany(
+            "INSERT OR IGNORE INTO url_state (step, url, seq, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((step, url, seq + i, status, now, now) for i, url in enumerate(urls, start=1))
+        )
+
+    def ingest(self, step, path, column, status=PENDING, chunksize=100_000, referrer=None, weights=None):
+        """
+        Register the URLs in `column` of a step input file, in file order and
+        a chunk at a time, so memory stays flat however large the file grows.
+        For a CSV only the rows appended since the last ingest are read (its
+        high-water mark is kept in the `ingested` table); a CSV that was
+        rewritten, or a parquet dataset, is read again in full. Returns the
+        number of rows read.
+
+        With `referrer` (the column naming each row's source, e.g. list_url),
+        every row read is also a reference to its URL: `refs` counts them and
+        `priority` adds up the referrers' `weights` (1 for a referrer not in
+        it, or without weights). A full read recounts them from zero.
+
+        Each CSV chunk's URLs, references and advanced mark are written in one
+        transaction, so a crash mid-ingest resumes after the last chunk
+        without counting any reference twice.
+        """
+        key = os.path.abspath(path)
+        columns = [column] if referrer is None else [column, referrer]
+        counted = None if referrer is None else f"{referrer}:{'weighted' if weights else 'plain'}"
+        if is_parquet(path):
+            chunks = ((chunk, None) for chunk in iter_table(path, chunksize, columns))
+            offset, end = 0, None
+        else:
+            row = self.db.execute("SELECT mark FROM ingested WHERE step = ? AND path = ?", (step, key)).fetchone()
+            last = json.loads(row[0]) if row else None
+            # Rows already read were not counted as references if they were read without them.
+            last_counted = last.pop("references", None) if last else None
+            end = complete_lines_end(path)
+            offset = 0
+            if last and last["offset"] <= end and source_mark(path, last["offset"]) == last:
+                if counted is None or last_counted == counted:
+                    offset = last["offset"]
+            chunks = iter_csv_column(path, columns, offset, end, chunksize)
+        # A full recount starts from zero, in the same transaction as the first chunk.
+        reset = bool(counted) and not offset
+        rows = 0
+        for chunk, chunk_end in chunks:
+            urls = chunk[column]
+            rows += len(urls)
+            with self._lock, self.db:
+                if reset:
+                    self._reset_references(step)
+                    reset = False
+                # The url_state primary key is the exact seen-set: known URLs are skipped in SQLite.
+                self._add_urls(step, urls.dropna().drop_duplicates().tolist(), status)
+                if counted:
+                    chunk = chunk.dropna(subset=[column])
+                    weight = chunk[referrer].map(weights).fillna(1.0) if weights else 1.0
+                    refs = chunk.assign(weight=weight).groupby(column, sort=False)["weight"].agg(["size", "sum"])
+                    self._add_references(step, zip(refs["size"].tolist(), refs["sum"].tolist(), refs.index))
+                if chunk_end is not None:
+                    self._set_mark(step, key, dict(source_mark(path, chunk_end), references=counted))
+        if end is not None:
+            with self._lock, self.db:
+                if reset:
+                    self._reset_references(step)
+                self._set_mark(step, key, dict(source_mark(path, end), references=counted))
+        elif reset:
+            self.reset_references(step)
+        return rows
+
+    def _set_mark(self, step, key, mark):
+        self.db.execute(
+            "INSERT INTO ingested (step, path, mark) VALUES (?, ?, ?) "
+            "ON CONFLICT(step, path) DO UPDATE SET mark = excluded.mark",
+            (step, key, json.dumps(mark))
+        )
+
+    def commit_page(self, step, list_url, page, next_url, movies, end):
+        """
+        Checkpoint one page of a list, once its rows are written and the step
+        output ends at `end` (output_end()). `next_url` is the page to resume
+        from, and `movies` the list's rows written so far. The checkpoint of
+        the last page (no `next_url`) also marks the list done, in the same
+        transaction.
+        """
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO list_pages (step, list_url, page, next_url, movies, output_end) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (step, list_url, page, next_url, movies, end)
+            )
+            if next_url is None:
+                self.db.execute(
+                    "UPDATE url_state SET status = ?, updated_at = ? WHERE step = ? AND url = ?",
+                    (DONE, now, step, list_url)
+                )
+
+    def last_page(self, step, list_url):
+        """(page, next_url, movies) of the list's last checkpointed page, or None."""
+        return self.db.execute(
+            "SELECT page, next_url, movies FROM list_pages WHERE step = ? AND list_url = ? "
+            "ORDER BY page DESC LIMIT 1", (step, list_url)
+        ).fetchone()
+
+    def reconcile_output(self, step, path):
+        """
+        Bring a step output and its page checkpoints back in line after a
+        crash. Rows written after the last checkpoint are cut off the output;
+        checkpoints whose rows never reached the disk are dropped, and their
+        lists go back to pending. Returns the number of dropped checkpoints.
+        """
+        row = self.db.execute(
+            "SELECT output_end FROM list_pages WHERE step = ? ORDER BY rowid DESC LIMIT 1", (step,)
+        ).fetchone()
+        if row is None:
+            return 0
+        committed, actual = row[0], output_end(path)
+        if None not in (committed, actual) and type(committed) is not type(actual):
+            # The output format changed since these checkpoints were taken.
+            return 0
+        lost = []
+        if committed is not None and (actual is None or actual < committed):
+            with self._lock, self.db:
+                where = "step = ? AND output_end > ?" if actual is not None else "step = ? AND output_end IS NOT NULL"
+                params = (step, actual) if actual is not None else (step,)
+                lost = [r[0] for r in self.db.execute(f"SELECT DISTINCT list_url FROM list_pages WHERE {where}", params)]
+                self.db.execute(f"DELETE FROM list_pages WHERE {where}", params)
+                self.db.executemany(
+                    "UPDATE url_state SET status = ?, updated_at = ? WHERE step = ? AND url = ?",
+                    ((PENDING, time.time(), step, url) for url in lost)
+                )
+            row = self.db.execute(
+                "SELECT output_end FROM list_pages WHERE step = ? ORDER BY rowid DESC LIMIT 1", (step,)
+            ).fetchone()
+            committed = row[0] if row else None
+        if actual is not None and (committed is None or actual > committed):
+            truncate_output(path, committed)
+        return len(lost)
+
+    def add_references(self, step, references):
+        """Add (refs, priority, url) increments from ingest(referrer=...)."""
+        with self._lock, self.db:
+            self._add_references(step, references)
+
+    def _add_references(self, step, references):
+        self.db.executemany(
+            "UPDATE url_state SET refs = refs + ?, priority = priority + ? WHERE step = ? AND url = ?",
+            ((refs, priority, step, url) for refs, priority, url in references)
+        )
+
+    def reset_references(self, step):
+        with self._lock, self.db:
+            self._reset_references(step)
+
+    def _reset_references(self, step):
+        self.db.execute("UPDATE url_state SET refs = 0, priority = 0 WHERE step = ?", (step,))
+
+    def references(self, step, urls=None, status=None):
+        """(refs, priority) summed over `urls`, or over every URL of the step (with `status`, if given)."""
+        if urls is None:
+            where, params = ("step = ? AND status = ?", (step, status)) if status else ("step = ?", (step,))
+            return self.db.execute(
+                f"SELECT COALESCE(SUM(refs), 0), COALESCE(SUM(priority), 0) FROM url_state WHERE {where}", params
+            ).fetchone()
+        refs = priority = 0
+        urls = list(urls)
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            found = self.db.execute(
+                "SELECT COALESCE(SUM(refs), 0), COALESCE(SUM(priority), 0) FROM url_state "
+                f"WHERE step = ? AND url IN ({','.join('?' * len(chunk))})", [step, *chunk]
+            ).fetchone()
+            refs, priority = refs + found[0], priority + found[1]
+        return refs, priority
+
+    def claim(self, step, limit, by_priority=False):
+        """
+        Mark the next `limit` pending URLs in_flight (attempts + 1) and return
+        them in input order, or highest priority first with `by_priority`.
+        """
+        now = time.time()
+        order = "priority DESC, seq" if by_priority else "seq"
+        with self._lock, self.db:
+            urls = [r[0] for r in self.db.execute(
+                f"SELECT url FROM url_state WHERE step = ? AND status = ? ORDER BY {order} LIMIT ?",
+                (step, PENDING, limit)
+            )]
+            self.db.executemany(
+                "UPDATE url_state SET status = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE step = ? AND url = ?",
+                ((IN_FLIGHT, now, step, url) for url in urls)
+            )
+        return urls
+
+    def mark(self, step, urls, status):
+        now = time.time()
+        with self._lock, self.db:
+            self.db.executemany(
+                "UPDATE url_state SET status = ?, updated_at = ? WHERE step = ? AND url = ?",
+                ((status, now, step, url) for url in urls)
+            )
+
+    def mark_done(self, step, urls):
+        self.mark(step, urls, DONE)
+
+    def mark_failed(self, step, urls):
+        self.mark(step, urls, FAILED)
+
+    def recover(self, step, max_attempts=3):
+        """On startup: in_flight rows from a crashed run, and failed rows with attempts left, go back to pending."""
+        with self._lock, self.db:
+            self.db.execute(
+                "UPDATE url_state SET status = ? WHERE step = ? AND "
+                "(status = ? OR (status = ? AND attempts < ?))",
+                (PENDING, step, IN_FLIGHT, FAILED, max_attempts)
+            )
+
+    def pending(self, step):
+        return [r[0] for r in self.db.execute(
+            "SELECT url FROM url_state WHERE step = ? AND status = ? ORDER BY seq", (step, PENDING)
+        )]
+
+    def first_pending(self, step):
+        row = self.db.execute(
+            "SELECT url FROM url_state WHERE step = ? AND status = ? ORDER BY seq LIMIT 1", (step, PENDING)
+        ).fetchone()
+        return row[0] if row else None
+
+    def status(self, step, url):
+        row = self.db.execute(
+            "SELECT status FROM url_state WHERE step = ? AND url = ?", (step, url)
+        ).fetchone()
+        return row[0] if row else None
+
+    def count(self, step, status=None):
+        if status:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM url_state WHERE step = ? AND status = ?", (step, status)
+            ).fetchone()[0]
+        return self.db.execute("SELECT COUNT(*) FROM url_state WHERE step = ?", (step,)).fetchone()[0]
+
+    def mark_step_complete(self, step, completed=True):
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT INTO step_state (step, completed, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(step) DO UPDATE SET completed = excluded.completed, updated_at = excluded.updated_at",
+                (step, int(completed), time.time())
+            )
+
+    def is_step_complete(self, step):
+        row = self.db.execute("SELECT completed FROM step_state WHERE step = ?", (step,)).fetchone()
+        return bool(row and row[0])
+
+    def validators(self, urls):
+        """{url: {etag, last_modified, content_hash, fetched_at, checked_at}} for the known URLs."""
+        found = {}
+        urls = list(urls)
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            rows = self.db.execute(
+                "SELECT url, etag, last_modified, content_hash, fetched_at, checked_at FROM validators "
+                f"WHERE url IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for url, etag, last_modified, content_hash, fetched_at, checked_at in rows:
+                found[url] = dict(etag=etag, last_modified=last_modified, content_hash=content_hash,
+                                  fetched_at=fetched_at, checked_at=checked_at)
+        return found
+
+    def save_validators(self, records):
+        """Upsert validator dicts (url plus the fields above); None keeps the stored value."""
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT INTO validators (url, etag, last_modified, content_hash, fetched_at, checked_at) "
+                "VALUES (:url, :etag, :last_modified, :content_hash, :fetched_at, :checked_at) "
+                "ON CONFLICT(url) DO UPDATE SET "
+                "etag = COALESCE(excluded.etag, etag), "
+                "last_modified = COALESCE(excluded.last_modified, last_modified), "
+                "content_hash = COALESCE(excluded.content_hash, content_hash), "
+                "fetched_at = COALESCE(excluded.fetched_at, fetched_at), "
+                "checked_at = excluded.checked_at",
+                records
+            )
+
+    def close(self):
+        self.db.close()
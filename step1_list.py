@@ -7,6 +7,27 @@ import random
 import os
 import re
 import logging
+import asyncio
+from contextlib import aclosing
+from html_parser import make_soup
+from html_archive import archived, archive_page
+from output_sink import ColumnBuffer, is_parquet, read_table, write_csv, write_parquet
+from state_store import FAILED, StateStore
+import config
+import metrics
+from http_client import DEFAULT_HEADERS, controlled_get, controlled_get_async, controller_for
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+BASE_URL='https://letterboxd.com'
+START_URL='https://letterboxd.com/lists/popular/this/week/'
+MAX_LIST_URLS=500
+BATCH_SIZE=100
+MAX_RETRIES=3
+STATE_STEP="step1"
 
 def ensure_parent_dir(path: str):
     parent = os.path.dirname(path)
@@ -22,14 +43,14 @@ def extract(tag, strip=True):
         return None 
 
 def flush_to_disk(buffer_df,output_file):
-    temp_df = pd.DataFrame(buffer_df)
-    ensure_parent_dir(output_file)
-    temp_df.to_csv(
-        output_file,
-        mode='a',
-        header=not os.path.exists(output_file),
-        index=False
-    )
+    metrics.count(STATE_STEP, "rows_written", len(buffer_df))
+    with metrics.timer(STATE_STEP, "flush"):
+        if is_parquet(output_file):
+            write_parquet(buffer_df, output_file)
+            buffer_df.clear()
+            return
+        ensure_parent_dir(output_file)
+        write_csv(buffer_df, output_file)
 
     buffer_df.clear()
 
@@ -47,51 +68,103 @@ def convert_k_m(value):
     except:
         return None
     
-def load_checkpoint(path):
-    if os.path.exists(path):
-        with open(path) as f:
-            return f.read().strip()
-    return None
 
-def mark_completed(checkpoint_path, url):
-    ensure_parent_dir(checkpoint_path)
-    with open(checkpoint_path, 'w') as f:
-        f.write(url)
-
-def list_url_extraction(output_file, checkpoint):
-    MAX_LIST_URLS=500
+def count_existing_lists(output_file):
     total_extracted=0
     if os.path.exists(output_file):
         try:
-            existing_df = pd.read_csv(output_file)
+            existing_df = read_table(output_file, ['list_url'])
             total_extracted = existing_df['list_url'].nunique()
             print(f"Resuming with {total_extracted} lists already extracted.")
-            if total_extracted >= MAX_LIST_URLS:
-                print("Already reached MAX_LIST_URLS limit.")
-                return
         except Exception as e:
             print(f"Error reading existing output file: {e}")
+    return total_extracted
+
+def parse_list_summary_page(html, page_url, base_url):
+    with metrics.timer(STATE_STEP, "parse"):
+        soup=make_soup(html)
+    started=time.perf_counter()
+    rows=[]
+    container=soup.find('div', class_='list-summary-list')
+    list_items=container.find_all('div', class_='masthead') if container else []
+    for item in list_items:
+        row={'page_url':None,'list_url':None,'list_name':None,'owner_name':None,'film_count':None,'like_count':None,'comment_count':None}
+        row['page_url']=page_url
+        list_link_tag=item.find('h2', class_='name prettify').find('a')
+        list_url=base_url + list_link_tag['href']
+        row['list_url']=list_url
+        row['list_name']=extract(list_link_tag)
+        row['owner_name']=extract(item.find('a', class_='owner'))
+        film_text = extract(item.find('span', class_='value'))
+        if film_text:
+            film_text = film_text.replace('films', '').replace(',', '').strip()
+            try:
+                row['film_count'] = int(film_text)
+            except ValueError:
+                row['film_count'] = None
+
+        labels=item.find_all('span', class_='label')
+        if len(labels)==2:
+            row['like_count']=convert_k_m(extract(labels[0]))
+            row['comment_count']=convert_k_m(extract(labels[1]))
+        elif len(labels)==1:
+            row['like_count']=convert_k_m(extract(labels[0]))
+        rows.append(row)
+
+    next_page_tag=soup.find('a', class_='next')
+    next_url=base_url + next_page_tag['href'] if next_page_tag else None
+    metrics.observe(STATE_STEP, "extract", time.perf_counter() - started)
+    return rows, next_url
+
+def resume_page(store, start_url):
+    """
+    First page that still has to be fetched, or None when the step has nothing left.
+    Pages are marked done only once their rows are flushed, so a crash resumes
+    at the first page whose rows never reached disk.
+    """
+    store.recover(STATE_STEP)
+    page_url = store.first_pending(STATE_STEP)
+    if page_url is None and not store.count(STATE_STEP):
+        page_url = start_url
+        store.add_urls(STATE_STEP, [page_url])
+    return page_url
+
+def flush_pages(buffer_df, output_file, store, unflushed_pages):
+    if buffer_df:
+        flush_to_disk(buffer_df, output_file)
+    store.mark_done(STATE_STEP, unflushed_pages)
+    unflushed_pages.clear()
 
-    buffer_df=[]
+def finish(store):
+    if not store.count(STATE_STEP, FAILED):
+        store.mark_step_complete(STATE_STEP)
+
+def list_url_extraction(output_file, state_db, fetch_mode="sync", concurrency=4,
+                        base_url=BASE_URL, start_url=START_URL):
+    if fetch_mode == "async":
+        asyncio.run(list_url_extraction_async(
+            output_file, state_db, concurrency, base_url, start_url
+        ))
+        return
+    store = StateStore(state_db)
+    total_extracted=count_existing_lists(output_file)
+    if total_extracted >= MAX_LIST_URLS:
+        print("Already reached MAX_LIST_URLS limit.")
+        store.mark_step_complete(STATE_STEP)
+        return
+
+    buffer_df=ColumnBuffer('lists')
     LOGGING_FILE='scrap_error.log'
-    BATCH_SIZE=100
-    MAX_RETRIES=3
     logger = logging.getLogger("step1")
     # logging.basicConfig(
     #     filename=LOGGING_FILE, filemode='a', level=logging.INFO,
     #     format="%(asctime)s | %(levelname)s | %(message)s"
     # )
 
-    headers={
-        "User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36",
-        "Accept-Language":"en-US,en;q=0.9"
-    }
+    headers=DEFAULT_HEADERS
     count=0
-    BASE_URL='https://letterboxd.com'
-    CURR_URL='https://letterboxd.com/lists/popular/this/week/'
-    last_completed = load_checkpoint(checkpoint)
-    if last_completed:
-        CURR_URL = last_completed
+    unflushed_pages=[]
+    CURR_URL=resume_page(store, start_url)
 
     session = requests.Session()
     session.headers.update(headers)
@@ -99,84 +172,209 @@ def list_url_extraction(output_file, checkpoint):
         print("Scraping the CURR_URL =", CURR_URL)
         logger.info(f"Processing Page URL: {CURR_URL}")
         try:
-            for attempt in range(1, MAX_RETRIES + 1):
-                try:
-                    response = session.get(CURR_URL, timeout=10)
-                    response.raise_for_status()
-                    break
-                except Exception as e:
-                    logger.warning(
-                        f"Attempt {attempt}/{MAX_RETRIES} failed for {CURR_URL}: {e}"
-                        )
-                    time.sleep(random.uniform(3, 6))
-            else:
-                logger.error(f"Skipping page after {MAX_RETRIES} failures: {CURR_URL}")
-                CURR_URL = None
-                continue
-            soup=BeautifulSoup(response.text, 'html.parser')
-            
-            container=soup.find('div', class_='list-summary-list')
-            list_items=container.find_all('div', class_='masthead') if container else []
-            print(f"Found {len(list_items)} list items on the page.")
-            for item in list_items:
-                row={'page_url':None,'list_url':None,'list_name':None,'owner_name':None,'film_count':None,'like_count':None,'comment_count':None}
-                row['page_url']=CURR_URL
-                list_link_tag=item.find('h2', class_='name prettify').find('a')
-                list_url=BASE_URL + list_link_tag['href']
-                row['list_url']=list_url
-                row['list_name']=extract(list_link_tag)
-                row['owner_name']=extract(item.find('a', class_='owner'))
-                film_text = extract(item.find('span', class_='value'))
-                if film_text:
-                    film_text = film_text.replace('films', '').replace(',', '').strip()
+            html = archived(CURR_URL)
+            if html is None:
+                for attempt in range(1, MAX_RETRIES + 1):
                     try:
-                        row['film_count'] = int(film_text)
-                    except ValueError:
-                        row['film_count'] = None
-
-                labels=item.find_all('span', class_='label')
-                if len(labels)==2:
-                    row['like_count']=convert_k_m(extract(labels[0]))
-                    row['comment_count']=convert_k_m(extract(labels[1]))
-                elif len(labels)==1:
-                    row['like_count']=convert_k_m(extract(labels[0]))
+                        response = controlled_get(session, CURR_URL, step=STATE_STEP, timeout=10)
+                        response.raise_for_status()
+                        break
+                    except Exception as e:
+                        logger.warning(
+                            f"Attempt {attempt}/{MAX_RETRIES} failed for {CURR_URL}: {e}"
+                            )
+                        time.sleep(controller_for(CURR_URL).pause())
+                else:
+                    logger.error(f"Skipping page after {MAX_RETRIES} failures: {CURR_URL}")
+                    store.mark_failed(STATE_STEP, [CURR_URL])
+                    metrics.count(STATE_STEP, "failed")
+                    CURR_URL = None
+                    continue
+                html = response.text
+                archive_page(CURR_URL, html)
+            else:
+                metrics.count(STATE_STEP, "archived")
+            rows, next_url = parse_list_summary_page(html, CURR_URL, base_url)
+            metrics.count(STATE_STEP, "ok")
+            print(f"Found {len(rows)} list items on the page.")
+            for row in rows:
                 buffer_df.append(row)
                 total_extracted+=1
                 if total_extracted>=MAX_LIST_URLS:
                     logger.info("Reached MAX_LIST_URLS limit. Stopping Step-1.")
                     print("Reaches 500 list")
-                    flush_to_disk(buffer_df, output_file)
+                    flush_pages(buffer_df, output_file, store, unflushed_pages + [CURR_URL])
+                    store.mark_step_complete(STATE_STEP)
                     return
                 
             logger.info(f"Completed Page URL: {CURR_URL}")
-            mark_completed(checkpoint, CURR_URL)
-            next_page_tag=soup.find('a', class_='next')
-            if next_page_tag:
-                CURR_URL=BASE_URL + next_page_tag['href']
-            else:
-                CURR_URL=None
+            unflushed_pages.append(CURR_URL)
+            if next_url:
+                store.add_urls(STATE_STEP, [next_url])
+            CURR_URL=next_url
         except Exception as e:
             logger.error(f"Error processing {CURR_URL}: {e}")
+            store.mark_failed(STATE_STEP, [CURR_URL])
+            metrics.count(STATE_STEP, "failed")
             CURR_URL=None
             print("Terminating due to error.")
             print(e)
         if len(buffer_df)>=BATCH_SIZE:
             print(f"Flushing {len(buffer_df)} records to disk.")
-            flush_to_disk(buffer_df,output_file)
-        time.sleep(1)
+            flush_pages(buffer_df, output_file, store, unflushed_pages)
         count+=1
         if count%50==0:
             session.close()
             session = requests.Session()
             session.headers.update(headers)
 
-    if buffer_df:
-        print(f"Flushing remaining {len(buffer_df)} records to disk.")
-        flush_to_disk(buffer_df, output_file)
-    mark_completed(checkpoint, "COMPLETED")
+    print(f"Flushing remaining {len(buffer_df)} records to disk.")
+    flush_pages(buffer_df, output_file, store, unflushed_pages)
+    finish(store)
+    print("Scraping Completed.")
+
+def page_number(url):
+    m = re.search(r'/page/(\d+)/?$', url)
+    return int(m.group(1)) if m else 1
+
+def page_url_for(start_url, number):
+    return start_url if number == 1 else f"{start_url}page/{number}/"
+
+async def fetch_page_async(session, url, logger):
+    html = archived(url)
+    if html is not None:
+        metrics.count(STATE_STEP, "archived")
+        return html
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            status, html = await controlled_get_async(session, url, step=STATE_STEP)
+            if status == 404:
+                return None
+            if status != 200:
+                raise RuntimeError(f"HTTP {status}")
+            archive_page(url, html)
+            return html
+        except Exception as e:
+            logger.warning(
+                f"Attempt {attempt}/{MAX_RETRIES} failed for {url}: {e}"
+                )
+            await asyncio.sleep(controller_for(url).pause())
+    logger.error(f"Skipping page after {MAX_RETRIES} failures: {url}")
+    return None
+
+async def crawl_list_pages(session, start_url, first_page, concurrency, logger):
+    """
+    Yield (page_url, html) in page order while keeping up to
+    `concurrency` page requests in flight ahead of the consumer.
+    """
+    in_flight=[]
+    next_number=first_page
+
+    def schedule():
+        nonlocal next_number
+        url=page_url_for(start_url, next_number)
+        in_flight.append((url, asyncio.create_task(fetch_page_async(session, url, logger))))
+        next_number+=1
+
+    for _ in range(concurrency):
+        schedule()
+    try:
+        while in_flight:
+            url, task = in_flight.pop(0)
+            html = await task
+            yield url, html
+            schedule()
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
+
+async def list_url_extraction_async(output_file, state_db, concurrency=4,
+                                    base_url=BASE_URL, start_url=START_URL, on_lists=None):
+    """
+    Async Step 1, with at most `concurrency` pages in flight; the host's rate
+    controller may allow fewer. `on_lists`, when given, is called with the
+    list rows of each page as soon as it is parsed, so a downstream stage can
+    start on them before they are flushed.
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for the async Step 1 fetch mode")
+
+    store = StateStore(state_db)
+    total_extracted=count_existing_lists(output_file)
+    if total_extracted >= MAX_LIST_URLS:
+        print("Already reached MAX_LIST_URLS limit.")
+        store.mark_step_complete(STATE_STEP)
+        return
+
+    logger = logging.getLogger("step1")
+    buffer_df=ColumnBuffer('lists')
+    unflushed_pages=[]
+    first_url = resume_page(store, start_url)
+    if first_url is None:
+        print("Step 1 has no pending pages.")
+        finish(store)
+        return
+    first_page = page_number(first_url)
+
+    controller = controller_for(start_url)
+    # The controller may already exist (shared with other steps), so the read-ahead is capped here.
+    read_ahead = min(concurrency, controller.max_concurrency)
+    connector = aiohttp.TCPConnector(limit=read_ahead, limit_per_host=read_ahead)
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(headers=DEFAULT_HEADERS, connector=connector, timeout=timeout) as session:
+        pages = crawl_list_pages(session, start_url, first_page, read_ahead, logger)
+        async with aclosing(pages):
+            async for page_url, html in pages:
+                print("Scraping the CURR_URL =", page_url)
+                logger.info(f"Processing Page URL: {page_url}")
+                if html is None:
+                    store.add_urls(STATE_STEP, [page_url])
+                    store.mark_failed(STATE_STEP, [page_url])
+                    metrics.count(STATE_STEP, "failed")
+                    break
+                try:
+                    rows, next_url = parse_list_summary_page(html, page_url, base_url)
+                    metrics.count(STATE_STEP, "ok")
+                except Exception as e:
+                    store.add_urls(STATE_STEP, [page_url])
+                    store.mark_failed(STATE_STEP, [page_url])
+                    metrics.count(STATE_STEP, "failed")
+                    logger.error(f"Error processing {page_url}: {e}")
+                    print("Terminating due to error.")
+                    print(e)
+                    break
+                print(f"Found {len(rows)} list items on the page.")
+                rows = rows[:MAX_LIST_URLS - total_extracted]
+                if on_lists:
+                    on_lists(rows)
+                for row in rows:
+                    buffer_df.append(row)
+                    total_extracted+=1
+                    if total_extracted>=MAX_LIST_URLS:
+                        logger.info("Reached MAX_LIST_URLS limit. Stopping Step-1.")
+                        print("Reaches 500 list")
+                        store.add_urls(STATE_STEP, [page_url])
+                        flush_pages(buffer_df, output_file, store, unflushed_pages + [page_url])
+                        store.mark_step_complete(STATE_STEP)
+                        return
+
+                logger.info(f"Completed Page URL: {page_url}")
+                store.add_urls(STATE_STEP, [page_url] + ([next_url] if next_url else []))
+                unflushed_pages.append(page_url)
+                if len(buffer_df)>=BATCH_SIZE:
+                    print(f"Flushing {len(buffer_df)} records to disk.")
+                    flush_pages(buffer_df, output_file, store, unflushed_pages)
+                if not next_url:
+                    break
+
+    print(f"Flushing remaining {len(buffer_df)} records to disk.")
+    flush_pages(buffer_df, output_file, store, unflushed_pages)
+    finish(store)
+    logger.info(f"Rate controller: {controller.snapshot()}")
     print("Scraping Completed.")
 
 if __name__ == "__main__":
     OUTPUT_FILE_LIST_URL='Output_list_url.csv'
-    CHECKPOINT_URL='list_url_checkpoint.txt'
-    list_url_extraction(OUTPUT_FILE_LIST_URL, CHECKPOINT_URL)
\ No newline at end of file
+    STATE_DB='state.sqlite3'
+    list_url_extraction(OUTPUT_FILE_LIST_URL, STATE_DB)
\ No newline at end of file
@@ -1,3 +1,4 @@
+import asyncio
 import numpy as np
 import pandas as pd
 import os
@@ -8,7 +9,24 @@ from bs4 import BeautifulSoup
 import logging
 import re
 import sys
-from playwright.sync_api import sync_playwright
+import threading
+from collections import deque
+from contextlib import nullcontext
+from playwright.async_api import async_playwright
+from resource_blocking import install_resource_blocking, install_resource_blocking_async
+from browser_session import BrowserSession, ColdStart, new_context_async
+from login import ensure_login
+from html_parser import make_soup
+from html_archive import archived, archive_page
+from output_sink import ColumnBuffer, is_parquet, output_end, read_table, write_csv, write_parquet
+from state_store import FAILED, StateStore
+from http_client import controller_for
+import metrics
+
+BASE_URL='https://letterboxd.com'
+MAX_MOVIE_PER_LIST=1000
+LIST_PAGE_SIZE=100
+STATE_STEP="step2"
 
 def ensure_parent_dir(path: str):
     parent = os.path.dirname(path)
@@ -25,32 +43,129 @@ def extract(tag, strip=True):
 
 
 def flush_to_disk(buffer_df, output_file):
-    temp_df = pd.DataFrame(buffer_df)
-    ensure_parent_dir(output_file)
-    temp_df.to_csv(
-        output_file,
-        mode='a',
-        header=not os.path.exists(output_file),
-        index=False
-    )
+    metrics.count(STATE_STEP, "rows_written", len(buffer_df))
+    with metrics.timer(STATE_STEP, "flush"):
+        if is_parquet(output_file):
+            write_parquet(buffer_df, output_file)
+            buffer_df.clear()
+            return
+        ensure_parent_dir(output_file)
+        write_csv(buffer_df, output_file)
 
     buffer_df.clear()
 
-def load_checkpoint(path):
-    if os.path.exists(path):
-        with open(path) as f:
-            return f.read().strip()
-    return None
-
-def mark_completed(checkpoint_path, url):
-    ensure_parent_dir(checkpoint_path)
-    with open(checkpoint_path, 'w') as f:
-        f.write(url)
-
-def extract_movie_urls_from_list(input_lists, output_movies, checkpoint):
-    USER_DATA_DIR = "browser_profile"
-    MAX_MOVIE_PER_LIST=1000
-    buffer_df=[]
+def parse_list_page(html, list_url, base_url):
+    with metrics.timer(STATE_STEP, "parse"):
+        soup = make_soup(html)
+    started = time.perf_counter()
+
+    tags_text=None
+    tags=soup.find('ul', class_='tags')
+    if tags:
+        tag_list=[extract(tag) for tag in tags.find_all('li') if extract(tag)]
+        tags_text=','.join(tag_list)
+    movie_urls=[]
+    container=soup.find('ul', class_='js-list-entries')
+    li_list=container.find_all('li', class_='posteritem')
+    for li in li_list:
+        react_div=li.select_one('div.react-component[data-item-link]')
+        if not react_div:
+            continue
+
+        movie_urls.append(base_url + react_div['data-item-link'])
+    # One row per movie; list_url and tags are stored once for the page.
+    rows=ColumnBuffer('movie_list')
+    rows.extend_column('movie_url', movie_urls, list_url=list_url, tags=tags_text)
+
+    page_next=soup.find('a', class_='next')
+    if page_next and page_next.has_attr('href'):
+        next_url=base_url+page_next['href']
+    else:
+        next_url=None
+    metrics.observe(STATE_STEP, "extract", time.perf_counter() - started)
+    return rows, next_url
+
+def load_film_counts(input_lists):
+    """list_url -> film_count from a Step 1 output (empty for inputs without the column)."""
+    if not os.path.exists(input_lists):
+        return {}
+    df = read_table(input_lists)
+    if 'film_count' not in df:
+        return {}
+    df = df.dropna(subset=['film_count']).drop_duplicates('list_url')
+    return dict(zip(df['list_url'], df['film_count'].astype(int)))
+
+def list_page_urls(list_url, film_count=None):
+    """
+    Page URLs of a list computed from Step 1's film count: LIST_PAGE_SIZE
+    films a page, and no page past MAX_MOVIE_PER_LIST. Only the first page
+    when the count is unknown; the rest are then found through a.next.
+    """
+    if film_count is None or film_count != film_count:
+        return [list_url]
+    pages = max(1, -(-min(int(film_count), MAX_MOVIE_PER_LIST) // LIST_PAGE_SIZE))
+    return [list_url] + [f"{list_url.rstrip('/')}/page/{n}/" for n in range(2, pages + 1)]
+
+def follow_next(urls, index, next_url, movie_count, list_url, logger):
+    """
+    Check page `index`'s a.next link against the planned `urls`; False when
+    the list ends at that page. Pages a.next finds beyond the plan (a list
+    that grew since Step 1, or one without a film count) are appended to
+    `urls`, and planned pages past the real end are dropped.
+    """
+    if movie_count >= MAX_MOVIE_PER_LIST:
+        return False
+    planned = urls[index + 1] if index + 1 < len(urls) else None
+    if next_url == planned:
+        return planned is not None
+    if planned is None:
+        urls.append(next_url)
+        return True
+    metrics.count(STATE_STEP, "page_plan_mismatch")
+    logger.warning(f"Page {index + 1} of {list_url} links to {next_url}, planned {planned}")
+    del urls[index + 1:]
+    if next_url is None:
+        return False
+    urls.append(next_url)
+    return True
+
+def resume_point(list_url, film_count, last_page=None):
+    """
+    (index of the next page, page URLs, rows written) of a list, continuing
+    after `last_page`, its last checkpoint from StateStore.last_page().
+    """
+    urls = list_page_urls(list_url, film_count)
+    if not last_page:
+        return 0, urls, 0
+    page, next_url, movies = last_page
+    if page >= len(urls) or urls[page] != next_url:
+        # The checkpoint's a.next wins over the plan; earlier pages are never fetched again.
+        urls = urls[:page] + [None] * (page - len(urls)) + [next_url]
+    return page, urls, movies
+
+def commit_page(store, rows, output_file, list_url, page, next_url, movies):
+    """
+    Append one page's rows to the output, then checkpoint the page with the
+    output's new end. A crash in between leaves rows past the last
+    checkpoint, which StateStore.reconcile_output() cuts off on restart.
+    """
+    flush_to_disk(rows, output_file)
+    store.commit_page(STATE_STEP, list_url, page, next_url, movies, output_end(output_file))
+
+def extract_movie_urls_from_list(input_lists, output_movies, state_db, block_resources=False, login=True,
+                                 base_url=BASE_URL, headless=None, browser_session=None, workers=1, stop=None,
+                                 journal_mode="WAL"):
+    """
+    Step 2. Runs headless from the login.py storage state (the interactive
+    login runs first if there is none and `login` is set). Pass a shared
+    BrowserSession to reuse a browser another step already launched; it is
+    used by the sequential path, while `workers` > 1 fetches that many list
+    pages at once in an async browser of its own.
+
+    Once `stop` (a threading.Event) is set, no further page is written or
+    checkpointed and the step returns without being marked complete.
+    `journal_mode` is passed to the StateStore of `state_db`.
+    """
     logger=logging.getLogger("step2")
     # logging.basicConfig(
     #     filename=LOGGING_FILE, filemode='a', level=logging.INFO,
@@ -60,165 +175,282 @@ def extract_movie_urls_from_list(input_lists, output_movies, checkpoint):
     #     "User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36",
     #     "Accept-Language":"en-US,en;q=0.9"
     # }
-    count=0
-    BASE_URL='https://letterboxd.com'
     CURR_URL=None
-    if os.path.exists(input_lists):
-        existing_df=pd.read_csv(input_lists)
-        list_urls=existing_df['list_url'].drop_duplicates().tolist()
-        print(f'Found {len(list_urls)} unique list URLs to process.')
-    else:
+    stop = stop or threading.Event()
+    if not os.path.exists(input_lists):
         print("Please run step1_list.py to generate the list of list URLs first.")
         sys.exit(1)
 
+    store = StateStore(state_db, journal_mode)
+    # Rows written after the last page checkpoint (a crash mid-page) are dropped first.
+    lost = store.reconcile_output(STATE_STEP, output_movies)
+    if lost:
+        print(f'{lost} page checkpoints had no rows in {output_movies}; those lists resume earlier.')
+    # Only rows Step 1 appended since the last run are read.
+    store.ingest(STATE_STEP, input_lists, 'list_url')
+    print(f'Found {store.count(STATE_STEP)} unique list URLs to process.')
+    store.recover(STATE_STEP)
+    pending_lists = store.pending(STATE_STEP)
     if os.path.exists(output_movies):
-        print(f'{output_movies} exists. Resuming from checkpoint if available.')
-        # seen_movie_urls = set(
-        #     pd.read_csv(output_movies, usecols=['movie_url'])['movie_url']
-        # )
-        
-    last_completed = load_checkpoint(checkpoint)
-    resume=bool(last_completed)
-    with sync_playwright() as p:
-        browser = p.chromium.launch_persistent_context(
-            USER_DATA_DIR,
-            headless=False,
-            viewport={"width": 1366, "height": 768},
-            locale="en-US",
-            timezone_id="Asia/Kolkata",
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--no-sandbox",
-                "--disable-infobars"
-            ]
-        )
-
-        browser.add_init_script("""
-        Object.defineProperty(navigator, 'webdriver', {
-            get: () => undefined
-        });
-        """)
-
-        page = browser.new_page()
-
-        # IMPORTANT: homepage first
-        page.goto("https://letterboxd.com/", wait_until="domcontentloaded")
-        page.wait_for_timeout(3000)
-
-        # Navigate normally
-        page.click("a[href='/sign-in/']")
-        page.wait_for_timeout(3000)
-
-        input("Log in manually, then press ENTER...")
-        browser.close()
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch_persistent_context(
-            user_data_dir=USER_DATA_DIR,
-            headless=False,
-            viewport={"width": 1366, "height": 768},
-            locale="en-US",
-            timezone_id="Asia/Kolkata",
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--no-sandbox",
-                "--disable-infobars"
-            ]
-        )
-
-        browser.add_init_script("""
-        Object.defineProperty(navigator, 'webdriver', {
-            get: () => undefined
-        });
-        """)
-
-        page = browser.new_page()
-
-        page.goto("https://letterboxd.com/", wait_until="domcontentloaded")
+        print(f'{output_movies} exists. Resuming with {len(pending_lists)} lists remaining.')
+    # Every page of a list is known up front from its film count.
+    film_counts = load_film_counts(input_lists) if pending_lists else {}
+
+    ensure_login(login)
+    cold_start = ColdStart(STATE_STEP)
+    if workers > 1:
+        asyncio.run(extract_movie_urls_pool(
+            store, pending_lists, film_counts, output_movies, workers, logger,
+            block_resources, headless, base_url, cold_start, stop
+        ))
+        if not stop.is_set() and not store.count(STATE_STEP, FAILED):
+            store.mark_step_complete(STATE_STEP)
+        print("Scraping Completed.")
+        return
+    with nullcontext(browser_session) if browser_session else BrowserSession(headless) as session:
+        context = session.new_context()
+        resource_stats = install_resource_blocking(context) if block_resources else None
+
+        page = context.new_page()
+
+        page.goto(base_url + "/", wait_until="domcontentloaded")
+        cold_start.page_loaded()
         page.wait_for_timeout(2000)
 
-        for list_url in list_urls:
-            movie_count=0
-            if resume:
-                if list_url != last_completed:
-                    continue
-                resume = False
-                continue
-                
-            CURR_URL = f"{list_url}"
+        for list_url in pending_lists:
+            if stop.is_set():
+                break
+            list_failed=False
+            page_index, page_urls, movie_count = resume_point(
+                list_url, film_counts.get(list_url), store.last_page(STATE_STEP, list_url)
+            )
             print(f"Starting processing for List URL: {list_url}")
-            while CURR_URL:
+            if page_index:
+                print(f"Resuming at page {page_index + 1}.")
+            while True:
+                CURR_URL = page_urls[page_index]
                 print(f"Processing List URL: {CURR_URL}")
                 logger.info(f"Processing Page URL: {CURR_URL}")
                 try:
-                    page.goto(CURR_URL, wait_until="domcontentloaded", timeout=30000)
-                    page.wait_for_selector("ul.js-list-entries", timeout=8000)
+                    html = archived(CURR_URL)
+                    if html is None:
+                        controller = controller_for(CURR_URL)
+                        with metrics.timer(STATE_STEP, "queue"):
+                            started = controller.acquire()
+                        try:
+                            with metrics.timer(STATE_STEP, "navigate"):
+                                response = page.goto(CURR_URL, wait_until="domcontentloaded", timeout=30000)
+                            with metrics.timer(STATE_STEP, "wait"):
+                                page.wait_for_selector("ul.js-list-entries", timeout=8000)
+                            html = page.content()
+                        except Exception:
+                            controller.record(started, error=True)
+                            raise
+                        except BaseException:
+                            controller.release()
+                            raise
+                        controller.record(started, response.status if response else None, html)
+                        metrics.count(STATE_STEP, "bytes", len(html.encode("utf-8")))
+                        if 'js-list-entries' not in html:
+                            logger.error(f"Incomplete list page: {CURR_URL}")
+                            list_failed=True
+                            break
+                        archive_page(CURR_URL, html)
 
-                    html = page.content()
-                    if 'js-list-entries' not in html:
-                        logger.error(f"Incomplete list page: {CURR_URL}")
+                    rows, next_url = parse_list_page(html, list_url, base_url)
+                    metrics.count(STATE_STEP, "ok")
+                    rows.truncate(MAX_MOVIE_PER_LIST - movie_count)
+                    movie_count+=len(rows)
+                    more = follow_next(page_urls, page_index, next_url, movie_count, list_url, logger)
+                    if stop.is_set():
                         break
+                    # The page's rows and its checkpoint go together; the last page's also marks the list done.
+                    commit_page(store, rows, output_movies, list_url, page_index + 1,
+                                page_urls[page_index + 1] if more else None, movie_count)
+
+                    if movie_count>=MAX_MOVIE_PER_LIST:
+                        logger.info(
+                            f"Reached {MAX_MOVIE_PER_LIST} movies for list {list_url}. Moving to next list."
+                            )
+                        print(f"Reached {MAX_MOVIE_PER_LIST} movies for list {list_url}. Moving to next list.")
 
-                    soup = BeautifulSoup(html, "html.parser")
-
-                    row={'list_url':None, 'movie_url':None, 'tags':None}
-                    row['list_url']=list_url
-                    tags=soup.find('ul', class_='tags')
-                    if tags:
-                        tag_list=[extract(tag) for tag in tags.find_all('li') if extract(tag)]
-                        row['tags']=','.join(tag_list)
-                    container=soup.find('ul', class_='js-list-entries')
-                    li_list=container.find_all('li', class_='posteritem')
-                    for li in li_list:
-                        react_div=li.select_one('div.react-component[data-item-link]')
-                        if not react_div:
-                            continue
-                        
-                        movie_url=BASE_URL + react_div['data-item-link']
-                        movie_count+=1
-                        # if movie_url in seen_movie_urls:
-                        #     continue
-                        # seen_movie_urls.add(movie_url)
-                        row['movie_url']=movie_url
-                        buffer_df.append(row.copy())
-
-                        if movie_count>=MAX_MOVIE_PER_LIST:
-                            print(f"Flushing {len(buffer_df)} records after list completion.")
-                            flush_to_disk(buffer_df, output_movies)
-                            logger.info(
-                                f"Reached {MAX_MOVIE_PER_LIST} movies for list {list_url}. Moving to next list."
-                                )
-                            print(f"Reached {MAX_MOVIE_PER_LIST} movies for list {list_url}. Moving to next list.")
-                            break
-                    
                     logger.info(f"Completed Page URL: {CURR_URL}")
-                    if movie_count >= MAX_MOVIE_PER_LIST:
+                    if resource_stats:
+                        logger.info(f"Resources for {CURR_URL}: {resource_stats.page_report()}")
+                    if not more:
                         break
-                    page_next=soup.find('a', class_='next')
-                    if page_next and page_next.has_attr('href'):
-                        CURR_URL=BASE_URL+page_next['href']
-                    else:
-                        CURR_URL=None
+                    page_index+=1
                 except Exception as e:
                     logger.error(f"Error processing {CURR_URL}: {e}")
-                    CURR_URL=None
+                    list_failed=True
                     print("Terminating due to error.")
                     print(e)
-                count+=1
-            mark_completed(checkpoint, list_url)
-            if buffer_df:
-                print(f"Flushing {len(buffer_df)} records after list completion.")
-                flush_to_disk(buffer_df, output_movies)
-
-        if buffer_df:
-            print(f"Flushing remaining {len(buffer_df)} records to disk.")
-            flush_to_disk(buffer_df, output_movies)
-            mark_completed(checkpoint, "COMPLETED")
-            print("Scraping Completed.")
-        browser.close()
+                    break
+            if list_failed:
+                # Its checkpointed pages stay; the next run resumes at the page that failed.
+                store.mark_failed(STATE_STEP, [list_url])
+                metrics.count(STATE_STEP, "failed")
+
+        if not stop.is_set() and not store.count(STATE_STEP, FAILED):
+            store.mark_step_complete(STATE_STEP)
+        print("Scraping Completed.")
+        if resource_stats:
+            print(resource_stats.summary())
+            logger.info(resource_stats.summary())
+        context.close()
+
+async def fetch_list_page_async(pages, url, logger, resource_stats=None):
+    """
+    HTML of one list page, from the archive or loaded on a Playwright page
+    borrowed from the `pages` pool (an asyncio.Queue); None when incomplete.
+    """
+    html = archived(url)
+    if html is not None:
+        return html
+    page = await pages.get()
+    try:
+        logger.info(f"Processing Page URL: {url}")
+        controller = controller_for(url)
+        with metrics.timer(STATE_STEP, "queue"):
+            started = await controller.acquire_async()
+        try:
+            with metrics.timer(STATE_STEP, "navigate"):
+                response = await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            with metrics.timer(STATE_STEP, "wait"):
+                await page.wait_for_selector("ul.js-list-entries", timeout=8000)
+            html = await page.content()
+        except asyncio.CancelledError:
+            # ListPages.cancel() stopped a load nobody will read; it says nothing about the host.
+            controller.release()
+            raise
+        except Exception:
+            controller.record(started, error=True)
+            raise
+        controller.record(started, response.status if response else None, html)
+    finally:
+        pages.put_nowait(page)
+    if resource_stats:
+        resource_stats.pages += 1
+    metrics.count(STATE_STEP, "bytes", len(html.encode("utf-8")))
+    if 'js-list-entries' not in html:
+        logger.error(f"Incomplete list page: {url}")
+        return None
+    archive_page(url, html)
+    return html
+
+class ListPages:
+    """
+    The remaining pages of one list, resumed after `last_page` (its last
+    checkpoint) and loading at once on the `pages` pool from the moment this
+    is created. parsed() yields them in page order as (page number, rows,
+    next page URL or None on the last page); rows are capped at
+    MAX_MOVIE_PER_LIST overall and `failed` is set when a page is incomplete.
+    """
+
+    def __init__(self, pages, list_url, logger, base_url=BASE_URL, film_count=None, last_page=None,
+                 resource_stats=None):
+        self.pages, self.list_url, self.logger, self.base_url = pages, list_url, logger, base_url
+        self.resource_stats = resource_stats
+        self.index, self.urls, self.movies = resume_point(list_url, film_count, last_page)
+        self.failed = False
+        # Pages past the list's real end (it shrank since Step 1) are fetched but never read.
+        self.fetches = {url: asyncio.ensure_future(self.fetch(url)) for url in self.urls[self.index:]}
+
+    def fetch(self, url):
+        return fetch_list_page_async(self.pages, url, self.logger, self.resource_stats)
+
+    async def parsed(self):
+        while True:
+            url = self.urls[self.index]
+            fetch = self.fetches.pop(url, None)
+            html = await (fetch or self.fetch(url))
+            if html is None:
+                self.failed = True
+                return
+            rows, next_url = parse_list_page(html, self.list_url, self.base_url)
+            metrics.count(STATE_STEP, "ok")
+            rows.truncate(MAX_MOVIE_PER_LIST - self.movies)
+            self.movies += len(rows)
+            self.logger.info(f"Completed Page URL: {url}")
+            more = follow_next(self.urls, self.index, next_url, self.movies, self.list_url, self.logger)
+            self.index += 1
+            yield self.index, rows, self.urls[self.index] if more else None
+            if not more:
+                return
+
+    def cancel(self):
+        """Stop the page loads nobody will read (after the end, or a failure)."""
+        for fetch in self.fetches.values():
+            if fetch.done() and not fetch.cancelled():
+                fetch.exception()
+            fetch.cancel()
+        self.fetches.clear()
+
+async def new_page_pool(context, size):
+    pages = asyncio.Queue()
+    for _ in range(size):
+        pages.put_nowait(await context.new_page())
+    return pages
+
+async def close_page_pool(pages):
+    while not pages.empty():
+        await pages.get_nowait().close()
+
+async def extract_movie_urls_pool(store, pending_lists, film_counts, output_movies, workers, logger,
+                                  block_resources=False, headless=None, base_url=BASE_URL, cold_start=None,
+                                  stop=None):
+    """
+    Scrape lists with `workers` pages open at once, shared by the pages of
+    one list and of the next few lists. Pages are written and checkpointed
+    in list and page order, whatever order they finish loading in.
+    """
+    async with async_playwright() as p:
+        browser, context = await new_context_async(p, headless)
+        resource_stats = await install_resource_blocking_async(context) if block_resources else None
+        pages = await new_page_pool(context, workers)
+
+        async def finish(list_pages):
+            list_url = list_pages.list_url
+            try:
+                async for number, rows, next_url in list_pages.parsed():
+                    if stop is not None and stop.is_set():
+                        break
+                    if cold_start:
+                        cold_start.page_loaded()
+                    commit_page(store, rows, output_movies, list_url, number, next_url, list_pages.movies)
+            except Exception as e:
+                logger.error(f"Error processing {list_url}: {e}")
+                list_pages.failed = True
+            finally:
+                list_pages.cancel()
+            if list_pages.failed:
+                # Its checkpointed pages stay; the next run resumes at the page that failed.
+                store.mark_failed(STATE_STEP, [list_url])
+                metrics.count(STATE_STEP, "failed")
+
+        # Up to `workers` lists in flight keeps every page busy, even on one-page lists.
+        in_flight = deque()
+        for list_url in pending_lists:
+            if stop is not None and stop.is_set():
+                break
+            print(f"Starting processing for List URL: {list_url}")
+            in_flight.append(ListPages(pages, list_url, logger, base_url, film_counts.get(list_url),
+                                       store.last_page(STATE_STEP, list_url), resource_stats))
+            if len(in_flight) >= workers:
+                await finish(in_flight.popleft())
+        while in_flight:
+            await finish(in_flight.popleft())
+
+        if resource_stats:
+            # Pages share one context here, so only the per-page average is meaningful.
+            print(resource_stats.summary())
+            logger.info(resource_stats.summary())
+        await close_page_pool(pages)
+        await context.close()
+        await browser.close()
 
 if __name__ == "__main__":
     OUTPUT_FILE_LIST_URL='Output_list_url.csv'
-    CHECKPOINT_MOVIE_URL='Movie_url_checkpoint.txt'
+    STATE_DB='state.sqlite3'
     OUTPUT_FILE_MOVIE_URL='Output_movie_url.csv'
-    extract_movie_urls_from_list(OUTPUT_FILE_LIST_URL, OUTPUT_FILE_MOVIE_URL, CHECKPOINT_MOVIE_URL)
\ No newline at end of file
+    extract_movie_urls_from_list(OUTPUT_FILE_LIST_URL, OUTPUT_FILE_MOVIE_URL, STATE_DB)
\ No newline at end of file
@@ -1,216 +1,236 @@
+import numpy as np
 import pandas as pd
 import os
 import logging
 import re
 import traceback
+import time
 import sys
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright
+from contextlib import nullcontext
+from playwright.async_api import async_playwright
+from html_parser import make_soup
+from movie_extractor import extract_into, extract_movie
+from html_archive import archived, archive_page
+from output_sink import ColumnBuffer, is_parquet, read_table, write_csv, write_parquet
+from state_store import DONE, FAILED, PENDING, StateStore
+from http_client import controlled_get, controller_for, make_session
+import metrics
+from resource_blocking import install_resource_blocking, install_resource_blocking_async
+from browser_session import BrowserSession, ColdStart, new_context_async
+from login import ensure_login
 
 def ensure_parent_dir(path: str):
     parent = os.path.dirname(path)
     if parent:
         os.makedirs(parent, exist_ok=True)
 
-def extract(tag, strip=True):
-    if not tag:
-        return None
-    text = tag.get_text(strip=strip)
-    return text.replace("&nbsp;", " ") if text else None
-
 def flush_to_disk(buffer_df, output_file):
-    df = pd.DataFrame(buffer_df)
-    ensure_parent_dir(output_file)
-    df.to_csv(
-        output_file,
-        mode="a",
-        header=not os.path.exists(output_file),
-        index=False
-    )
+    metrics.count(STATE_STEP, "rows_written", len(buffer_df))
+    with metrics.timer(STATE_STEP, "flush"):
+        if is_parquet(output_file):
+            write_parquet(buffer_df, output_file)
+            buffer_df.clear()
+            return
+        ensure_parent_dir(output_file)
+        write_csv(buffer_df, output_file)
     buffer_df.clear()
 
-def load_checkpoint(path):
-    if os.path.exists(path):
-        with open(path) as f:
-            return f.read().strip()
-    return None
-
-def mark_completed(path, url):
-    ensure_parent_dir(path)
-    with open(path, "w") as f:
-        f.write(url)
-
-def extract_rating_count(a_tag):
-    if not a_tag:
-        return None
+def flush_movies(buffer_df, output_file, store, failed, coverage=None):
+    """Write the buffered rows, then record their URLs as done in one transaction."""
+    done = buffer_df.column('movie_url')
+    metrics.count(STATE_STEP, "ok", len(done))
+    metrics.count(STATE_STEP, "failed", len(failed))
+    if buffer_df:
+        flush_to_disk(buffer_df, output_file)
+    store.mark_done(STATE_STEP, done)
+    store.mark_failed(STATE_STEP, failed)
+    failed.clear()
+    if coverage:
+        coverage.add(done)
+
+class Coverage:
+    """
+    Share of the list-movie edges whose movie is scraped, from the reference
+    counts StateStore.ingest() keeps for "references" / "likes" order;
+    updated and printed as each batch of movies is flushed.
+    """
 
-    title = a_tag.get("data-original-title")
-    if not title:
+    def __init__(self, store, logger, weighted=False):
+        self.store, self.logger, self.weighted = store, logger, weighted
+        self.total, self.total_weight = store.references(STATE_STEP)
+        # Movies done before this run (including ones already in the output).
+        self.done, self.done_weight = store.references(STATE_STEP, status=DONE)
+
+    def add(self, urls):
+        refs, weight = self.store.references(STATE_STEP, urls)
+        self.done += refs
+        self.done_weight += weight
+        metrics.count(STATE_STEP, "edges_covered", refs)
+        self.report()
+
+    def report(self):
+        if not self.total:
+            return
+        message = f"Coverage: {self.done / self.total:.1%} of list-movie edges have movie data ({self.done}/{self.total})"
+        if self.weighted and self.total_weight:
+            message += f", {self.done_weight / self.total_weight:.1%} like-weighted"
+        print(message)
+        self.logger.info(message)
+
+def list_weights(lists_file):
+    """list_url -> 1 + log(1 + like_count): how much a list's references count in "likes" order."""
+    lists = read_table(lists_file, ['list_url', 'like_count']).dropna().drop_duplicates('list_url')
+    return dict(zip(lists['list_url'], 1 + np.log1p(lists['like_count'].astype(float))))
+
+STATE_STEP = "step3"
+BASE_URL = "https://letterboxd.com"
+FLUSH_SIZE = 100
+ORDERS = ("input", "references", "likes")
+
+HISTOGRAM_COLUMNS = [
+    'half_stars', 'one_stars', 'one_and_half_stars', 'two_stars', 'two_and_half_stars',
+    'three_stars', 'three_and_half_stars', 'four_stars', 'four_and_half_stars', 'five_stars'
+]
+
+FRAGMENT_PATHS = {
+    "ratings": "/csi/film/{slug}/rating-histogram/",
+    "stats": "/csi/film/{slug}/stats/",
+}
+FRAGMENT_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fragments")
+
+MOVIE_READY_SELECTOR = "span.average-rating, div.rating-histogram, div.production-statistic"
+
+def parse_movie_page(html, movie_url, logger):
+    with metrics.timer(STATE_STEP, "parse"):
+        soup = make_soup(html)
+    with metrics.timer(STATE_STEP, "extract"):
+        return extract_movie(soup, movie_url, logger)
+
+def is_rendered_copy(html):
+    """An archived page can stand in for a browser render only if it has the histogram too."""
+    return 'id="content"' in html and 'rating-histogram' in html
+
+def scrape_movie_browser(page, movie_url, logger):
+    html = archived(movie_url)
+    if html is not None and is_rendered_copy(html):
+        metrics.count(STATE_STEP, "archived")
+        return parse_movie_page(html, movie_url, logger)
+
+    controller = controller_for(movie_url)
+    with metrics.timer(STATE_STEP, "queue"):
+        started = controller.acquire()
+    try:
+        with metrics.timer(STATE_STEP, "navigate"):
+            response = page.goto(movie_url, wait_until="domcontentloaded", timeout=30000)
+        try:
+            with metrics.timer(STATE_STEP, "wait"):
+                page.wait_for_selector(MOVIE_READY_SELECTOR, timeout=5000)
+        except Exception:
+            print("[MAIN] Rating/stats not visible yet, scraping anyway")
+
+        with metrics.timer(STATE_STEP, "settle"):
+            page.wait_for_timeout(1000)
+
+        html = page.content()
+    except Exception:
+        controller.record(started, error=True)
+        raise
+    except BaseException:
+        controller.release()
+        raise
+    controller.record(started, response.status if response else None, html)
+    metrics.count(STATE_STEP, "bytes", len(html.encode("utf-8")))
+
+    if 'id="content"' not in html:
+        logger.error(f"Blocked or incomplete HTML for {movie_url}")
         return None
+    archive_page(movie_url, html)
+    return parse_movie_page(html, movie_url, logger)
 
-    m = re.search(r'([\d,]+)', title)
+def fragment_urls(movie_url):
+    """Server-side include URLs for the lazily-loaded rating histogram and stats blocks."""
+    parts = urlsplit(movie_url)
+    m = re.search(r'/film/([^/]+)', parts.path)
     if not m:
+        return {}
+    base = f"{parts.scheme}://{parts.netloc}"
+    return {name: base + path.format(slug=m.group(1)) for name, path in FRAGMENT_PATHS.items()}
+
+def fetch_html(session, url, logger, expect_content=True):
+    html = archived(url)
+    if html is not None:
+        return html
+    try:
+        response = controlled_get(session, url, expect_content=expect_content, step=STATE_STEP, timeout=10)
+        response.raise_for_status()
+        archive_page(url, response.text)
+        return response.text
+    except Exception as e:
+        logger.warning(f"HTTP fetch failed for {url}: {e}")
         return None
 
-    return int(m.group(1).replace(',', ''))
+def apply_fragments(fragments, row):
+    for name in ["ratings", "stats"]:
+        if fragments.get(name):
+            extract_into(make_soup(fragments[name]), row)
 
-def convert_k_m(value):
-    if value is None:
-        return None
-    value = str(value).strip()
-    try:
-        if value.endswith("K"):
-            return float(value[:-1]) * 1_000
-        if value.endswith("M"):
-            return float(value[:-1]) * 1_000_000
-        return float(value.replace(",", ""))
-    except:
-        return None
-    
-def fetch_stats(soup, row):
+def scrape_movie_http(session, movie_url, logger):
     """
-    Attempt to extract watches / lists / likes
-    directly from the movie page HTML.
+    Fetch the server-rendered page and the ratings/stats fragments
+    concurrently over plain HTTP and parse them into one row.
+    Returns None when the page looks blocked, or the histogram is missing
+    and its fragment could not be fetched, so the caller falls back to Playwright.
     """
+    urls = fragment_urls(movie_url)
+    futures = {name: FRAGMENT_EXECUTOR.submit(fetch_html, session, url, logger, False) for name, url in urls.items()}
+    html = fetch_html(session, movie_url, logger)
+    fragments = {name: future.result() for name, future in futures.items()}
+    if html is None or 'id="content"' not in html:
+        return None
+    row = parse_movie_page(html, movie_url, logger)
+    apply_fragments(fragments, row)
+    if fragments.get("ratings") is None and all(row[col] is None for col in HISTOGRAM_COLUMNS):
+        return None
+    return row
 
-    stats = soup.select("div.production-statistic")
-
-    if not stats:
-        # print("[STATS-MAIN] ❌ No production-statistic blocks found")
+def report_fetch_counts(fetch_counts, logger):
+    total = fetch_counts["http"] + fetch_counts["browser"]
+    if not total:
         return
-
-    for div in stats:
-        classes = div.get("class", [])
-        label = div.find("span", class_="label")
-        value = convert_k_m(extract(label))
-
-        if "-watches" in classes:
-            row["movie_watched_by"] = value
-        elif "-lists" in classes:
-            row["movie_listed_by"] = value
-        elif "-likes" in classes:
-            row["movie_liked_by"] = value
-
-    # print(
-    #     "[STATS-MAIN] ✅",
-    #     row["movie_watched_by"],
-    #     row["movie_listed_by"],
-    #     row["movie_liked_by"]
-    # )
-
-def fetch_ratings(soup, row):
+    message = (f'Fetch paths: {fetch_counts["http"]} via HTTP, {fetch_counts["browser"]} via browser '
+               f'({fetch_counts["http"] / total:.0%} of pages skipped the browser)')
+    print(message)
+    logger.info(message)
+
+def extract_movie_data(input_movie_urls, output_movie_data, state_db, workers=1, fetch_mode="browser",
+                       block_resources=False, login=True, base_url=BASE_URL, headless=None,
+                       browser_session=None, order="input", lists_file=None, stop=None, journal_mode="WAL"):
     """
-    Attempt to extract rating + histogram
-    directly from the movie page HTML.
+    Step 3. Runs headless from the login.py storage state (the interactive
+    login runs first if there is none and `login` is set). A shared
+    BrowserSession is reused by the sequential path; the async worker pool
+    (workers > 1) launches its own browser from the same saved state.
+
+    `order` is "input" (first seen in the edges first), "references" (films
+    in the most lists first) or "likes" (each list counted by the
+    1 + log(1 + like_count) of `lists_file`). The last two report the share
+    of edges with movie data after every flush, so a cut-short run covers as
+    many edges as it can.
+
+    Once `stop` (a threading.Event) is set, no further batch is written or
+    marked done and the step returns without being marked complete.
+    `journal_mode` is passed to the StateStore of `state_db`.
     """
-
-    avg = soup.select_one("span.average-rating")
-    if avg:
-        row["rating"] = extract(avg)
-    # else:
-    #     print("[RATINGS-MAIN] ❌ average-rating not found")
-
-    fans = soup.select_one("a.all-link.more-link")
-    if fans and "fan" in fans.text.lower():
-        row["fans_count"] = convert_k_m(
-            extract(fans).replace("fans", "").strip()
-        )
-    bars=soup.select_one('div.rating-histogram')
-    if bars:
-        histogram = bars.select_one('ul')
-    else:
-        return
-    if not histogram:
-        # print("[RATINGS-MAIN] ❌ rating histogram not found")
-        return
-
-    STAR_MAP = {
-        "½": "half_stars",
-        "★": "one_stars",
-        "★½": "one_and_half_stars",
-        "★★": "two_stars",
-        "★★½": "two_and_half_stars",
-        "★★★": "three_stars",
-        "★★★½": "three_and_half_stars",
-        "★★★★": "four_stars",
-        "★★★★½": "four_and_half_stars",
-        "★★★★★": "five_stars",
-    }
-
-    for li in histogram.select('li.rating-histogram-bar'):
-        a = li.select_one('a.bar')
-        if not a:
-            continue
-
-        title = a.get('data-original-title', '')
-        if not title:
-            continue
-        title = title.replace('half-★', '½')
-        m = re.search(r'([\d,]+)', title)
-        if not m:
-            continue
-
-        count = int(m.group(1).replace(',', ''))
-
-        star_match=re.search(r'([\u00BD★]+)', title)
-        if not star_match:
-            # print("[RATINGS-MAIN] ❌ Star symbol not found:", title)
-            continue
-        stars=star_match.group(1)
-        # print("[RATINGS-MAIN] Parsed:", stars, count)
-        col = STAR_MAP.get(stars)
-        if col:
-            row[col] = count
-
-    # print("[RATINGS-MAIN] ✅ rating:", row["rating"])
-
-def fetch_imdb_tmdb(duration_text, second_container, row):
-    duration_match=re.search(r'(\d+)\s*min', duration_text)
-    if duration_match:
-        row['duration']=duration_match.group(1)
-
-    for a in second_container.find_all('a', href=True):
-        href = a['href']
-
-        if 'imdb.com/title/tt' in href:
-            row['imdb'] = href
-            m = re.search(r'(tt\d+)', href)
-            if m:
-                row['imdb_id'] = m.group(1)
-
-        elif 'themoviedb.org/movie/' in href:
-            row['tmdb'] = href
-            m = re.search(r'/movie/(\d+)', href)
-            if m:
-                row['tmdb_id'] = m.group(1)
-
-def fetch_info_section(info_section, row, roles_dict, id_name, class_name=None):
-    tab=info_section.find('div', id=id_name) if info_section else None
-    if tab:
-        for h3 in tab.find_all('h3'):
-            if class_name:
-                span=h3.find('span', class_=class_name)
-            else:
-                span=h3.find('span')
-            if not span:
-                continue
-            texts=extract(span)
-            normalization=None
-            for raw, normalized in roles_dict.items():
-                if raw.lower() in texts.lower():
-                    normalization=normalized
-                    break
-            if not normalization:
-                continue
-            people_div=h3.find_next_sibling('div', class_='text-sluglist')
-            if not people_div:
-                continue
-            row[normalization]=', '.join(
-                [extract(a) for a in people_div.find_all('a') if extract(a)]
-            )
-
-def extract_movie_data(input_movie_urls, output_movie_data, checkpoint):
-    buffer_df=[]
+    if order not in ORDERS:
+        raise ValueError(f"Unknown Step 3 order {order!r}; expected one of {ORDERS}")
+    if order == "likes" and not lists_file:
+        raise ValueError('Step 3 order "likes" needs the Step 1 lists file')
+    buffer_df=ColumnBuffer('movie_data')
     logger=logging.getLogger("step3")
     if not logger.handlers:
         logging.basicConfig(
@@ -221,240 +241,244 @@ def extract_movie_data(input_movie_urls, output_movie_data, checkpoint):
         )
     
     count=0
-    BASE_URL='https://letterboxd.com'
     CURR_URL=None
-    seen_movie_data=set()
-    if os.path.exists(output_movie_data):
-        print(f'{output_movie_data} exists. Resuming from checkpoint if available.')
-        seen_movie_data = set(
-            pd.read_csv(output_movie_data, usecols=['movie_url'])['movie_url']
-        )
-
-    if os.path.exists(input_movie_urls):
-        existing_df=pd.read_csv(input_movie_urls)
-        movie_urls=existing_df['movie_url'].unique().tolist()
-        print(f'Found {len(movie_urls)} unique list URLs to process.')
-        print(f'{len(movie_urls) - len(seen_movie_data)} is remaining')
-    else:
+    stop = stop or threading.Event()
+    if not os.path.exists(input_movie_urls):
         print("Please run step2_list.py to generate the movie URLs first.")
         sys.exit(1)
 
-    last_completed = load_checkpoint(checkpoint)
-    resume=bool(last_completed)
-    USER_DATA_DIR = "browser_profile"
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch_persistent_context(
-            USER_DATA_DIR,
-            headless=False,
-            viewport={"width": 1366, "height": 768},
-            locale="en-US",
-            timezone_id="Asia/Kolkata",
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--no-sandbox",
-                "--disable-infobars"
-            ]
-        )
+    store = StateStore(state_db, journal_mode)
+    if not store.count(STATE_STEP) and os.path.exists(output_movie_data):
+        # First run against the state store: movies already in the output are done.
+        print(f'{output_movie_data} exists. Marking its movies as done.')
+        store.ingest(STATE_STEP, output_movie_data, 'movie_url', status=DONE)
+    # Only edges Step 2 appended since the last run are read; known movies are skipped by the store.
+    if order == "input":
+        store.ingest(STATE_STEP, input_movie_urls, 'movie_url')
+    else:
+        # Each edge also counts as a reference to its movie, weighted by its list in "likes" order.
+        weights = list_weights(lists_file) if order == "likes" else None
+        store.ingest(STATE_STEP, input_movie_urls, 'movie_url', referrer='list_url', weights=weights)
+    store.recover(STATE_STEP)
+    print(f'Found {store.count(STATE_STEP)} unique movie URLs to process.')
+    print(f'{store.count(STATE_STEP, PENDING)} is remaining')
+    by_priority = order != "input"
+    coverage = Coverage(store, logger, weighted=order == "likes") if by_priority else None
+    if coverage:
+        coverage.report()
+
+    fetch_counts={"http": 0, "browser": 0}
+    session = make_session(pool_size=max(workers, 1)) if fetch_mode == "hybrid" else None
+
+    ensure_login(login)
+    cold_start = ColdStart(STATE_STEP)
+    if workers > 1:
+        asyncio.run(extract_movie_data_pool(
+            store, output_movie_data, workers, logger,
+            session, fetch_counts, block_resources, headless, cold_start, by_priority, coverage, stop
+        ))
+    else:
+        with nullcontext(browser_session) if browser_session else BrowserSession(headless) as shared:
+            context = shared.new_context()
+            resource_stats = install_resource_blocking(context) if block_resources else None
+            page=context.new_page()
+            page.goto(base_url, wait_until="domcontentloaded", timeout=30000)
+            cold_start.page_loaded()
+
+            while not stop.is_set():
+                batch = store.claim(STATE_STEP, FLUSH_SIZE, by_priority)
+                if not batch:
+                    break
+                failed=[]
+                for movie_url in batch:
+                    CURR_URL=f"{movie_url}"
+                    print(f'Start Processing Movie URL: {CURR_URL}')
+                    logger.info(f"Processing {movie_url}")
+                    try:
+                        row = scrape_movie_http(session, movie_url, logger) if session else None
+                        if row is not None:
+                            fetch_counts["http"]+=1
+                        else:
+                            row = scrape_movie_browser(page, movie_url, logger)
+                            if resource_stats:
+                                logger.info(f"Resources for {movie_url}: {resource_stats.page_report()}")
+                            if row is None:
+                                failed.append(movie_url)
+                                continue
+                            fetch_counts["browser"]+=1
+                        buffer_df.append(row)
+                        logger.info(f"Completed Page URL: {CURR_URL}")
+                        context.set_default_navigation_timeout(45000)
+                        context.set_default_timeout(30000)
+                    except Exception as e:
+                        logger.error(f"Error processing URL: {CURR_URL} with error: {e}")
+                        print("Terminating due to error.")
+                        traceback.print_exc()
+                        failed.append(movie_url)
+                    count+=1
+                if stop.is_set():
+                    # The claimed batch is left in progress; recover() hands it out again.
+                    break
+                flush_movies(buffer_df, output_movie_data, store, failed, coverage)
+                print(f'Flushed data to disk after processing {count} URLs.')
+                report_fetch_counts(fetch_counts, logger)
+            if resource_stats:
+                print(resource_stats.summary())
+                logger.info(resource_stats.summary())
+            context.close()
+
+    report_fetch_counts(fetch_counts, logger)
+    if not stop.is_set() and not store.count(STATE_STEP, FAILED):
+        store.mark_step_complete(STATE_STEP)
+    print('Scraping completed.')
+
+async def scrape_movie_async(page, movie_url, logger):
+    html = archived(movie_url)
+    if html is not None and is_rendered_copy(html):
+        metrics.count(STATE_STEP, "archived")
+        return parse_movie_page(html, movie_url, logger)
+
+    controller = controller_for(movie_url)
+    with metrics.timer(STATE_STEP, "queue"):
+        started = await controller.acquire_async()
+    try:
+        with metrics.timer(STATE_STEP, "navigate"):
+            response = await page.goto(movie_url, wait_until="domcontentloaded", timeout=30000)
+        try:
+            with metrics.timer(STATE_STEP, "wait"):
+                await page.wait_for_selector(MOVIE_READY_SELECTOR, timeout=5000)
+        except Exception:
+            print("[MAIN] Rating/stats not visible yet, scraping anyway")
+        with metrics.timer(STATE_STEP, "settle"):
+            await page.wait_for_timeout(1000)
+
+        html = await page.content()
+    except asyncio.CancelledError:
+        controller.release()
+        raise
+    except Exception:
+        controller.record(started, error=True)
+        raise
+    controller.record(started, response.status if response else None, html)
+    metrics.count(STATE_STEP, "bytes", len(html.encode("utf-8")))
+    if 'id="content"' not in html:
+        logger.error(f"Blocked or incomplete HTML for {movie_url}")
+        return None
+    archive_page(movie_url, html)
+    return parse_movie_page(html, movie_url, logger)
 
-        browser.add_init_script("""
-        Object.defineProperty(navigator, 'webdriver', {
-            get: () => undefined
-        });
-        """)
-
-        page = browser.new_page()
-
-        # IMPORTANT: homepage first
-        page.goto("https://letterboxd.com/", wait_until="domcontentloaded")
-        page.wait_for_timeout(3000)
-
-        # Navigate normally
-        page.click("a[href='/sign-in/']")
-        page.wait_for_timeout(3000)
-
-        input("Log in manually, then press ENTER...")
-        browser.close()
-    with sync_playwright() as p:
-        browser = p.chromium.launch_persistent_context(
-            user_data_dir=USER_DATA_DIR,
-            headless=False,
-            viewport={"width": 1366, "height": 768},
-            locale="en-US",
-            timezone_id="Asia/Kolkata",
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--no-sandbox",
-                "--disable-infobars"
-            ]
-        )
-        browser.add_init_script("""
-        Object.defineProperty(navigator, 'webdriver', {
-            get: () => undefined
-        });
-        """)
-        context=browser
-        page=context.new_page()
-        page.goto(BASE_URL, wait_until="domcontentloaded", timeout=30000)
-
-        for movie_url in movie_urls:
-            if resume:
-                if movie_url != last_completed:
-                    continue
-                resume = False
-                continue
-
-            if movie_url in seen_movie_data:
-                continue
-
-            CURR_URL=f"{movie_url}"
-            print(f'Start Processing Movie URL: {CURR_URL}')
+async def movie_worker(context, work_queue, results, logger, session, fetch_counts, cold_start=None):
+    page = await context.new_page()
+    try:
+        while True:
+            movie_url = await work_queue.get()
+            if movie_url is None:
+                break
+            print(f'Start Processing Movie URL: {movie_url}')
             logger.info(f"Processing {movie_url}")
             try:
-                page.goto(movie_url, wait_until="domcontentloaded", timeout=30000)
-
-                try:
-                    page.wait_for_selector(
-                        "span.average-rating, div.rating-histogram, div.production-statistic",
-                        timeout=5000
-                    )
-                except:
-                    print("[MAIN] Rating/stats not visible yet, scraping anyway")
-
-                page.wait_for_timeout(1000)
-
-                html = page.content()
-
-                if 'id="content"' not in html:
-                    logger.error(f"Blocked or incomplete HTML for {movie_url}")
-                    continue
-                soup = BeautifulSoup(page.content(), "html.parser")
-                row={'movie_url':CURR_URL, 'title':None, 'release_year':None, 'movie_watched_by':None, 'movie_listed_by':None, 
-                'movie_liked_by':None,'tmdb':None, 'imdb':None, 'imdb_id':None, 'tmdb_id':None, 'rating':None, 'duration':None, 
-                'actors':None, 'director':None, 'writer':None, 'editor':None, 'cinematography':None, 'producer':None, 
-                'composer':None, 'studio':None, 'country':None,'primary_language':None, 'genres':None, 'themes':None, 
-                'first_theatrical_release':None, 'OTT_release':None, 'half_stars':None, 'one_stars':None, 'one_and_half_stars':None, 
-                'two_stars':None, 'two_and_half_stars':None, 'three_stars':None, 'three_and_half_stars':None,
-                'four_stars':None, 'four_and_half_stars':None, 'five_stars':None, 'fans_count':None
-                }
-                # Title, Release Year, Directors
-                first_container=soup.find('div', class_='col-17')
-                if first_container:
-                    details=first_container.find('div', class_='details')
+                row = None
+                if session:
+                    row = await asyncio.to_thread(scrape_movie_http, session, movie_url, logger)
+                if row is not None:
+                    fetch_counts["http"]+=1
                 else:
-                    details=None
-                if details:
-                    row['title']=extract(details.find('h1', class_='headline-1'))
-                    row['release_year']=extract(details.find('span', class_='releasedate'))
-                    row['director']=extract(details.find('span', class_='creatorlist'))
-
-                #Duration, IMDB, TMDB
-                second_container=soup.find('p', class_='text-link text-footer')
-                duration_text=extract(second_container)
-                if duration_text:
-                    fetch_imdb_tmdb(duration_text, second_container, row)
-                
-                #actors
-                info_section=soup.find('div', id='tabbed-content')
-                if not info_section:
-                    logger.warning(f"No tabbed-content found for {CURR_URL}")
-                else:
-                    actors_tab=info_section.find('div', id='tab-cast')
-                    if actors_tab:
-                        actors=actors_tab.find_all('a', class_='text-slug')
-                        row['actors']=', '.join(extract(a) for a in actors[:-1] if extract(a))
-                #producers, writers, editors, cinematographers, composers
-                TARGET_ROLES={
-                    'Writer': 'writer',
-                    'Editor': 'editor',
-                    'Cinematography': 'cinematography',
-                    'Producer': 'producer',
-                    'Composer': 'composer'
-                }
-                crew_name='tab-crew'
-                crew_class='crewrole -full'
-                fetch_info_section(info_section, row, TARGET_ROLES,crew_name, crew_class)
-                
-                #studio, countries, primary_language
-                TARGET_DETAILS={
-                    'Studio':'studio',
-                    'Country':'country',
-                    'Language':'primary_language'
-                }
-                detail_name='tab-details'
-                fetch_info_section(info_section, row, TARGET_DETAILS,detail_name)
-            
-                #genres, themes
-                TARGET_GENRES={
-                    'Genres':'genres',
-                    'Themes':'themes'
-                }
-                genre_name='tab-genres'
-                fetch_info_section(info_section, row, TARGET_GENRES,genre_name)
-                
-                #first_theatrical_release
-                TARGET_DATE={
-                    'Theatrical':'first_theatrical_release',
-                    'Digital':'OTT_release'
-                }
-                release_tab=info_section.find('div', id='tab-releases') if info_section else None
-                if release_tab:
-                    for h3 in release_tab.find_all('h3'):
-                        if not h3:
-                            continue
-                        date_text=extract(h3)
-                        normalized_date=None
-                        for raw, normalized in TARGET_DATE.items():
-                            if raw.lower() == date_text.lower():
-                                normalized_date=normalized
-                                break
-                        if not normalized_date:
-                            continue
-                        div=h3.find_next_sibling('div', class_='release-table -bydate')
-                        if not div:
-                            continue
-                        first_div=div.find('div', class_='listitem')
-                        if not first_div:
-                            continue
-                        date_h5=first_div.find('h5', class_='date')
-                        if not date_h5:
-                            continue
-                        row[normalized_date]=extract(date_h5)
-                if not release_tab:
-                    logger.warning(f"No releases tab found for {CURR_URL}")
-                    
-                #Ratings Breakdown
-                #fetch_ratings(BASE_URL, soup, row, context)
-                fetch_ratings(soup, row)
-
-                #likes, watched, listed
-                # fetch_stats(BASE_URL, soup, row, context)
-                fetch_stats(soup, row)
-
-                buffer_df.append(row)
-                seen_movie_data.add(CURR_URL)
-                logger.info(f"Completed Page URL: {CURR_URL}")
-                context.set_default_navigation_timeout(45000)
-                context.set_default_timeout(30000)
+                    row = await scrape_movie_async(page, movie_url, logger)
+                    if row is not None:
+                        fetch_counts["browser"]+=1
+                if cold_start:
+                    cold_start.page_loaded()
             except Exception as e:
-                logger.error(f"Error processing URL: {CURR_URL} with error: {e}")
-                print("Terminating due to error.")
+                logger.error(f"Error processing URL: {movie_url} with error: {e}")
                 traceback.print_exc()
-            count+=1
-            if len(buffer_df) >= 100:
-                flush_to_disk(buffer_df, output_movie_data)
-                mark_completed(checkpoint, movie_url)
-                print(f'Flushed data to disk after processing {count} URLs.')
-    if buffer_df:
-        flush_to_disk(buffer_df, output_movie_data)
-        mark_completed(checkpoint, "COMPLETED")
-        print(f'Final flush to disk after processing {count} URLs.')
-        print('Scraping completed.')
+                row = None
+            await results.put((movie_url, row))
+    finally:
+        await page.close()
 
-        browser.close()
+async def movie_writer(results, output_movie_data, store, logger, flush_interval=None, on_flush=None,
+                       coverage=None, stop=None):
+    """
+    Single consumer of scraped rows, so the output CSV is never interleaved.
+    Flushes every FLUSH_SIZE rows, or sooner once `flush_interval` seconds
+    have passed since the last flush; `on_flush` is called with the number of
+    rows written by each flush. Nothing more is written once `stop` is set.
+    """
+    buffer_df=ColumnBuffer('movie_data')
+    failed=[]
+    count=0
+    last_flush=time.monotonic()
+    while True:
+        item = await results.get()
+        if item is None:
+            break
+        movie_url, row = item
+        count+=1
+        if row is not None:
+            buffer_df.append(row)
+            logger.info(f"Completed Page URL: {movie_url}")
+        else:
+            failed.append(movie_url)
+        if stop is not None and stop.is_set():
+            continue
+        overdue = flush_interval is not None and buffer_df and time.monotonic() - last_flush >= flush_interval
+        if len(buffer_df) >= FLUSH_SIZE or overdue:
+            if on_flush:
+                on_flush(len(buffer_df))
+            flush_movies(buffer_df, output_movie_data, store, failed, coverage)
+            last_flush=time.monotonic()
+            print(f'Flushed data to disk after processing {count} URLs.')
+    if stop is not None and stop.is_set():
+        return
+    if on_flush and buffer_df:
+        on_flush(len(buffer_df))
+    flush_movies(buffer_df, output_movie_data, store, failed, coverage)
+    print(f'Final flush to disk after processing {count} URLs.')
+
+async def feed_work_queue(store, work_queue, workers, by_priority=False, stop=None):
+    """Claim pending URLs from the state store in batches and hand them to the workers."""
+    while stop is None or not stop.is_set():
+        batch = store.claim(STATE_STEP, FLUSH_SIZE, by_priority)
+        if not batch:
+            break
+        for movie_url in batch:
+            await work_queue.put(movie_url)
+    for _ in range(workers):
+        await work_queue.put(None)
+
+async def extract_movie_data_pool(store, output_movie_data, workers, logger, session=None,
+                                  fetch_counts=None, block_resources=False, headless=None, cold_start=None,
+                                  by_priority=False, coverage=None, stop=None):
+    """
+    Scrape movie pages with `workers` pages open at once in the same logged-in
+    context, fed from the pending URLs in the state store.
+    """
+    work_queue = asyncio.Queue(maxsize=workers * 2)
+    results = asyncio.Queue()
+
+    async with async_playwright() as p:
+        browser, context = await new_context_async(p, headless)
+        resource_stats = await install_resource_blocking_async(context) if block_resources else None
+        context.set_default_navigation_timeout(45000)
+        context.set_default_timeout(30000)
+        writer = asyncio.create_task(movie_writer(results, output_movie_data, store, logger, coverage=coverage,
+                                                  stop=stop))
+        await asyncio.gather(feed_work_queue(store, work_queue, workers, by_priority, stop), *(
+            movie_worker(context, work_queue, results, logger, session, fetch_counts, cold_start)
+            for _ in range(workers)
+        ))
+        await results.put(None)
+        await writer
+        if resource_stats:
+            # Pages share one context here, so only the per-page average is meaningful.
+            resource_stats.pages = fetch_counts["browser"] if fetch_counts else 0
+            print(resource_stats.summary())
+            logger.info(resource_stats.summary())
+        await context.close()
+        await browser.close()
 
 if __name__ == "__main__":
-    CHECKPOINT_MOVIE_DATA='Movie_data_checkpoint.txt'
+    STATE_DB='state.sqlite3'
     OUTPUT_FILE_MOVIE_URL='Output_movie_url.csv'
     OUTPUT_FILE_MOVIE_DATA='Output_movie_data.csv'
-    extract_movie_data(OUTPUT_FILE_MOVIE_URL, OUTPUT_FILE_MOVIE_DATA, CHECKPOINT_MOVIE_DATA)
\ No newline at end of file
+    extract_movie_data(OUTPUT_FILE_MOVIE_URL, OUTPUT_FILE_MOVIE_DATA, STATE_DB)
\ No newline at end of file
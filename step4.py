@@ -1,11 +1,28 @@
 from step1_list import list_url_extraction
 from step2_movie_list_playwright import extract_movie_urls_from_list
 from step3_movie_data_playwright import extract_movie_data
+from pipeline import run_streaming_pipeline
+from browser_session import BrowserSession
+from login import ensure_login
 import config
+import metrics
+from output_sink import compact_parquet, is_parquet, iter_table, read_table, source_mark
+from state_store import StateStore
+import argparse
+import io
+import itertools
+import json
 import logging
 import pandas as pd
 import os
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
 def setup_logger(name, log_file):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
@@ -25,81 +42,358 @@ def setup_logger(name, log_file):
     return logger
 
 
-def merge_outputs(list_file, movie_list_file, movie_data_file, final_output_file):
+# Rough in-memory size of one list/movie edge row (three URL-ish strings).
+EDGE_ROW_BYTES = 300
+
+def load_dimension(path, key):
+    """
+    Load a lookup table indexed by `key`. Repetitive text columns become
+    categoricals and integer columns nullable, so the table stays compact and
+    every merged chunk formats numbers the same way.
+    """
+    df = read_table(path)
+    if df[key].duplicated().any():
+        raise pd.errors.MergeError(f"Merge keys are not unique in {path}; not a many-to-one merge")
+    df = df.set_index(key)
+    for col in df.columns:
+        if df[col].dtype == object and df[col].nunique() < len(df) // 2:
+            df[col] = df[col].astype("category")
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col].astype("Int64")
+    return df
+
+def merge_chunk_rows(df_lists, df_movies, memory_budget):
+    """Edge rows per chunk so that the lookups plus one chunk in flight fit in `memory_budget` bytes."""
+    lookup_bytes = df_lists.memory_usage(deep=True).sum() + df_movies.memory_usage(deep=True).sum()
+    row_bytes = EDGE_ROW_BYTES
+    for df in (df_lists, df_movies):
+        if len(df):
+            row_bytes += df.memory_usage(deep=True).sum() / len(df)
+    available = memory_budget - lookup_bytes
+    if available < memory_budget // 4:
+        logging.warning(
+            f"Merge lookups take {lookup_bytes / 2**20:.0f} MiB of the "
+            f"{memory_budget / 2**20:.0f} MiB budget; edges are merged in small chunks."
+        )
+        available = memory_budget // 4
+    # The edge chunk, its merged copy and the serialized output are alive at once.
+    return max(1000, int(available // (3 * row_bytes)))
+
+def parquet_schema(frame):
+    """Arrow schema for the merged frame; all-null text columns are typed as strings."""
+    schema = pa.Schema.from_pandas(frame.head(0), preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.string()))
+    return schema
+
+def merge_outputs(list_file, movie_list_file, movie_data_file, final_output_file,
+                  memory_budget_mb=512, pending_file=None):
+    """
+    Join the list-movie edges with the movie and list tables.
+    Only the two lookup tables are held in memory; the edge table is streamed
+    in chunks sized from `memory_budget_mb` and each merged chunk is appended
+    to a temporary output that replaces `final_output_file` at the end.
+    With `pending_file`, edges whose movie is not scraped yet are written
+    there instead of being merged with empty movie columns.
+    """
     if not (os.path.exists(list_file) and
             os.path.exists(movie_list_file) and
             os.path.exists(movie_data_file)):
         raise FileNotFoundError("One or more input files missing")
 
-    df_lists = pd.read_csv(list_file)
-    df_movie_lists = pd.read_csv(movie_list_file)
-    df_movies = pd.read_csv(movie_data_file)
+    df_lists = load_dimension(list_file, "list_url")
+    df_movies = load_dimension(movie_data_file, "movie_url")
+    chunk_rows = merge_chunk_rows(df_lists, df_movies, memory_budget_mb * 2**20)
 
-    merged_movies = df_movie_lists.merge(
-        df_movies,
-        on="movie_url",
-        how="left",
-        validate="many_to_one" 
-    )
+    tmp_file = final_output_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    writer = None
+    rows = 0
+    try:
+        for edges in iter_table(movie_list_file, chunk_rows):
+            if pending_file:
+                edges = hold_back(edges, df_movies, pending_file)
+            merged = edges.join(df_movies, on="movie_url").join(df_lists, on="list_url")
+            if is_parquet(final_output_file):
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_file, parquet_schema(merged), compression="zstd")
+                writer.write_table(pa.Table.from_pandas(merged, schema=writer.schema, preserve_index=False))
+            else:
+                merged.to_csv(tmp_file, mode="a", header=rows == 0, index=False)
+            rows += len(merged)
+    finally:
+        if writer is not None:
+            writer.close()
+    if not rows:
+        # Header only: every edge was held back, and writing them here would merge them twice.
+        edges = next(iter_table(movie_list_file, 1), pd.DataFrame(columns=["list_url", "movie_url"]))
+        empty = edges.head(0).join(df_movies, on="movie_url").join(df_lists, on="list_url")
+        if is_parquet(final_output_file):
+            empty.to_parquet(tmp_file, index=False)
+        else:
+            empty.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, final_output_file)
+    logging.info(f"Final merged dataset ({rows} rows, {chunk_rows} per chunk) written to {final_output_file}")
+
+def hold_back(edges, df_movies, pending_file):
+    """Append edges whose movie is missing from `df_movies` to `pending_file`; return the rest."""
+    scraped = edges["movie_url"].isin(df_movies.index)
+    if not scraped.all():
+        edges[~scraped].to_csv(pending_file, mode="a", header=not os.path.exists(pending_file), index=False)
+    return edges[scraped]
+
+def load_merge_state(state_file):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file) as f:
+        return json.load(f)
+
+def save_merge_state(state_file, state):
+    parent = os.path.dirname(state_file)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_file + ".tmp", state_file)
+
+def pending_path(state_file, generation):
+    return f"{state_file}.pending-{generation}.csv"
+
+def delta_blocker(state, movie_list_file, movie_data_file, final_output_file):
+    """Why the last merge cannot be extended with a delta, or None if it can."""
+    if state is None:
+        return "no merge state yet"
+    if not os.path.exists(final_output_file) or os.path.getsize(final_output_file) < state["final_size"]:
+        return "final output is missing or shorter than recorded"
+    for key, path in (("edges", movie_list_file), ("movies", movie_data_file)):
+        mark = state["sources"][key]
+        if os.path.getsize(path) < mark["offset"] or source_mark(path, mark["offset"]) != mark:
+            return f"{path} was rewritten since the last merge"
+    return None
+
+def rebuild_merge(list_file, movie_list_file, movie_data_file, final_output_file, state_file,
+                  memory_budget_mb=512):
+    """Full merge that starts a new incremental history (the fallback for merge_incremental)."""
+    if is_parquet(final_output_file):
+        print("Full merge: the incremental merge only tracks CSV outputs.")
+        merge_outputs(list_file, movie_list_file, movie_data_file, final_output_file, memory_budget_mb)
+        return
+    state = load_merge_state(state_file)
+    generation = state["generation"] + 1 if state else 1
+    sources = {"edges": source_mark(movie_list_file), "movies": source_mark(movie_data_file)}
+    pending_file = pending_path(state_file, generation)
+    if os.path.exists(pending_file):
+        os.remove(pending_file)
+    merge_outputs(list_file, movie_list_file, movie_data_file, final_output_file,
+                  memory_budget_mb, pending_file=pending_file)
+    save_merge_state(state_file, {
+        "generation": generation,
+        "sources": sources,
+        "final_size": os.path.getsize(final_output_file),
+        "pending": pending_file if os.path.exists(pending_file) else None,
+    })
+    if state and state.get("pending") and os.path.exists(state["pending"]):
+        os.remove(state["pending"])
+
+def iter_new_rows(path, offset, end, chunksize):
+    """Rows of a CSV appended between byte offsets `offset` and `end`."""
+    with open(path, "rb") as f:
+        columns = pd.read_csv(io.BytesIO(f.readline()), nrows=0).columns
+        f.seek(offset)
+        delta = f.read(end - offset)
+    if delta:
+        yield from pd.read_csv(io.BytesIO(delta), names=columns, header=None, chunksize=chunksize)
+
+def merge_incremental(list_file, movie_list_file, movie_data_file, final_output_file, state_file,
+                      memory_budget_mb=512):
+    """
+    Append to the final dataset only what changed since the last merge:
+    edges added to the edge file after its recorded byte offset, plus held-back
+    edges whose movie has been scraped since. Edges whose movie is still
+    missing stay held back for the next run. Falls back to rebuild_merge when
+    an input was rewritten rather than appended to.
+    """
+    if not (os.path.exists(list_file) and
+            os.path.exists(movie_list_file) and
+            os.path.exists(movie_data_file)):
+        raise FileNotFoundError("One or more input files missing")
+
+    state = None if is_parquet(final_output_file) else load_merge_state(state_file)
+    reason = delta_blocker(state, movie_list_file, movie_data_file, final_output_file)
+    if reason:
+        print(f"Full merge: {reason}.")
+        rebuild_merge(list_file, movie_list_file, movie_data_file, final_output_file, state_file,
+                      memory_budget_mb)
+        return
+
+    df_lists = load_dimension(list_file, "list_url")
+    df_movies = load_dimension(movie_data_file, "movie_url")
+    columns = list(pd.read_csv(movie_list_file, nrows=0).columns) + list(df_movies.columns) + list(df_lists.columns)
+    if list(pd.read_csv(final_output_file, nrows=0).columns) != columns:
+        print("Full merge: the final output columns changed.")
+        rebuild_merge(list_file, movie_list_file, movie_data_file, final_output_file, state_file,
+                      memory_budget_mb)
+        return
+    chunk_rows = merge_chunk_rows(df_lists, df_movies, memory_budget_mb * 2**20)
+    sources = {"edges": source_mark(movie_list_file), "movies": source_mark(movie_data_file)}
+
+    # Roll back rows appended by a run that crashed before saving its state.
+    with open(final_output_file, "r+b") as f:
+        f.truncate(state["final_size"])
 
-    final_df = merged_movies.merge(
-        df_lists,
-        on="list_url",
-        how="left",
-        validate="many_to_one"
+    generation = state["generation"] + 1
+    pending_file = pending_path(state_file, generation)
+    if os.path.exists(pending_file):
+        os.remove(pending_file)
+    chunks = iter_new_rows(
+        movie_list_file, state["sources"]["edges"]["offset"], sources["edges"]["offset"], chunk_rows
     )
+    if state.get("pending"):
+        chunks = itertools.chain(iter_table(state["pending"], chunk_rows), chunks)
+    rows = 0
+    for edges in chunks:
+        edges = hold_back(edges, df_movies, pending_file)
+        merged = edges.join(df_movies, on="movie_url").join(df_lists, on="list_url")
+        merged.to_csv(final_output_file, mode="a", header=False, index=False)
+        rows += len(merged)
 
-    final_df.to_csv(final_output_file, index=False)
-    logging.info(f"Final merged dataset written to {final_output_file}")
+    save_merge_state(state_file, {
+        "generation": generation,
+        "sources": sources,
+        "final_size": os.path.getsize(final_output_file),
+        "pending": pending_file if os.path.exists(pending_file) else None,
+    })
+    if state.get("pending") and os.path.exists(state["pending"]):
+        os.remove(state["pending"])
+    logging.info(f"Incremental merge appended {rows} rows to {final_output_file}")
+    print(f"Incremental merge appended {rows} rows.")
 
-def is_step_complete(checkpoint_file):
-    """Checks if the checkpoint file contains the 'COMPLETED' flag."""
-    if os.path.exists(checkpoint_file):
-        with open(checkpoint_file, 'r') as f:
-            return f.read().strip() == "COMPLETED"
-    return False
+def is_step_complete(step):
+    """Checks if the state store has the step flagged as completed."""
+    store = StateStore(config.STATE_DB)
+    try:
+        return store.is_step_complete(step)
+    finally:
+        store.close()
 
-def main():
-    if not is_step_complete(config.CHECKPOINT_LIST):
+def output_paths():
+    """(lists, movie_list, movie_data, final) output paths for config.OUTPUT_FORMAT."""
+    if config.OUTPUT_FORMAT == "parquet":
+        return (config.LISTS_URL_PARQUET, config.MOVIE_LIST_PARQUET,
+                config.MOVIE_DATA_PARQUET, config.FINAL_OUTPUT_PARQUET)
+    return (config.LISTS_URL_CSV, config.MOVIE_LIST_CSV,
+            config.MOVIE_DATA_CSV, config.FINAL_OUTPUT_CSV)
+
+def compact_output(path):
+    if is_parquet(path) and os.path.isdir(path):
+        compact_parquet(path)
+
+def run_staged(lists_output, movie_list_output, movie_data_output):
+    if not is_step_complete("step1"):
         print("Starting Step 1...")
         logger1 = setup_logger("step1", "logs/step1.log")
         list_url_extraction(
-            output_file=config.LISTS_URL_CSV,
-            checkpoint=config.CHECKPOINT_LIST
+            output_file=lists_output,
+            state_db=config.STATE_DB,
+            fetch_mode=config.STEP1_FETCH_MODE,
+            concurrency=config.STEP1_CONCURRENCY
         )
+        compact_output(lists_output)
     else:
         print("Step 1: Skipped (Already Completed)")
 
-    if not is_step_complete(config.CHECKPOINT_MOVIE_URL):
-        print("Starting Step 2...")
-        logger2 = setup_logger("step2", "logs/step2.log")
-        extract_movie_urls_from_list(
-            input_lists=config.LISTS_URL_CSV,
-            output_movies=config.MOVIE_LIST_CSV,
-            checkpoint=config.CHECKPOINT_MOVIE_URL
-        )
-    else:
-        print("Step 2: Skipped (Already Completed)")
-
-    if not is_step_complete(config.CHECKPOINT_MOVIE_DATA):
-        print("Starting Step 3...")
-        logger3 = setup_logger("step3", "logs/step3.log")
-        extract_movie_data(
-            input_movie_urls=config.MOVIE_LIST_CSV,
-            output_movie_data=config.MOVIE_DATA_CSV,
-            checkpoint=config.CHECKPOINT_MOVIE_DATA
-        )
+    # Steps 2 and 3 open their contexts in one browser, launched when first needed.
+    if not (is_step_complete("step2") and is_step_complete("step3")):
+        ensure_login()
+    with BrowserSession() as browser_session:
+        if not is_step_complete("step2"):
+            print("Starting Step 2...")
+            logger2 = setup_logger("step2", "logs/step2.log")
+            extract_movie_urls_from_list(
+                input_lists=lists_output,
+                output_movies=movie_list_output,
+                state_db=config.STATE_DB,
+                block_resources=config.BLOCK_RESOURCES,
+                browser_session=browser_session,
+                workers=config.STEP2_PAGE_WORKERS
+            )
+            compact_output(movie_list_output)
+        else:
+            print("Step 2: Skipped (Already Completed)")
+
+        if not is_step_complete("step3"):
+            print("Starting Step 3...")
+            logger3 = setup_logger("step3", "logs/step3.log")
+            extract_movie_data(
+                input_movie_urls=movie_list_output,
+                output_movie_data=movie_data_output,
+                state_db=config.STATE_DB,
+                workers=config.STEP3_WORKERS,
+                fetch_mode=config.STEP3_FETCH_MODE,
+                block_resources=config.BLOCK_RESOURCES,
+                browser_session=browser_session,
+                order=config.STEP3_ORDER,
+                lists_file=lists_output
+            )
+            compact_output(movie_data_output)
+        else:
+            print("Step 3: Skipped (Already Completed)")
+
+def run_streaming(lists_output, movie_list_output, movie_data_output):
+    if is_step_complete("step3"):
+        print("Steps 1-3: Skipped (Already Completed)")
+        return
+    print("Starting streaming pipeline (Steps 1-3)...")
+    setup_logger("step1", "logs/step1.log")
+    setup_logger("step2", "logs/step2.log")
+    setup_logger("step3", "logs/step3.log")
+    setup_logger("pipeline", "logs/pipeline.log")
+    run_streaming_pipeline(
+        lists_output, movie_list_output, movie_data_output, config.STATE_DB,
+        list_workers=config.STEP2_WORKERS,
+        list_pages=config.STEP2_PAGE_WORKERS,
+        movie_workers=config.STEP3_WORKERS,
+        fetch_mode=config.STEP3_FETCH_MODE,
+        concurrency=config.STEP1_CONCURRENCY,
+        block_resources=config.BLOCK_RESOURCES,
+        flush_interval=config.STREAM_FLUSH_SECONDS
+    )
+    for output in (lists_output, movie_list_output, movie_data_output):
+        compact_output(output)
+
+def main(merge_mode=None):
+    metrics.start()
+    lists_output, movie_list_output, movie_data_output, final_output = output_paths()
+    if config.PIPELINE_MODE == "streaming":
+        run_streaming(lists_output, movie_list_output, movie_data_output)
     else:
-        print("Step 3: Skipped (Already Completed)")
+        run_staged(lists_output, movie_list_output, movie_data_output)
 
     print("Starting Merge...")
-    merge_outputs(
-    list_file=config.LISTS_URL_CSV,
-    movie_list_file=config.MOVIE_LIST_CSV,
-    movie_data_file=config.MOVIE_DATA_CSV,
-    final_output_file=config.FINAL_OUTPUT_CSV
-    )
+    merge = {
+        "full": merge_outputs,
+        "rebuild": rebuild_merge,
+        "incremental": merge_incremental,
+    }[merge_mode or config.MERGE_MODE]
+    extra = {} if merge is merge_outputs else {"state_file": config.MERGE_STATE}
+    with metrics.timer("step4", "merge"):
+        merge(
+        list_file=lists_output,
+        movie_list_file=movie_list_output,
+        movie_data_file=movie_data_output,
+        final_output_file=final_output,
+        memory_budget_mb=config.MERGE_MEMORY_BUDGET_MB,
+        **extra
+        )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the scraping pipeline and merge its outputs")
+    parser.add_argument(
+        "--merge", choices=["full", "rebuild", "incremental"],
+        help="Merge mode (default: config.MERGE_MODE); 'rebuild' resets the incremental merge"
+    )
+    args = parser.parse_args()
+    main(merge_mode=args.merge)